@@ -0,0 +1,119 @@
+"""
+User, room and storage totals for the admin dashboard.
+
+Each entity is counted with a single aggregate query (conditional counts
+instead of one ``COUNT`` per figure, a grouped membership subquery
+instead of correlated ``EXISTS`` per room, and the blob and upload
+aggregates cross-joined as two one-row subqueries). Results are kept for
+``ADMIN_STATS_TTL`` seconds and dropped by the admin actions that change
+them, so reloading the dashboard does not rescan the tables.
+"""
+
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import case, func, select, true
+
+from app import db
+
+
+class AdminStats:
+    """Process-wide TTL cache of the dashboard totals"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def users(self):
+        """total_users, admin_users, banned_users, active_users"""
+        return self._cached('users', self._count_users)
+
+    def rooms(self):
+        """total_rooms, active_rooms (any approved member), empty_rooms (no members)"""
+        return self._cached('rooms', self._count_rooms)
+
+    def storage(self):
+        """videos, stored_blobs, released_blobs, stored_bytes, uploaded_bytes, saved_bytes"""
+        return self._cached('storage', self._count_storage)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _cached(self, key, load):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+        stats = load()
+        with self._lock:
+            self._entries[key] = (now + current_app.config.get('ADMIN_STATS_TTL', 60), stats)
+        return stats
+
+    @staticmethod
+    def _count_users():
+        from models import User
+
+        total, admins, banned, active = db.session.execute(select(
+            func.count(User.id),
+            func.count(case((User.is_admin == True, 1))),
+            func.count(case((User.is_banned == True, 1))),
+            func.count(case((User.is_banned == False, 1))),
+        )).one()
+        return {
+            'total_users': total,
+            'admin_users': admins,
+            'banned_users': banned,
+            'active_users': active,
+        }
+
+    @staticmethod
+    def _count_rooms():
+        from models import Room, RoomMember
+
+        # One row per room that has members, flagging whether any is approved
+        memberships = select(RoomMember.room_id,
+                             func.max(case((RoomMember.is_approved == True, 1), else_=0)).label('approved'))\
+            .group_by(RoomMember.room_id).subquery()
+        total, active, empty = db.session.execute(
+            select(func.count(Room.id),
+                   func.count(case((memberships.c.approved == 1, 1))),
+                   func.count(case((memberships.c.room_id.is_(None), 1))))
+            .select_from(Room).outerjoin(memberships, memberships.c.room_id == Room.id)
+        ).one()
+        return {
+            'total_rooms': total,
+            'active_rooms': active,
+            'empty_rooms': empty,
+        }
+
+    @staticmethod
+    def _count_storage():
+        from models import VideoBlob, VideoFile
+
+        blobs = select(func.count(VideoBlob.id).label('count'),
+                       func.coalesce(func.sum(VideoBlob.size), 0).label('bytes'),
+                       func.count(case((VideoBlob.ref_count <= 0, 1))).label('released')).subquery()
+        uploads = select(func.count(VideoFile.id).label('count'),
+                         func.coalesce(func.sum(VideoFile.file_size), 0).label('bytes'),
+                         # Uploads from before content-addressed storage have a file each
+                         func.coalesce(func.sum(case((VideoFile.blob_id.is_(None), VideoFile.file_size))), 0)
+                         .label('unshared_bytes')).subquery()
+        row = db.session.execute(select(blobs, uploads.c.count.label('videos'),
+                                        uploads.c.bytes.label('uploaded_bytes'),
+                                        uploads.c.unshared_bytes)
+                                 .select_from(blobs.join(uploads, true()))).one()
+        stored_bytes = row.bytes + row.unshared_bytes
+        return {
+            'videos': row.videos,
+            'stored_blobs': row.count,
+            'released_blobs': row.released,
+            'stored_bytes': stored_bytes,
+            'uploaded_bytes': row.uploaded_bytes,
+            'saved_bytes': max(row.uploaded_bytes - stored_bytes, 0),
+        }
+
+
+admin_stats = AdminStats()
@@ -6,7 +6,6 @@ from flask_login import LoginManager
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
-from datetime import datetime
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -16,170 +15,347 @@ class Base(DeclarativeBase):
 
 db = SQLAlchemy(model_class=Base)
 
-# create the app
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET")
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1) # needed for url_for to generate with https
-
-# configure the database, relative to the app instance folder
-database_url = os.environ.get("DATABASE_URL", "sqlite:///app.db")
-if database_url.startswith("postgres://"):
-    database_url = database_url.replace("postgres://", "postgresql://", 1)
-app.config["SQLALCHEMY_DATABASE_URI"] = database_url
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-
-# File upload configuration
-app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max file size
-app.config['UPLOAD_FOLDER'] = 'uploads'
-
-# Initialize Flask-Login
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
-login_manager.login_message = 'Please log in to access this page.'
+socketio = SocketIO()
 
-# initialize the app with the extension, flask-sqlalchemy >= 3.0.x
-db.init_app(app)
 
-# Initialize Socket.IO
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+def config_from_env():
+    """Settings read from the environment (see the Readme for each variable)"""
+    config = {}
+    config['SECRET_KEY'] = os.environ.get("SESSION_SECRET", "fallback_key")
+    
+    # configure the database, relative to the app instance folder
+    database_url = os.environ.get("DATABASE_URL", "sqlite:///app.db")
+    if database_url.startswith("postgres://"):
+        database_url = database_url.replace("postgres://", "postgresql://", 1)
+    config["SQLALCHEMY_DATABASE_URI"] = database_url
+    config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_recycle": 300,
+        "pool_pre_ping": True,
+    }
+    # Green-thread servers run far more handlers per process than there are
+    # database connections, so the pool can be capped explicitly
+    if os.environ.get("DB_POOL_SIZE"):
+        config["SQLALCHEMY_ENGINE_OPTIONS"]["pool_size"] = int(os.environ["DB_POOL_SIZE"])
+        config["SQLALCHEMY_ENGINE_OPTIONS"]["max_overflow"] = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+    config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+
+    # File upload configuration
+    config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max file size
+    config['UPLOAD_FOLDER'] = os.environ.get("UPLOAD_FOLDER", "uploads")
+    # Chunked uploads: bytes the browser sends per PUT, and seconds an unfinished upload is kept
+    config['UPLOAD_CHUNK_SIZE'] = int(os.environ.get("UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024))
+    config['UPLOAD_SESSION_TTL'] = float(os.environ.get("UPLOAD_SESSION_TTL", 24 * 3600))
+    # Upload quotas in MB: videos held by one room and uploaded by one user (0 = unlimited)
+    config['STORAGE_ROOM_QUOTA_MB'] = float(os.environ.get("STORAGE_ROOM_QUOTA_MB", 2048))
+    config['STORAGE_USER_QUOTA_MB'] = float(os.environ.get("STORAGE_USER_QUOTA_MB", 10240))
+    # Storage sweep every N seconds (0 disables), N rows per transaction; uploads a room has
+    # moved on from expire after N seconds (0 keeps them); files younger than N seconds are never removed
+    config['STORAGE_SWEEP_INTERVAL'] = float(os.environ.get("STORAGE_SWEEP_INTERVAL", 3600))
+    config['STORAGE_SWEEP_BATCH'] = int(os.environ.get("STORAGE_SWEEP_BATCH", 100))
+    config['STORAGE_REPLACED_AFTER'] = float(os.environ.get("STORAGE_REPLACED_AFTER", 24 * 3600))
+    config['STORAGE_ORPHAN_GRACE'] = float(os.environ.get("STORAGE_ORPHAN_GRACE", 3600))
+    # Uploaded videos streamed at once per process (0 = no limit); further viewers get 503
+    config['VIDEO_MAX_STREAMS'] = int(os.environ.get("VIDEO_MAX_STREAMS", 32))
+    # Hand video transfers to the front server: "x-accel" (nginx) or "x-sendfile" (Apache/lighttpd)
+    config['VIDEO_OFFLOAD'] = os.environ.get("VIDEO_OFFLOAD", "").lower() or None
+    config['VIDEO_ACCEL_PREFIX'] = os.environ.get("VIDEO_ACCEL_PREFIX", "/protected-uploads/")
+    # Prefetch hints sent with joins, video changes and seeks: seconds of video from the target keyframe,
+    # capped at N MB per range (0 disables the hints)
+    config['VIDEO_PREFETCH_SECONDS'] = float(os.environ.get("VIDEO_PREFETCH_SECONDS", 10))
+    config['VIDEO_PREFETCH_MAX_MB'] = float(os.environ.get("VIDEO_PREFETCH_MAX_MB", 8))
+
+    # Playback state is kept in memory and written back to the rooms table every N seconds
+    config['PLAYBACK_FLUSH_INTERVAL'] = float(os.environ.get("PLAYBACK_FLUSH_INTERVAL", 5))
+    # Control broadcasts are scheduled this far ahead so every viewer can act at the same instant
+    config['PLAYBACK_LEAD_MS'] = float(os.environ.get("PLAYBACK_LEAD_MS", 250))
+    # Seconds between sync_tick broadcasts to each active room (0 disables them)
+    config['SYNC_TICK_INTERVAL'] = float(os.environ.get("SYNC_TICK_INTERVAL", 5))
+    # Host commands arriving within this many ms of a broadcast are merged into one (0 disables)
+    config['CONTROL_COALESCE_MS'] = float(os.environ.get("CONTROL_COALESCE_MS", 150))
+
+    # Seconds a room + membership lookup is served from memory by the /room/... routes (0 disables)
+    config['ROOM_CONTEXT_TTL'] = float(os.environ.get("ROOM_CONTEXT_TTL", 30))
+
+    # Identity records behind current_user are cached this many seconds (0 disables), up to N users
+    config['USER_CACHE_TTL'] = float(os.environ.get("USER_CACHE_TTL", 30))
+    config['USER_CACHE_SIZE'] = int(os.environ.get("USER_CACHE_SIZE", 10000))
+
+    # Admin dashboard user/room totals are recomputed at most this often, in seconds (0 disables)
+    config['ADMIN_STATS_TTL'] = float(os.environ.get("ADMIN_STATS_TTL", 60))
+
+    # Chat retention: messages older than N days, or beyond the newest N of a room, move to
+    # the archive table every INTERVAL seconds, BATCH per transaction (0 disables each)
+    config['CHAT_MAX_AGE_DAYS'] = float(os.environ.get("CHAT_MAX_AGE_DAYS", 30))
+    config['CHAT_ROOM_CAP'] = int(os.environ.get("CHAT_ROOM_CAP", 1000))
+    config['CHAT_RETENTION_INTERVAL'] = float(os.environ.get("CHAT_RETENTION_INTERVAL", 600))
+    config['CHAT_RETENTION_BATCH'] = int(os.environ.get("CHAT_RETENTION_BATCH", 500))
+
+    # Chat inserts are group-committed: queued up to N ms (0 writes each message on its own)
+    # or N messages, then written with one multi-row INSERT
+    config['CHAT_BATCH_MS'] = float(os.environ.get("CHAT_BATCH_MS", 5))
+    config['CHAT_BATCH_SIZE'] = int(os.environ.get("CHAT_BATCH_SIZE", 100))
+
+    # Socket.IO server mode: threading, eventlet or gevent (green modes are
+    # monkey-patched by main.py before this module is imported)
+    config['SOCKETIO_ASYNC_MODE'] = os.environ.get("SOCKETIO_ASYNC_MODE", "threading")
+
+    # Message queue shared by every worker/node so broadcasts reach sockets held by
+    # other processes (redis://, kafka://, zmq+tcp://, amqp://; local:// = in-process)
+    config['SOCKETIO_MESSAGE_QUEUE'] = os.environ.get("SOCKETIO_MESSAGE_QUEUE") or None
+    # With several workers, in-memory room state not written by this process is
+    # re-read from the database after this many seconds (defaults to the flush interval)
+    config['STATE_REPLICA_TTL'] = (float(os.environ.get("STATE_REPLICA_TTL", config['PLAYBACK_FLUSH_INTERVAL']))
+                                   if config['SOCKETIO_MESSAGE_QUEUE'] else None)
+    # Engine.IO transports the client may use; websocket-only needs no sticky sessions
+    web_concurrency = int(os.environ.get("WEB_CONCURRENCY", 1))
+    config['SOCKETIO_TRANSPORTS'] = os.environ.get(
+        "SOCKETIO_TRANSPORTS", "websocket" if web_concurrency > 1 else "polling,websocket").split(',')
+    return config
+
+
+def create_app(config=None):
+    """Build the app; ``config`` overrides settings read from the environment.
+    
+    Nothing here touches the database: tables, migrations and the admin
+    account are set up once per deploy by ``python init_db.py``.
+    """
+    app = Flask(__name__)
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1) # needed for url_for to generate with https
+    app.config.update(config_from_env())
+    app.config.update(config or {})
+    
+    # Initialize Flask-Login
+    login_manager.init_app(app)
+    login_manager.login_view = 'main.login'
+    login_manager.login_message = 'Please log in to access this page.'
+    
+    # initialize the app with the extension, flask-sqlalchemy >= 3.0.x
+    db.init_app(app)
+    
+    # Initialize Socket.IO
+    socketio_options = {}
+    if app.config['SOCKETIO_MESSAGE_QUEUE'] and app.config['SOCKETIO_MESSAGE_QUEUE'].startswith('local://'):
+        from socket_queue import LocalManager
+        # The extension is shared, so a previous app's manager would keep listening
+        if isinstance(getattr(socketio.server, 'manager', None), LocalManager):
+            socketio.server.manager.close()
+        socketio_options['client_manager'] = LocalManager(app.config['SOCKETIO_MESSAGE_QUEUE'])
+    elif app.config['SOCKETIO_MESSAGE_QUEUE']:
+        socketio_options['message_queue'] = app.config['SOCKETIO_MESSAGE_QUEUE']
+    socketio.init_app(app, cors_allowed_origins="*", async_mode=app.config['SOCKETIO_ASYNC_MODE'],
+                      **socketio_options)
+    
+    from routes import bp
+    app.register_blueprint(bp)
+    return app
 
 @login_manager.user_loader
 def load_user(user_id):
-    from models import User
-    return User.query.get(int(user_id))
+    from user_cache import user_cache
+    
+    user = user_cache.get(int(user_id))
+    # Banned users are treated as logged out from their next request on
+    if user is None or user.is_banned:
+        return None
+    return user
 
 # Socket.IO event handlers
+def broadcast_member_left(result, removed=False):
+    """Tell a room that a member went offline or was removed"""
+    from presence import presence_registry
+    
+    room_code, user_id, went_offline = result
+    if went_offline or removed:
+        presence, _ = presence_registry.get_member(room_code, user_id)
+        payload = {'user_id': user_id, 'removed': removed}
+        if presence is not None:
+            payload.update(presence_registry.counts(presence))
+        socketio.emit('member_left', payload, to=room_code)
+
+def evict_sockets(sids, room_code):
+    """Stop room broadcasts to sockets whose membership just ended"""
+    for sid in sids:
+        socketio.server.leave_room(sid, room_code, namespace='/')
+
 @socketio.on('connect')
 def handle_connect():
     """Handle client connection"""
+    from flask_login import current_user
+    from presence import presence_registry
+    
+    user_id = current_user.id if current_user.is_authenticated else None
+    presence_registry.connect(request.sid, user_id)
     print(f'Client connected: {request.sid}')
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """Handle client disconnection"""
+    from presence import presence_registry
+    
+    result = presence_registry.disconnect(request.sid)
+    if result:
+        broadcast_member_left(result)
     print(f'Client disconnected: {request.sid}')
 
+def room_session(host_only=False):
+    """Cached session of the calling socket, or an error payload for the acknowledgement"""
+    from presence import presence_registry
+    
+    session = presence_registry.session(request.sid)
+    if session is None:
+        return None, {'error': 'Not in a room'}
+    if host_only and not session.is_host:
+        return None, {'error': 'Only the host can control playback'}
+    return session, None
+
 @socketio.on('join_room')
-def handle_join_room(data):
-    """Handle client joining a room"""
-    room_code = data.get('room_code')
-    if room_code:
-        join_room(room_code)
-        print(f'Client {request.sid} joined room: {room_code}')
+def handle_join_room(data=None):
+    """Authenticate the socket for a room once and cache its session"""
+    from presence import presence_registry
+    
+    room_code = ((data or {}).get('room_code') or '').upper()
+    if not room_code:
+        return {'error': 'Room code is required'}
+    
+    presence, info, came_online = presence_registry.join(request.sid, room_code)
+    if info is None:
+        return {'error': 'Not authorized'}
+    
+    from playback import playback_store
+    
+    state = playback_store.get(room_code)
+    if state is None:
+        # Deleted while this worker's room context still had it cached
+        presence_registry.leave(request.sid)
+        return {'error': 'Room not found'}
+    
+    join_room(room_code)
+    print(f'Client {request.sid} joined room: {room_code}')
+    
+    counts = presence_registry.counts(presence)
+    if came_online:
+        emit('member_joined', dict(counts, member=info.to_dict(online=True)),
+             room=room_code, include_self=False)
+    
+    # The joining client gets the member list and playback state in the acknowledgement
+    from chat_retention import chat_retention
+    from storage_sweeper import storage_sweeper
+    
+    playback_store.start_ticker()
+    chat_retention.ensure_started()
+    storage_sweeper.ensure_started()
+    snapshot = state.snapshot()
+    if snapshot['video_type'] == 'local':
+        from video_index import video_indexer
+        snapshot.update(video_indexer.hints(snapshot['video_url'], snapshot['position'], header=True) or {})
+    return dict(counts,
+                members=presence_registry.member_list(presence),
+                playback=snapshot)
+
+@socketio.on('time_sync')
+def handle_time_sync(data=None):
+    """NTP-style clock probe: echo the client's send time with the server time"""
+    from playback import server_time_ms
+    
+    return {'t0': (data or {}).get('t0'), 'server_time': server_time_ms()}
 
 @socketio.on('leave_room')
-def handle_leave_room(data):
+def handle_leave_room(data=None):
     """Handle client leaving a room"""
-    room_code = data.get('room_code')
+    from presence import presence_registry
+    
+    room_code = ((data or {}).get('room_code') or '').upper()
     if room_code:
         leave_room(room_code)
+        result = presence_registry.leave(request.sid)
+        if result:
+            broadcast_member_left(result)
         print(f'Client {request.sid} left room: {room_code}')
 
 @socketio.on('change_video')
-def handle_change_video(data):
+def handle_change_video(data=None):
     """Handle video change from host and broadcast to all users in room"""
-    room_code = data.get('room_code')
+    session, error = room_session(host_only=True)
+    if error:
+        return error
+    
+    data = data or {}
     video_url = data.get('video_url')
     video_type = data.get('video_type')
-    user_id = data.get('user_id')
     
-    if room_code and video_url and video_type:
-        # Update room state in database
-        from models import Room
-        from routes import current_user
+    if video_url and video_type:
+        # Update in-memory room state (persisted by the playback flusher)
+        from playback import playback_store
+        
+        state = playback_store.change_video(session.room_code, video_url, video_type)
+        if state is None:
+            return {'error': 'Room not found'}
+        payload = {
+            'video_url': video_url,
+            'video_type': video_type,
+            'changed_by': session.user_id
+        }
+        if video_type == 'local':
+            # Duration and the byte ranges a player reads first, for indexed uploads
+            from video_index import video_indexer
+            payload.update(video_indexer.hints(video_url, 0, header=True) or {})
         
-        room = Room.query.filter_by(room_code=room_code.upper()).first()
-        if room:
-            room.current_video_url = video_url
-            room.current_video_type = video_type
-            room.current_video_time = 0
-            room.is_playing = False
-            room.last_sync_time = datetime.now()
-            db.session.commit()
-            
-            # Broadcast video change to all users in the room
-            emit('video_changed', {
-                'video_url': video_url,
-                'video_type': video_type,
-                'changed_by': user_id
-            }, room=room_code, include_self=False)
-            
-            print(f'Video changed in room {room_code}: {video_type} - {video_url}')
+        # Broadcast video change to all users in the room
+        emit('video_changed', payload, room=session.room_code, include_self=False)
+        
+        print(f'Video changed in room {session.room_code}: {video_type} - {video_url}')
 
 @socketio.on('video_control')
-def handle_video_control(data):
+def handle_video_control(data=None):
     """Handle video control (play/pause/seek) from host and broadcast to all users"""
-    room_code = data.get('room_code')
+    session, error = room_session(host_only=True)
+    if error:
+        return error
+    
+    data = data or {}
     action = data.get('action')
     time = data.get('time', 0)
-    user_id = data.get('user_id')
     
-    if room_code and action:
-        # Update room state in database
-        from models import Room
-        from datetime import datetime
-        
-        room = Room.query.filter_by(room_code=room_code.upper()).first()
-        if room:
-            if action == 'play':
-                room.is_playing = True
-            elif action == 'pause':
-                room.is_playing = False
-            elif action == 'seek':
-                room.current_video_time = time
-            
-            room.current_video_time = time
-            room.last_sync_time = datetime.now()
-            db.session.commit()
-            
-            # Broadcast video control to all users in the room
-            emit('video_control_update', {
-                'action': action,
-                'time': time,
-                'controlled_by': user_id
-            }, room=room_code, include_self=False)
-            
-            print(f'Video control in room {room_code}: {action} at {time}s')
-
-with app.app_context():
-    # Make sure to import the models here or their tables won't be created
-    import models  # noqa: F401
-    db.create_all()
-    logging.info("Database tables created")
-    
-    # Auto-create admin user if it doesn't exist
-    from models import User
-    admin_user = User.query.filter_by(is_admin=True).first()
-    if not admin_user:
-        # Get admin credentials from environment variables
-        admin_username = os.environ.get("ADMIN_USERNAME", "admin")
-        admin_password = os.environ.get("ADMIN_PASSWORD", "admin123")
-        admin_email = os.environ.get("ADMIN_EMAIL", "admin@watchwithme.com")
-        admin_first_name = os.environ.get("ADMIN_FIRST_NAME", "Admin")
-        admin_last_name = os.environ.get("ADMIN_LAST_NAME", "User")
+    if action in ('play', 'pause', 'seek', 'heartbeat'):
+        # Update in-memory room state (persisted by the playback flusher)
+        from playback import playback_store
         
-        admin = User()
-        admin.username = admin_username
-        admin.email = admin_email
-        admin.first_name = admin_first_name
-        admin.last_name = admin_last_name
-        admin.is_admin = True
-        admin.is_banned = False
-        admin.set_password(admin_password)
+        state = playback_store.control(session.room_code, action, time)
+        if state is None:
+            return {'error': 'Room not found'}
         
-        db.session.add(admin)
-        db.session.commit()
-        logging.info(f"Admin user created: {admin_username}/[password from env]")
-    else:
-        # Reset admin password to environment variable value
-        admin_password = os.environ.get("ADMIN_PASSWORD", "admin123")
-        admin_user.set_password(admin_password)
-        db.session.commit()
-        logging.info("Admin password reset from environment variable")
-
+        # Heartbeats only refresh the authoritative position; viewers follow
+        # it through sync_tick. Commands go through the coalescing window.
+        if action != 'heartbeat':
+            playback_store.broadcast_control(session.room_code, action, state.video_time,
+                                             session.user_id, skip_sid=request.sid)
+            print(f'Video control in room {session.room_code}: {action} at {time}s')
+        return {'success': True}
+    
+    return {'error': 'Invalid action'}
 
+@socketio.on('send_message')
+def handle_send_message(data=None):
+    """Store a chat message and broadcast it to everyone in the room"""
+    from chat_writer import chat_writer
+    
+    session, error = room_session()
+    if error:
+        return error
+    
+    message_text = ((data or {}).get('message') or '').strip()
+    if not message_text:
+        return {'error': 'Message cannot be empty'}
+    
+    # Committed together with whatever else was sent in the same few milliseconds
+    try:
+        message = chat_writer.save(session.room_id, session.user_id, message_text)
+    except Exception:
+        logging.exception("Error saving chat message")
+        return {'error': 'Message could not be saved'}
+    payload = message.to_dict(session.display_name)
+    
+    # The sender gets the message through the acknowledgement
+    emit('new_message', payload, room=session.room_code, include_self=False)
+    return payload
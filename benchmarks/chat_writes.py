@@ -0,0 +1,124 @@
+"""
+Chat write throughput benchmark.
+
+Sends bursts of chat messages from many concurrent senders through
+``chat_writer.save`` (the call behind both send paths), once with every
+message committed on its own (``CHAT_BATCH_MS=0``) and once per batch
+window, and reports messages per second and per-message latency.
+
+    python benchmarks/chat_writes.py --senders 50 --messages 40 --windows 0,2,5,10
+
+Uses a throwaway SQLite database unless ``--database-url`` points somewhere
+else (e.g. a scratch PostgreSQL database; its chat_messages rows are left behind).
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compare direct and group-committed chat inserts')
+    parser.add_argument('--senders', type=int, default=50, help='concurrent senders')
+    parser.add_argument('--messages', type=int, default=40, help='messages per sender')
+    parser.add_argument('--rooms', type=int, default=5, help='rooms the senders are spread over')
+    parser.add_argument('--windows', default='0,2,5,10', help='CHAT_BATCH_MS values to compare (0 = no batching)')
+    parser.add_argument('--database-url', default=None)
+    return parser.parse_args()
+
+
+args = parse_args()
+os.environ['DATABASE_URL'] = args.database_url or 'sqlite:///' + os.path.join(
+    tempfile.mkdtemp(prefix='watchwithme-chat-'), 'app.db')
+os.environ.setdefault('SESSION_SECRET', 'chat-writes')
+
+from app import create_app, db
+from chat_writer import ChatWriter
+from models import Room, User
+
+app = create_app()
+
+
+def seed(rooms):
+    with app.app_context():
+        host = User.query.filter_by(username='chat-bench').first()
+        if host is None:
+            host = User(username='chat-bench', email='chat-bench@example.com', password_hash='-')
+            db.session.add(host)
+            db.session.flush()
+        room_ids = []
+        for i in range(rooms):
+            room = Room(room_code=Room.generate_room_code(), name=f'Chat bench {i}', host_id=host.id)
+            db.session.add(room)
+            db.session.flush()
+            room_ids.append(room.id)
+        db.session.commit()
+        return host.id, room_ids
+
+
+def run(window_ms, user_id, room_ids):
+    app.config['CHAT_BATCH_MS'] = window_ms
+    writer = ChatWriter()  # a fresh writer picks up the window
+    latencies = []
+    errors = []
+    start_gate = threading.Barrier(args.senders + 1)
+
+    def sender(index):
+        room_id = room_ids[index % len(room_ids)]
+        with app.app_context():
+            start_gate.wait()
+            for n in range(args.messages):
+                sent = time.perf_counter()
+                try:
+                    writer.save(room_id, user_id, f'message {n} from sender {index}')
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                latencies.append(time.perf_counter() - sent)
+            db.session.remove()
+
+    threads = [threading.Thread(target=sender, args=(i,)) for i in range(args.senders)]
+    for thread in threads:
+        thread.start()
+    start_gate.wait()
+    began = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - began
+
+    latencies.sort()
+    return {
+        'rate': len(latencies) / elapsed,
+        'p50': statistics.median(latencies) * 1000 if latencies else 0,
+        'p95': latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else 0,
+        'errors': len(errors),
+    }
+
+
+def main():
+    with app.app_context():
+        db.create_all()
+    user_id, room_ids = seed(args.rooms)
+    windows = [float(window) for window in args.windows.split(',')]
+
+    print(f'{args.senders} senders x {args.messages} messages over {args.rooms} rooms')
+    print(f"{'batch window':<14}{'msg/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'errors':>8}")
+    baseline = None
+    for window in windows:
+        result = run(window, user_id, room_ids)
+        label = 'none' if not window else f'{window:g} ms'
+        if baseline is None:
+            baseline = result['rate']
+        print(f"{label:<14}{result['rate']:>10.0f}{result['p50']:>10.1f}{result['p95']:>10.1f}"
+              f"{result['errors']:>8}   x{result['rate'] / baseline:.1f}")
+
+
+if __name__ == '__main__':
+    main()
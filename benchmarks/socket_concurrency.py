@@ -0,0 +1,178 @@
+"""
+Concurrent room connection benchmark.
+
+Starts the app once per Socket.IO async mode, opens an increasing number of
+socket connections to a single room and measures how long a host's
+``video_control`` broadcast takes to reach every viewer. For each mode it
+reports the largest connection count whose p95 broadcast latency stays
+under the threshold.
+
+    python benchmarks/socket_concurrency.py --modes threading,eventlet --steps 50,100,200,400
+
+The benchmark's own clients run as eventlet green threads and use
+``requests`` and ``websocket-client`` (``pip install -r requirements-dev.txt``;
+``--transport polling`` works with just ``requests``). Each server gets a
+throwaway SQLite database.
+"""
+
+import eventlet
+eventlet.monkey_patch()
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import requests
+import socketio
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_server(mode, port, workdir):
+    env = dict(os.environ,
+               SOCKETIO_ASYNC_MODE=mode,
+               PORT=str(port),
+               DATABASE_URL=f"sqlite:///{os.path.join(workdir, f'bench-{mode}.db')}",
+               SESSION_SECRET='benchmark',
+               SYNC_TICK_INTERVAL='0',
+               FLASK_ENV='production')
+    env.pop('SOCKETIO_MESSAGE_QUEUE', None)
+    log = open(os.path.join(workdir, f'server-{mode}.log'), 'w')
+    process = subprocess.Popen([sys.executable, 'main.py'], cwd=ROOT, env=env,
+                               stdout=log, stderr=subprocess.STDOUT)
+    base_url = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            requests.get(base_url + '/login', timeout=1)
+            return process, base_url
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'{mode} server did not start (see {log.name})')
+
+
+def create_room(base_url):
+    """Register a throwaway host and create a room; returns (cookie header, room code)"""
+    http = requests.Session()
+    username = f'bench_{uuid.uuid4().hex[:8]}'
+    http.post(base_url + '/register', data={'username': username,
+                                            'email': f'{username}@example.com',
+                                            'password': 'benchmark'})
+    response = http.post(base_url + '/create-room', data={'room_name': 'Benchmark'},
+                         allow_redirects=False)
+    room_code = response.headers['Location'].rstrip('/').rsplit('/', 1)[-1]
+    cookie = '; '.join(f'{name}={value}' for name, value in http.cookies.items())
+    return cookie, room_code
+
+
+class Viewer:
+    def __init__(self, base_url, cookie, room_code, transport):
+        self.received = {}
+        self.client = socketio.Client(reconnection=False)
+        self.client.on('video_control_update', self.on_update)
+        self.client.connect(base_url, headers={'Cookie': cookie},
+                            transports=[transport], wait_timeout=30)
+        self.client.call('join_room', {'room_code': room_code}, timeout=30)
+
+    def on_update(self, data):
+        self.received[data['time']] = time.perf_counter()
+
+
+def measure(base_url, cookie, room_code, viewers, transport, rounds):
+    """Broadcast ``rounds`` seeks from a host socket; returns per-viewer latencies in ms"""
+    host = Viewer(base_url, cookie, room_code, transport)
+    latencies = []
+    missed = 0
+    try:
+        for round_number in range(rounds):
+            marker = time.time() + round_number  # unique seek position per round
+            sent = time.perf_counter()
+            host.client.emit('video_control', {'room_code': room_code, 'action': 'seek',
+                                               'time': marker})
+            deadline = sent + 10
+            while time.perf_counter() < deadline and any(marker not in v.received for v in viewers):
+                eventlet.sleep(0.01)
+            for viewer in viewers:
+                if marker in viewer.received:
+                    latencies.append((viewer.received[marker] - sent) * 1000)
+                else:
+                    missed += 1
+            eventlet.sleep(0.2)
+    finally:
+        host.client.disconnect()
+    return latencies, missed
+
+
+def run_mode(mode, port, steps, args, workdir):
+    process, base_url = start_server(mode, port, workdir)
+    results = []
+    viewers = []
+    try:
+        cookie, room_code = create_room(base_url)
+        for target in steps:
+            pool = eventlet.GreenPool(100)
+            try:
+                viewers.extend(pool.imap(lambda _: Viewer(base_url, cookie, room_code, args.transport),
+                                         range(target - len(viewers))))
+            except Exception as e:
+                results.append((target, None, None, None, f'connect failed: {e}'))
+                break
+            latencies, missed = measure(base_url, cookie, room_code, viewers,
+                                        args.transport, args.rounds)
+            if latencies:
+                p50 = statistics.median(latencies)
+                p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0]
+                results.append((target, p50, p95, max(latencies), f'{missed} missed' if missed else ''))
+            else:
+                results.append((target, None, None, None, 'no deliveries'))
+            if missed or not latencies or p95 > args.threshold_ms:
+                break
+    finally:
+        for viewer in viewers:
+            try:
+                viewer.client.disconnect()
+            except Exception:
+                pass
+        process.terminate()
+        process.wait(timeout=30)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--modes', default='threading,eventlet',
+                        help='comma-separated async modes to compare')
+    parser.add_argument('--steps', default='50,100,200,400,800,1600',
+                        help='comma-separated connection counts')
+    parser.add_argument('--rounds', type=int, default=5, help='broadcasts per step')
+    parser.add_argument('--threshold-ms', type=float, default=250,
+                        help='p95 broadcast latency considered degraded')
+    parser.add_argument('--transport', default='websocket', choices=['websocket', 'polling'])
+    parser.add_argument('--port', type=int, default=5100)
+    args = parser.parse_args()
+
+    steps = [int(step) for step in args.steps.split(',')]
+    workdir = tempfile.mkdtemp(prefix='watchwithme-bench-')
+    for offset, mode in enumerate(args.modes.split(',')):
+        results = run_mode(mode, args.port + offset, steps, args, workdir)
+        print(f'\n{mode}')
+        print(f"{'sockets':>8} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}  note")
+        held = 0
+        for target, p50, p95, worst, note in results:
+            if p95 is None:
+                print(f'{target:>8} {"-":>8} {"-":>8} {"-":>8}  {note}')
+                continue
+            print(f'{target:>8} {p50:>8.1f} {p95:>8.1f} {worst:>8.1f}  {note}')
+            if p95 <= args.threshold_ms and not note:
+                held = target
+        print(f'{mode}: {held} connections held under {args.threshold_ms:.0f} ms p95')
+    print(f'\nServer logs: {workdir}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Cold start benchmark.
+
+Measures, in fresh interpreters, how long ``import main`` (imports plus
+``create_app()``) takes and how many database connections it opens, then
+how long a gunicorn worker takes from spawn to serving its first request.
+Both matter for autoscaling: a new instance is useless until it answers.
+
+    python benchmarks/startup_time.py --runs 5
+
+Uses a throwaway SQLite database, bootstrapped once with init_db.py
+beforehand so the timings never include table creation.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_PROBE = """
+import json, time
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+connections = []
+event.listen(Pool, 'connect', lambda *args: connections.append(1))
+started = time.perf_counter()
+import main
+print(json.dumps({'seconds': time.perf_counter() - started, 'connections': len(connections)}))
+"""
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def time_import(env):
+    output = subprocess.run([sys.executable, '-c', IMPORT_PROBE], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def time_first_response(env):
+    """Seconds from starting gunicorn to the first 200 from /login"""
+    port = free_port()
+    env = dict(env, PORT=str(port), WEB_CONCURRENCY='1')
+    started = time.perf_counter()
+    process = subprocess.Popen(['gunicorn', '-c', 'gunicorn.conf.py', 'main:app'], cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < 60:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/login', timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.02)
+        raise RuntimeError('gunicorn did not answer within 60s')
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure import and worker spawn time')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='watchwithme-startup-')
+    env = dict(os.environ,
+               DATABASE_URL='sqlite:///' + os.path.join(workdir, 'app.db'),
+               SESSION_SECRET='startup',
+               SOCKETIO_ASYNC_MODE='threading')
+    env.pop('SOCKETIO_MESSAGE_QUEUE', None)
+    subprocess.run([sys.executable, 'init_db.py'], cwd=ROOT, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    imports = [time_import(env) for _ in range(args.runs)]
+    print(f"import main + create_app: median {statistics.median(i['seconds'] for i in imports) * 1000:.0f} ms, "
+          f"database connections opened: {max(i['connections'] for i in imports)}")
+
+    if shutil.which('gunicorn'):
+        spawns = [time_first_response(env) for _ in range(args.runs)]
+        print(f"gunicorn spawn to first response: median {statistics.median(spawns) * 1000:.0f} ms, "
+              f"max {max(spawns) * 1000:.0f} ms")
+    else:
+        print('gunicorn not installed; skipping the spawn measurement')
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
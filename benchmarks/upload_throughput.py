@@ -0,0 +1,206 @@
+"""
+Video upload benchmark.
+
+Uploads the same file through the multipart ``/upload-video`` endpoint and
+through the chunked upload protocol (start, PUT chunks, finalize), each
+against a freshly started server, and reports throughput plus, from
+``/proc``, the server's peak resident memory and the bytes it wrote. The
+multipart path is spooled to a temporary file by Werkzeug and then copied
+into the upload folder, so it writes the video twice; chunked uploads are
+written once. The ``duplicate`` row uploads the file once more after a first
+upload, hashing it client-side first as the browser does for files up to
+64 MB, so the server finds the content and stores nothing; "stored MB" is the upload folder's size
+afterwards.
+
+    python benchmarks/upload_throughput.py --size-mb 200 --chunk-mb 8
+
+Linux only (reads /proc); needs ``requests`` (``pip install -r
+requirements-dev.txt``). Each server gets a throwaway SQLite database and
+upload folder.
+"""
+
+import argparse
+import hashlib
+import io
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class MultipartBody:
+    """File-like multipart/form-data body that streams the video from disk"""
+
+    def __init__(self, path, boundary):
+        head = (f'--{boundary}\r\nContent-Disposition: form-data; name="video"; '
+                f'filename="{os.path.basename(path)}"\r\nContent-Type: video/mp4\r\n\r\n').encode()
+        tail = f'\r\n--{boundary}--\r\n'.encode()
+        self._length = len(head) + os.path.getsize(path) + len(tail)
+        self._parts = [io.BytesIO(head), open(path, 'rb'), io.BytesIO(tail)]
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        while self._parts:
+            block = self._parts[0].read(size if size and size > 0 else 1024 * 1024)
+            if block:
+                return block
+            self._parts.pop(0).close()
+        return b''
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def proc_stats(pid):
+    """(peak RSS in bytes, bytes passed to write()) for a running process"""
+    with open(f'/proc/{pid}/status') as f:
+        peak = next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmHWM:'))
+    with open(f'/proc/{pid}/io') as f:
+        written = next(int(line.split()[1]) for line in f if line.startswith('wchar:'))
+    return peak, written
+
+
+def start_server(workdir, name):
+    port = free_port()
+    env = dict(os.environ,
+               PORT=str(port),
+               DATABASE_URL='sqlite:///' + os.path.join(workdir, f'{name}.db'),
+               UPLOAD_FOLDER=os.path.join(workdir, f'uploads-{name}'),
+               SESSION_SECRET='benchmark',
+               SOCKETIO_ASYNC_MODE='threading',
+               SYNC_TICK_INTERVAL='0',
+               FLASK_ENV='production')
+    env.pop('SOCKETIO_MESSAGE_QUEUE', None)
+    log = open(os.path.join(workdir, f'server-{name}.log'), 'w')
+    process = subprocess.Popen([sys.executable, 'main.py'], cwd=ROOT, env=env,
+                               stdout=log, stderr=subprocess.STDOUT)
+    base_url = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            requests.get(base_url + '/login', timeout=1)
+            return process, base_url
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'server did not start (see {log.name})')
+
+
+def create_room(base_url):
+    """Register a throwaway host and create a room; returns (session, room code)"""
+    http = requests.Session()
+    username = f'bench_{uuid.uuid4().hex[:8]}'
+    http.post(base_url + '/register', data={'username': username,
+                                            'email': f'{username}@example.com',
+                                            'password': 'benchmark'})
+    response = http.post(base_url + '/create-room', data={'room_name': 'Benchmark'},
+                         allow_redirects=False)
+    return http, response.headers['Location'].rstrip('/').rsplit('/', 1)[-1]
+
+
+def upload_multipart(http, base_url, room_code, path, chunk_size):
+    boundary = uuid.uuid4().hex
+    response = http.post(f'{base_url}/room/{room_code}/upload-video',
+                         data=MultipartBody(path, boundary),
+                         headers={'Content-Type': f'multipart/form-data; boundary={boundary}'})
+    response.raise_for_status()
+
+
+def upload_chunked(http, base_url, room_code, path, chunk_size):
+    size = os.path.getsize(path)
+    response = http.post(f'{base_url}/room/{room_code}/uploads',
+                         json={'filename': os.path.basename(path), 'size': size})
+    response.raise_for_status()
+    upload_url = f"{base_url}/room/{room_code}/uploads/{response.json()['upload_id']}"
+    offset = 0
+    with open(path, 'rb') as f:
+        while offset < size:
+            response = http.put(f'{upload_url}?offset={offset}', data=f.read(chunk_size))
+            response.raise_for_status()
+            offset = response.json()['offset']
+    http.post(upload_url + '/finalize', json={}).raise_for_status()
+
+
+def upload_duplicate(http, base_url, room_code, path, chunk_size):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2 ** 20), b''):
+            hasher.update(block)
+    response = http.post(f'{base_url}/room/{room_code}/uploads',
+                         json={'filename': 'again.mp4', 'size': os.path.getsize(path),
+                               'sha256': hasher.hexdigest()})
+    response.raise_for_status()
+    if not response.json().get('deduplicated'):
+        raise RuntimeError('the server did not recognise the content')
+
+
+def folder_size(folder):
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(folder) for name in names)
+
+
+def measure(name, upload, workdir, path, chunk_size, first_upload=None):
+    process, base_url = start_server(workdir, name)
+    try:
+        http, room_code = create_room(base_url)
+        if first_upload:
+            first_upload(http, base_url, room_code, path, chunk_size)
+        baseline_peak, baseline_written = proc_stats(process.pid)
+        started = time.perf_counter()
+        upload(http, base_url, room_code, path, chunk_size)
+        elapsed = time.perf_counter() - started
+        peak, written = proc_stats(process.pid)
+    finally:
+        process.terminate()
+        process.wait()
+    return {
+        'seconds': elapsed,
+        'rate': os.path.getsize(path) / elapsed / 2 ** 20,
+        'peak': peak / 2 ** 20,
+        'growth': (peak - baseline_peak) / 2 ** 20,
+        'written': (written - baseline_written) / 2 ** 20,
+        'stored': folder_size(os.path.join(workdir, f'uploads-{name}')) / 2 ** 20,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare multipart and chunked video uploads')
+    parser.add_argument('--size-mb', type=int, default=200, help='size of the uploaded file')
+    parser.add_argument('--chunk-mb', type=int, default=8, help='chunk size for chunked uploads')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='watchwithme-upload-')
+    path = os.path.join(workdir, 'bench.mp4')
+    with open(path, 'wb') as f:
+        for _ in range(args.size_mb):
+            f.write(os.urandom(2 ** 20))
+
+    try:
+        print(f'{args.size_mb} MB file, {args.chunk_mb} MB chunks')
+        print(f"{'path':<12}{'seconds':>9}{'MB/s':>8}{'peak RSS MB':>14}{'RSS growth MB':>16}"
+              f"{'written MB':>13}{'stored MB':>12}")
+        runs = (('multipart', upload_multipart, None),
+                ('chunked', upload_chunked, None),
+                ('duplicate', upload_duplicate, upload_chunked))
+        for name, upload, first_upload in runs:
+            result = measure(name, upload, workdir, path, args.chunk_mb * 2 ** 20, first_upload)
+            print(f"{name:<12}{result['seconds']:>9.2f}{result['rate']:>8.0f}{result['peak']:>14.0f}"
+                  f"{result['growth']:>16.0f}{result['written']:>13.0f}{result['stored']:>12.0f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+Video container indexing benchmark.
+
+Writes a long MP4 (``moov`` after the media data, as most encoders leave
+it) and a WebM with its cues after the clusters, both as sparse files so
+they take no real disk space, then indexes each with ``video_index`` and
+reports the time taken, how many bytes were read (from ``/proc``), the
+number of keyframes kept and the size of the stored table. Indexing only
+reads container metadata, so the bytes read stay in the hundreds of KB
+however large the file is.
+
+    python benchmarks/video_index.py --hours 2 --fps 30 --gop 2
+
+Linux only (reads /proc).
+"""
+
+import argparse
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from video_index import index_file  # noqa: E402
+
+
+def box(kind, *payload):
+    body = b''.join(payload)
+    return struct.pack('>I4s', 8 + len(body), kind) + body
+
+
+def full_box(kind, *payload):
+    return box(kind, b'\0\0\0\0', *payload)
+
+
+def write_mp4(path, seconds, fps, gop_seconds):
+    """Progressive MP4 with one H.264 track, 30 samples per chunk and co64 offsets"""
+    count = int(seconds * fps)
+    gop = max(int(gop_seconds * fps), 1)
+    sizes = [150000 if i % gop == 0 else 12000 + i % 4000 for i in range(count)]
+    per_chunk = 30
+    ftyp = box(b'ftyp', b'isom', struct.pack('>I', 512), b'isomavc1')
+    mdat_start = len(ftyp) + 16
+    chunks, offset = [], mdat_start
+    for first in range(0, count, per_chunk):
+        chunks.append(offset)
+        offset += sum(sizes[first:first + per_chunk])
+
+    timescale = fps * 1000
+    sync = list(range(1, count + 1, gop))
+    visual = b'\0' * 6 + struct.pack('>H', 1) + b'\0' * 16 + struct.pack('>HH', 1920, 1080) + b'\0' * 50
+    stbl = box(b'stbl',
+               full_box(b'stsd', struct.pack('>I', 1),
+                        box(b'avc1', visual, box(b'avcC', bytes([1, 0x64, 0, 0x28, 0xff, 0xe1])))),
+               full_box(b'stts', struct.pack('>III', 1, count, 1000)),
+               full_box(b'stss', struct.pack(f'>I{len(sync)}I', len(sync), *sync)),
+               full_box(b'stsc', struct.pack('>IIII', 1, 1, per_chunk, 1)),
+               full_box(b'stsz', struct.pack(f'>II{count}I', 0, count, *sizes)),
+               full_box(b'co64', struct.pack(f'>I{len(chunks)}Q', len(chunks), *chunks)))
+    mdia = box(b'mdia',
+               full_box(b'mdhd', struct.pack('>IIIIHH', 0, 0, timescale, count * 1000, 0, 0)),
+               full_box(b'hdlr', b'\0' * 4, b'vide', b'\0' * 12, b'video\0'),
+               box(b'minf', stbl))
+    trak = box(b'trak', full_box(b'tkhd', struct.pack('>IIII', 0, 0, 1, 0), b'\0' * 64), mdia)
+    moov = box(b'moov', full_box(b'mvhd', struct.pack('>IIII', 0, 0, 1000, int(seconds * 1000)),
+                                 b'\0' * 80), trak)
+    with open(path, 'wb') as f:
+        f.write(ftyp + struct.pack('>I4sQ', 1, b'mdat', offset - len(ftyp)))
+        f.seek(offset)
+        f.write(moov)
+
+
+def ebml_size(size):
+    return ((1 << 56) | size).to_bytes(8, 'big')
+
+
+def element(element_id, *payload):
+    body = b''.join(payload)
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, 'big') + ebml_size(len(body)) + body
+
+
+def uint_element(element_id, value):
+    return element(element_id, value.to_bytes(8, 'big'))
+
+
+def write_webm(path, seconds, cluster_seconds):
+    """WebM with a SeekHead, one VP9 track, sparse clusters and cues at the end"""
+    ebml = element(0x1A45DFA3, element(0x4282, b'webm'))
+    info = element(0x1549A966, uint_element(0x2AD7B1, 1000000),
+                   element(0x4489, struct.pack('>d', seconds * 1000.0)))
+    tracks = element(0x1654AE6B, element(0xAE, uint_element(0xD7, 1), uint_element(0x83, 1),
+                                         element(0x86, b'V_VP9')))
+
+    def seek_head(position):
+        return element(0x114D9B74, element(0x4DBB, element(0x53AB, (0x1C53BB6B).to_bytes(4, 'big')),
+                                           uint_element(0x53AC, position)))
+
+    cluster_size = 2 * 1024 * 1024
+    positions = []
+    position = len(seek_head(0) + info + tracks)
+    for start in range(0, int(seconds), cluster_seconds):
+        positions.append((start, position))
+        position += 4 + 8 + cluster_size
+    cues = element(0x1C53BB6B, *[element(0xBB, uint_element(0xB3, start * 1000),
+                                         element(0xB7, uint_element(0xF7, 1), uint_element(0xF1, pos)))
+                                 for start, pos in positions])
+    segment_size = position + len(cues)
+    with open(path, 'wb') as f:
+        f.write(ebml + (0x18538067).to_bytes(4, 'big') + ebml_size(segment_size))
+        segment = f.tell()
+        f.write(seek_head(position) + info + tracks)
+        for _, pos in positions:
+            f.seek(segment + pos)
+            f.write((0x1F43B675).to_bytes(4, 'big') + ebml_size(cluster_size))
+        f.seek(segment + position)
+        f.write(cues)
+
+
+def bytes_read():
+    with open('/proc/self/io') as f:
+        return next(int(line.split()[1]) for line in f if line.startswith('rchar:'))
+
+
+def measure(path, repeat):
+    best = None
+    for _ in range(repeat):
+        before = bytes_read()
+        started = time.perf_counter()
+        index = index_file(path)
+        elapsed = time.perf_counter() - started
+        read = bytes_read() - before
+        if best is None or elapsed < best[0]:
+            best = (elapsed, read, index)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time pure-Python MP4/WebM indexing')
+    parser.add_argument('--hours', type=float, default=2, help='video duration')
+    parser.add_argument('--fps', type=int, default=30, help='MP4 frame rate')
+    parser.add_argument('--gop', type=float, default=2, help='seconds between keyframes')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per file (best is shown)')
+    args = parser.parse_args()
+
+    seconds = args.hours * 3600
+    workdir = tempfile.mkdtemp(prefix='watchwithme-index-')
+    try:
+        files = (('mp4', os.path.join(workdir, 'long.mp4'), write_mp4, (seconds, args.fps, args.gop)),
+                 ('webm', os.path.join(workdir, 'long.webm'), write_webm, (seconds, max(int(args.gop), 1))))
+        print(f'{args.hours:g} h of video, keyframe every {args.gop:g} s')
+        print(f"{'file':<6}{'size MB':>10}{'index ms':>10}{'read KB':>10}{'keyframes':>11}{'table KB':>10}")
+        for name, path, write, write_args in files:
+            write(path, *write_args)
+            elapsed, read, index = measure(path, args.repeat)
+            print(f'{name:<6}{os.path.getsize(path) / 2 ** 20:>10.0f}{elapsed * 1000:>10.1f}'
+                  f'{read / 1024:>10.0f}{len(index.times):>11}{len(index.table_json()) / 1024:>10.1f}')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""
+Chat retention: keeps ``chat_messages`` small by moving old messages out.
+
+A message expires once it is older than ``CHAT_MAX_AGE_DAYS`` or its room
+holds more than ``CHAT_ROOM_CAP`` newer messages. Expired user messages are
+copied into ``chat_messages_archive`` (same id) and deleted from the hot
+table; expired system messages (joins, leaves, video changes) are just
+deleted. Work happens in a background task every ``CHAT_RETENTION_INTERVAL``
+seconds, ``CHAT_RETENTION_BATCH`` messages per transaction, so no statement
+holds locks for long.
+
+Both rules always take a room's oldest messages first, so archived ids are
+lower than every id still in the hot table and history can be read as
+"hot table first, then the archive".
+"""
+
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.exc import IntegrityError
+
+from app import db, socketio
+
+
+class ChatRetention:
+    """Process-wide background mover of expired chat messages"""
+
+    def __init__(self):
+        self._app = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        """Start the background task the first time a room is used in this process"""
+        if self._app is not None:
+            return
+        with self._lock:
+            if self._app is not None:
+                return
+            self._app = current_app._get_current_object()
+        if self._app.config.get('CHAT_RETENTION_INTERVAL'):
+            socketio.start_background_task(self._loop)
+
+    def _loop(self):
+        interval = self._app.config['CHAT_RETENTION_INTERVAL']
+        while True:
+            socketio.sleep(interval)
+            with self._app.app_context():
+                try:
+                    moved = self.run()
+                    if moved:
+                        logging.info(f"Chat retention expired {moved} message(s)")
+                except Exception as e:
+                    logging.error(f"Chat retention failed: {e}")
+                finally:
+                    db.session.remove()
+
+    def run(self):
+        """Expire everything currently due, batch by batch; returns the number of messages moved"""
+        from models import ChatMessage
+
+        config = current_app.config
+        batch_size = config.get('CHAT_RETENTION_BATCH', 500)
+        batches = []
+
+        if config.get('CHAT_MAX_AGE_DAYS'):
+            cutoff = datetime.now() - timedelta(days=config['CHAT_MAX_AGE_DAYS'])
+            batches.append(lambda: self._expired_by_age(cutoff, batch_size))
+
+        if config.get('CHAT_ROOM_CAP'):
+            for room_id, last_expired_id in self._rooms_over_cap(config['CHAT_ROOM_CAP']):
+                batches.append(lambda room_id=room_id, last_expired_id=last_expired_id:
+                               db.session.execute(
+                                   select(ChatMessage.id)
+                                   .where(ChatMessage.room_id == room_id, ChatMessage.id <= last_expired_id)
+                                   .order_by(ChatMessage.id).limit(batch_size)).scalars().all())
+
+        moved = 0
+        for next_batch in batches:
+            while True:
+                ids = next_batch()
+                if not ids:
+                    break
+                if not self._archive(ids):
+                    # Another worker is expiring the same messages; leave the rest to it
+                    return moved
+                moved += len(ids)
+                socketio.sleep(0)
+        return moved
+
+    @staticmethod
+    def _expired_by_age(cutoff, batch_size):
+        from models import ChatMessage
+
+        # Ids grow with created_at, so walk the primary key from the oldest
+        # message and stop at the first one that is still young
+        rows = db.session.execute(select(ChatMessage.id, ChatMessage.created_at)
+                                  .order_by(ChatMessage.id).limit(batch_size)).all()
+        ids = []
+        for message_id, created_at in rows:
+            if created_at is not None and created_at >= cutoff:
+                break
+            ids.append(message_id)
+        return ids
+
+    @staticmethod
+    def _rooms_over_cap(cap):
+        """(room_id, id of the newest message past the cap) for every room above the cap"""
+        from models import ChatMessage
+
+        room_ids = db.session.execute(select(ChatMessage.room_id).group_by(ChatMessage.room_id)
+                                      .having(func.count(ChatMessage.id) > cap)).scalars().all()
+        expired = []
+        for room_id in room_ids:
+            last_expired_id = db.session.execute(
+                select(ChatMessage.id).where(ChatMessage.room_id == room_id)
+                .order_by(ChatMessage.id.desc()).offset(cap).limit(1)).scalar()
+            if last_expired_id is not None:
+                expired.append((room_id, last_expired_id))
+        return expired
+
+    @staticmethod
+    def _archive(ids):
+        """Move one batch: archive user messages, drop system ones, in one transaction"""
+        from models import ArchivedChatMessage, ChatMessage
+
+        columns = [ChatMessage.id, ChatMessage.room_id, ChatMessage.user_id,
+                   ChatMessage.message, ChatMessage.message_type, ChatMessage.created_at]
+        try:
+            db.session.execute(
+                insert(ArchivedChatMessage).from_select(
+                    ['id', 'room_id', 'user_id', 'message', 'message_type', 'created_at'],
+                    select(*columns).where(ChatMessage.id.in_(ids), ChatMessage.message_type != 'system')))
+            db.session.execute(delete(ChatMessage).where(ChatMessage.id.in_(ids))
+                               .execution_options(synchronize_session=False))
+            db.session.commit()
+        except IntegrityError:
+            # Another worker archived the same batch first
+            db.session.rollback()
+            return False
+        return True
+
+
+chat_retention = ChatRetention()
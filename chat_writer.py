@@ -0,0 +1,152 @@
+"""
+Group commit for chat messages.
+
+``chat_writer.save`` used by the Socket.IO and HTTP send paths does not
+insert and commit on its own. It queues the row and blocks until a single
+background writer has stored it. The writer waits ``CHAT_BATCH_MS`` after
+the first message of a burst (or until ``CHAT_BATCH_SIZE`` messages are
+queued), then writes everything from every room with one multi-row
+``INSERT ... RETURNING id`` and one commit, and hands each caller its id.
+If a batch fails (say a room was deleted mid-burst) its rows are retried
+one by one so only the bad row reports an error.
+
+With ``CHAT_BATCH_MS=0`` every message is inserted and committed directly.
+"""
+
+import logging
+import threading
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import insert
+
+from app import db, socketio
+
+
+class PendingMessage:
+    """A queued row and, once written, the stored message or the error"""
+
+    __slots__ = ('row', 'message', 'error', '_done')
+
+    def __init__(self, row):
+        self.row = row
+        self.message = None
+        self.error = None
+        self._done = threading.Event()
+
+    def resolve(self, message=None, error=None):
+        self.message = message
+        self.error = error
+        self._done.set()
+
+    def wait(self, timeout):
+        if not self._done.wait(timeout):
+            raise TimeoutError('Chat message was not written in time')
+        if self.error is not None:
+            raise self.error
+        return self.message
+
+
+class ChatWriter:
+    """Process-wide queue of chat inserts, written in batches by one background task"""
+
+    def __init__(self):
+        self._queue = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._app = None
+
+    def save(self, room_id, user_id, text, message_type='user'):
+        """Store a message and return it as a detached ChatMessage with its id"""
+        row = {
+            'room_id': room_id,
+            'user_id': user_id,
+            'message': text,
+            'message_type': message_type,
+            'created_at': datetime.now(),
+        }
+        config = current_app.config
+        if not config.get('CHAT_BATCH_MS'):
+            return self._insert_one(row)
+
+        self._ensure_started()
+        pending = PendingMessage(row)
+        with self._lock:
+            self._queue.append(pending)
+            queued = len(self._queue)
+        # Wake the writer for the first message of a burst and for a full batch
+        if queued == 1 or queued >= config.get('CHAT_BATCH_SIZE', 100):
+            self._wakeup.set()
+        return pending.wait(config.get('CHAT_WRITE_TIMEOUT', 10))
+
+    def _ensure_started(self):
+        if self._app is not None:
+            return
+        with self._lock:
+            if self._app is not None:
+                return
+            self._app = current_app._get_current_object()
+        socketio.start_background_task(self._write_loop)
+
+    def _write_loop(self):
+        window = self._app.config['CHAT_BATCH_MS'] / 1000.0
+        batch_size = self._app.config.get('CHAT_BATCH_SIZE', 100)
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            with self._lock:
+                full = len(self._queue) >= batch_size
+            if not full:
+                # Let the rest of the burst arrive, unless the batch fills first
+                self._wakeup.wait(window)
+                self._wakeup.clear()
+
+            with self._lock:
+                batch = self._queue[:batch_size]
+                del self._queue[:batch_size]
+                if self._queue:
+                    self._wakeup.set()
+            if batch:
+                with self._app.app_context():
+                    try:
+                        self._write(batch)
+                    finally:
+                        db.session.remove()
+
+    def _write(self, batch):
+        from models import ChatMessage
+
+        rows = [pending.row for pending in batch]
+        try:
+            result = db.session.execute(
+                insert(ChatMessage).returning(ChatMessage.id, sort_by_parameter_order=True), rows)
+            ids = result.scalars().all()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logging.warning(f"Chat batch of {len(batch)} failed ({e}), writing rows one by one")
+            for pending in batch:
+                try:
+                    pending.resolve(self._insert_one(pending.row))
+                except Exception as row_error:
+                    pending.resolve(error=row_error)
+            return
+
+        for pending, message_id in zip(batch, ids):
+            pending.resolve(ChatMessage(id=message_id, **pending.row))
+
+    @staticmethod
+    def _insert_one(row):
+        from models import ChatMessage
+
+        try:
+            message_id = db.session.execute(
+                insert(ChatMessage).values(**row).returning(ChatMessage.id)).scalar_one()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return ChatMessage(id=message_id, **row)
+
+
+chat_writer = ChatWriter()
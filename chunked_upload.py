@@ -0,0 +1,233 @@
+"""
+Chunked, resumable video uploads.
+
+The host's browser opens an upload (``start``) with the file name and size,
+then PUTs the file in chunks, each at the offset the server reports. Every
+chunk is read from the raw request stream in ``UPLOAD_BUFFER`` blocks and
+written straight into ``UPLOAD_FOLDER/.partial/<id>.part``, and hashed
+(SHA-256) on the way. Nothing is parsed as a form or spooled to a temp
+file, so a byte hits the disk once and memory stays at one buffer per
+request. ``finish`` hands the complete part file and its digest to
+:mod:`video_store`, which renames it into place (same filesystem, no copy)
+or drops it when the content is already stored.
+
+The upload's metadata lives next to the part file as ``<id>.json`` and the
+offset is the part file's size, so a client that lost its connection (or
+reached a different worker) asks for the offset and continues from there.
+Chunks must arrive in order (offset == bytes stored); that keeps the hash
+incremental. A process that has no running hash for an upload (another
+worker took the earlier chunks, or it restarted) re-hashes the stored
+prefix once. Part files untouched for ``UPLOAD_SESSION_TTL`` seconds are
+removed when an upload starts and by the storage sweeper.
+"""
+
+import hashlib
+import json
+import os
+import re
+import secrets
+import threading
+import time
+
+from flask import current_app
+
+# Bytes read from the request stream and written per system call
+UPLOAD_BUFFER = 1024 * 1024
+
+UPLOAD_ID = re.compile(r'^[A-Za-z0-9_-]{16,64}$')
+
+
+class OffsetMismatch(Exception):
+    """A chunk was sent for an offset other than the number of bytes stored"""
+
+    def __init__(self, offset):
+        super().__init__(f'Upload is at offset {offset}')
+        self.offset = offset
+
+
+class UploadSession:
+    """An upload in progress, as recorded in its metadata file"""
+
+    __slots__ = ('upload_id', 'room_code', 'user_id', 'filename', 'size', 'created_at', 'offset')
+
+    def __init__(self, upload_id, room_code, user_id, filename, size, created_at, offset=0):
+        self.upload_id = upload_id
+        self.room_code = room_code
+        self.user_id = user_id
+        self.filename = filename
+        self.size = size
+        self.created_at = created_at
+        self.offset = offset
+
+    def to_dict(self):
+        return {
+            'upload_id': self.upload_id,
+            'filename': self.filename,
+            'size': self.size,
+            'offset': self.offset,
+        }
+
+
+class UploadSessions:
+    """Process-wide access to the uploads in progress and their running hashes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hashers = {}  # upload_id -> (offset, sha256 of the first offset bytes)
+        self._upload_locks = {}
+
+    @staticmethod
+    def _partial_dir():
+        return os.path.join(current_app.config['UPLOAD_FOLDER'], '.partial')
+
+    def _paths(self, upload_id):
+        base = os.path.join(self._partial_dir(), upload_id)
+        return base + '.json', base + '.part'
+
+    def start(self, room_code, user_id, filename, size):
+        """Create an empty upload and return its session"""
+        os.makedirs(self._partial_dir(), exist_ok=True)
+        self.sweep()
+        session = UploadSession(secrets.token_urlsafe(18), room_code, user_id, filename, size, time.time())
+        meta_path, part_path = self._paths(session.upload_id)
+        open(part_path, 'xb').close()
+        with open(meta_path, 'w') as f:
+            json.dump({'room_code': room_code, 'user_id': user_id, 'filename': filename,
+                       'size': size, 'created_at': session.created_at}, f)
+        return session
+
+    def get(self, upload_id):
+        """Load an upload by id with its current offset, or None"""
+        if not UPLOAD_ID.match(upload_id or ''):
+            return None
+        meta_path, part_path = self._paths(upload_id)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            offset = os.path.getsize(part_path)
+        except (OSError, ValueError):
+            return None
+        return UploadSession(upload_id, offset=offset, **meta)
+
+    def write(self, session, offset, stream):
+        """Append the request body at ``offset``; returns the new offset"""
+        _, part_path = self._paths(session.upload_id)
+        with self._upload_lock(session.upload_id):
+            stored = os.path.getsize(part_path)
+            if offset != stored:
+                raise OffsetMismatch(stored)
+            hasher = self._hasher(session.upload_id, part_path, stored)
+            written = stored
+            try:
+                with open(part_path, 'ab') as f:
+                    while written < session.size:
+                        block = stream.read(min(UPLOAD_BUFFER, session.size - written))
+                        if not block:
+                            break
+                        f.write(block)
+                        hasher.update(block)
+                        written += len(block)
+                    if stream.read(1):
+                        raise ValueError('Chunk runs past the declared file size')
+            finally:
+                # Whatever reached the file counts, even if the client dropped mid-chunk
+                with self._lock:
+                    self._hashers[session.upload_id] = (written, hasher)
+            session.offset = written
+            return written
+
+    def finish(self, session):
+        """Close a complete upload; returns (part file path, sha256 hex) and the caller owns the file"""
+        meta_path, part_path = self._paths(session.upload_id)
+        with self._upload_lock(session.upload_id):
+            stored = os.path.getsize(part_path)
+            if stored != session.size:
+                raise OffsetMismatch(stored)
+            digest = self._hasher(session.upload_id, part_path, stored).hexdigest()
+            self._forget(session.upload_id, meta_path)
+        return part_path, digest
+
+    def spool(self, stream):
+        """Copy a whole stream into a new part file; returns (path, sha256 hex, size)"""
+        os.makedirs(self._partial_dir(), exist_ok=True)
+        _, part_path = self._paths(secrets.token_urlsafe(18))
+        hasher = hashlib.sha256()
+        size = 0
+        try:
+            with open(part_path, 'xb') as f:
+                while True:
+                    block = stream.read(UPLOAD_BUFFER)
+                    if not block:
+                        break
+                    f.write(block)
+                    hasher.update(block)
+                    size += len(block)
+        except BaseException:
+            self._remove(part_path)
+            raise
+        return part_path, hasher.hexdigest(), size
+
+    def discard(self, session):
+        """Abandon an upload and delete what was stored"""
+        meta_path, part_path = self._paths(session.upload_id)
+        with self._upload_lock(session.upload_id):
+            self._remove(part_path)
+            self._forget(session.upload_id, meta_path)
+
+    def _hasher(self, upload_id, part_path, offset):
+        with self._lock:
+            cached = self._hashers.get(upload_id)
+        if cached is not None and cached[0] == offset:
+            return cached[1]
+        # First chunk this process sees for a resumed upload: hash what is already stored
+        hasher = hashlib.sha256()
+        with open(part_path, 'rb') as f:
+            remaining = offset
+            while remaining:
+                block = f.read(min(UPLOAD_BUFFER, remaining))
+                if not block:
+                    break
+                hasher.update(block)
+                remaining -= len(block)
+        return hasher
+
+    def _upload_lock(self, upload_id):
+        with self._lock:
+            return self._upload_locks.setdefault(upload_id, threading.Lock())
+
+    def _forget(self, upload_id, meta_path):
+        self._remove(meta_path)
+        with self._lock:
+            self._hashers.pop(upload_id, None)
+            self._upload_locks.pop(upload_id, None)
+
+    def sweep(self):
+        """Delete uploads whose part file has not grown for UPLOAD_SESSION_TTL seconds"""
+        ttl = current_app.config.get('UPLOAD_SESSION_TTL')
+        if not ttl:
+            return
+        cutoff = time.time() - ttl
+        if not os.path.isdir(self._partial_dir()):
+            return
+        for name in os.listdir(self._partial_dir()):
+            upload_id, ext = os.path.splitext(name)
+            if ext != '.part':
+                continue
+            meta_path, part_path = self._paths(upload_id)
+            try:
+                touched = os.path.getmtime(part_path)
+            except OSError:
+                continue
+            if touched < cutoff:
+                self._remove(part_path)
+                self._forget(upload_id, meta_path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+upload_sessions = UploadSessions()
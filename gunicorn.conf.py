@@ -0,0 +1,29 @@
+import os
+
+# Production server settings, used by the Procfile and render.yaml:
+#   gunicorn -c gunicorn.conf.py main:app
+# The worker class follows SOCKETIO_ASYNC_MODE so Socket.IO and gunicorn agree.
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+
+async_mode = os.environ.get("SOCKETIO_ASYNC_MODE", "threading")
+if async_mode == 'gevent':
+    worker_class = 'gevent'
+    worker_connections = int(os.environ.get("WORKER_CONNECTIONS", 1000))
+elif async_mode == 'eventlet':
+    # Recent gunicorn releases no longer ship the eventlet worker; on those,
+    # run `python main.py`, which serves through eventlet's own WSGI server
+    worker_class = 'eventlet'
+    worker_connections = int(os.environ.get("WORKER_CONNECTIONS", 1000))
+else:
+    # Every websocket holds one thread, so this caps connections per worker
+    worker_class = 'gthread'
+    threads = int(os.environ.get("WORKER_THREADS", 100))
+    # Importing the app opens no connections or threads, so workers can fork from
+    # a preloaded master (green workers must import after their own patching)
+    preload_app = True
+
+# Websockets are long-lived; don't let the worker timeout kill idle connections
+timeout = 0 if async_mode in ('eventlet', 'gevent') else 120
+graceful_timeout = 30
@@ -2,6 +2,9 @@
 """
 Database initialization script for WatchWithMe
 Run this script to set up the database and create admin user
+
+This is the one-shot bootstrap step of a deploy (render.yaml startCommand,
+Procfile release phase): the app itself does no database work on startup.
 """
 
 import os
@@ -11,11 +14,17 @@ from datetime import datetime
 # Add the current directory to the Python path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from app import app, db
+from dotenv import load_dotenv
+
+from app import create_app, db
+from migrations import run_migrations
 from models import User
 
-def init_database():
+def init_database(app=None):
     """Initialize database and create admin user"""
+    if app is None:
+        load_dotenv()
+        app = create_app()
     with app.app_context():
         print("🚀 Initializing WatchWithMe database...")
         
@@ -23,6 +32,11 @@ def init_database():
         db.create_all()
         print("✅ Database tables created")
         
+        # Bring existing databases up to the current schema version
+        applied = run_migrations(db.engine)
+        if applied:
+            print(f"✅ Applied migrations: {', '.join(str(version) for version in applied)}")
+        
         # Check if admin user exists
         admin_user = User.query.filter_by(is_admin=True).first()
         
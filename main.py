@@ -1,9 +1,46 @@
 import os
-from app import app, socketio
-import routes  # noqa: F401
 
-# For gunicorn
+# Green-thread servers need the standard library patched before anything else is
+# imported (gunicorn's gevent worker already has; patching twice is harmless)
+async_mode = os.environ.get("SOCKETIO_ASYNC_MODE", "threading")
+if async_mode == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+elif async_mode == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+if async_mode in ('eventlet', 'gevent'):
+    # Let psycopg2 yield to the event loop while waiting on PostgreSQL, if psycogreen is installed
+    try:
+        import importlib
+        importlib.import_module(f'psycogreen.{async_mode}').patch_psycopg()
+    except ImportError:
+        pass
+
+import signal
+import sys
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from app import create_app, db, socketio
+
+app = create_app()
+
+# For gunicorn (see gunicorn.conf.py); run directly for development or eventlet
 if __name__ == "__main__":
+    # Exit through sys.exit on SIGTERM so atexit hooks (playback state flush) run
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
+    # Deployments run init_db.py once before starting workers; the development
+    # server sets up a fresh database itself
+    with app.app_context():
+        if not db.inspect(db.engine).has_table('users'):
+            from init_db import init_database
+            init_database(app)
+    
     port = int(os.environ.get("PORT", 5000))  # use PORT from Render environment
     debug = os.environ.get("FLASK_ENV") == "development"
+    # eventlet and gevent serve through their own WSGI servers; Werkzeug is only for development
     socketio.run(app, host="0.0.0.0", port=port, debug=debug, allow_unsafe_werkzeug=True)
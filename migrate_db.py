@@ -1,104 +1,54 @@
 #!/usr/bin/env python3
 """
-Migration script to add admin columns to existing database
+Apply versioned schema migrations to the configured database
+
+    python migrate_db.py            # apply everything pending
+    python migrate_db.py --status   # list applied and pending versions
+    python migrate_db.py --to 1     # stop after version 1
 """
 
+import argparse
 import os
 import sys
 
 # Add the current directory to the Python path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from app import app, db
-from sqlalchemy import text
+from app import create_app, db
+from migrations import MIGRATIONS, applied_versions, run_migrations
+
+
+def show_status(engine):
+    applied = applied_versions(engine)
+    for version, name, _ in MIGRATIONS:
+        state = "applied" if version in applied else "pending"
+        print(f"{version:>4}  {state:<8} {name}")
 
-def migrate_database():
-    """Add admin columns to existing database"""
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply versioned schema migrations")
+    parser.add_argument('--status', action='store_true', help="show applied and pending migrations")
+    parser.add_argument('--to', type=int, default=None, help="highest version to apply")
+    args = parser.parse_args()
+
+    app = create_app()
     with app.app_context():
+        if args.status:
+            show_status(db.engine)
+            return
+
+        print("🔄 Migrating WatchWithMe Database...")
         try:
-            # Check if columns already exist
-            result = db.session.execute(text("PRAGMA table_info(users)"))
-            columns = [row[1] for row in result.fetchall()]
-            
-            print("Current columns:", columns)
-            
-            # Add is_admin column if it doesn't exist
-            if 'is_admin' not in columns:
-                db.session.execute(text("ALTER TABLE users ADD COLUMN is_admin BOOLEAN DEFAULT FALSE"))
-                print("✅ Added is_admin column")
-            else:
-                print("ℹ️  is_admin column already exists")
-            
-            # Add is_banned column if it doesn't exist
-            if 'is_banned' not in columns:
-                db.session.execute(text("ALTER TABLE users ADD COLUMN is_banned BOOLEAN DEFAULT FALSE"))
-                print("✅ Added is_banned column")
-            else:
-                print("ℹ️  is_banned column already exists")
-            
-            db.session.commit()
-            print("✅ Database migration completed successfully!")
-            
+            applied = run_migrations(db.engine, target=args.to)
         except Exception as e:
             print(f"❌ Error during migration: {e}")
-            db.session.rollback()
-            raise
+            sys.exit(1)
 
-def create_admin_user():
-    """Create the first admin user"""
-    from models import User
-    
-    with app.app_context():
-        # Check if admin user already exists
-        admin_user = User.query.filter_by(is_admin=True).first()
-        if admin_user:
-            print(f"Admin user already exists: {admin_user.username}")
-            return admin_user
-        
-        # Create admin user
-        admin = User()
-        admin.username = "admin"
-        admin.email = "admin@watchwithme.com"
-        admin.first_name = "Admin"
-        admin.last_name = "User"
-        admin.is_admin = True
-        admin.is_banned = False
-        admin.set_password("admin123")  # Change this password!
-        
-        db.session.add(admin)
-        db.session.commit()
-        
-        print("✅ Admin user created successfully!")
-        print("Username: admin")
-        print("Password: admin123")
-        print("⚠️  IMPORTANT: Change the password after first login!")
-        
-        return admin
+        if applied:
+            print(f"✅ Applied migrations: {', '.join(str(version) for version in applied)}")
+        else:
+            print("ℹ️  Database is already up to date")
 
-def main():
-    """Main migration function"""
-    print("🔄 Migrating WatchWithMe Database...")
-    print("=" * 50)
-    
-    try:
-        # Migrate database
-        migrate_database()
-        
-        # Create admin user
-        create_admin_user()
-        
-        print("=" * 50)
-        print("✅ Migration completed successfully!")
-        print("\n📋 Next steps:")
-        print("1. Run your Flask application: python app.py")
-        print("2. Go to http://localhost:5000")
-        print("3. Login with admin/admin123")
-        print("4. Change the admin password immediately!")
-        print("5. Access admin panel at http://localhost:5000/admin")
-        
-    except Exception as e:
-        print(f"❌ Error during migration: {e}")
-        sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,154 @@
+"""
+Versioned schema migrations.
+
+Each migration is a function registered with :func:`migration` under an
+increasing version number. Applied versions are recorded in the
+``schema_migrations`` table, so ``run_migrations`` only runs what a database
+is missing. Migrations are written to be idempotent: a database created by
+``db.create_all()`` from the current models already has their effect, and
+running them against it just records the version.
+
+Indexes are built online where the database allows it: PostgreSQL uses
+``CREATE INDEX CONCURRENTLY`` (outside a transaction, so writes keep
+flowing), SQLite uses ``CREATE INDEX IF NOT EXISTS``.
+"""
+
+import logging
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+MIGRATIONS = []  # (version, name, function), kept sorted by version
+
+
+def migration(version, name):
+    """Register ``fn(engine)`` as schema version ``version``"""
+    def register(fn):
+        MIGRATIONS.append((version, name, fn))
+        MIGRATIONS.sort(key=lambda entry: entry[0])
+        return fn
+    return register
+
+
+def ensure_version_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version INTEGER PRIMARY KEY, "
+            "name VARCHAR(200) NOT NULL, "
+            "applied_at TIMESTAMP NOT NULL)"
+        ))
+
+
+def applied_versions(engine):
+    ensure_version_table(engine)
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def pending_migrations(engine):
+    applied = applied_versions(engine)
+    return [entry for entry in MIGRATIONS if entry[0] not in applied]
+
+
+def run_migrations(engine, target=None):
+    """Apply every pending migration up to ``target`` (default: all); returns the versions applied"""
+    applied = []
+    for version, name, fn in pending_migrations(engine):
+        if target is not None and version > target:
+            break
+        logging.info(f"Applying migration {version}: {name}")
+        fn(engine)
+        with engine.begin() as conn:
+            conn.execute(text("INSERT INTO schema_migrations (version, name, applied_at) "
+                              "VALUES (:version, :name, :applied_at)"),
+                         {'version': version, 'name': name, 'applied_at': datetime.now()})
+        applied.append(version)
+    return applied
+
+
+def add_column(engine, table, column, ddl):
+    """Add a column unless it already exists"""
+    if column in {col['name'] for col in inspect(engine).get_columns(table)}:
+        return False
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    return True
+
+
+def create_index(engine, name, table, columns, unique=False):
+    """Build an index without blocking writes where the database supports it"""
+    kind = 'UNIQUE INDEX' if unique else 'INDEX'
+    column_list = ', '.join(columns)
+
+    if engine.dialect.name == 'postgresql':
+        # CONCURRENTLY cannot run inside a transaction block
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            # An interrupted concurrent build leaves an INVALID index that
+            # IF NOT EXISTS would keep; drop it so the build is retried
+            invalid = conn.execute(text(
+                "SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+                "WHERE c.relname = :name AND NOT i.indisvalid"), {'name': name}).first()
+            if invalid:
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+            conn.execute(text(f"CREATE {kind} CONCURRENTLY IF NOT EXISTS {name} ON {table} ({column_list})"))
+    elif engine.dialect.name == 'sqlite':
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE {kind} IF NOT EXISTS {name} ON {table} ({column_list})"))
+    else:
+        if name in {index['name'] for index in inspect(engine).get_indexes(table)}:
+            return
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE {kind} {name} ON {table} ({column_list})"))
+
+
+@migration(1, 'admin columns on users')
+def add_admin_columns(engine):
+    add_column(engine, 'users', 'is_admin', 'BOOLEAN DEFAULT FALSE')
+    add_column(engine, 'users', 'is_banned', 'BOOLEAN DEFAULT FALSE')
+
+
+@migration(2, 'indexes for chat, membership and user flag lookups')
+def add_hot_query_indexes(engine):
+    create_index(engine, 'ix_chat_messages_room_id_id', 'chat_messages', ['room_id', 'id'])
+    create_index(engine, 'ix_room_members_room_id_is_approved', 'room_members', ['room_id', 'is_approved'])
+    create_index(engine, 'ix_room_members_user_id_is_approved', 'room_members', ['user_id', 'is_approved'])
+    create_index(engine, 'ix_users_is_admin', 'users', ['is_admin'])
+    create_index(engine, 'ix_users_is_banned', 'users', ['is_banned'])
+
+
+@migration(3, 'chat message archive table')
+def add_chat_archive(engine):
+    from models import ArchivedChatMessage
+    ArchivedChatMessage.__table__.create(engine, checkfirst=True)
+
+
+@migration(4, 'content-addressed video blobs')
+def add_video_blobs(engine):
+    from models import VideoBlob
+    VideoBlob.__table__.create(engine, checkfirst=True)
+    add_column(engine, 'video_files', 'blob_id', 'INTEGER REFERENCES video_blobs(id)')
+    create_index(engine, 'ix_video_files_blob_id', 'video_files', ['blob_id'])
+
+
+@migration(5, 'video container index columns')
+def add_video_index_columns(engine):
+    add_column(engine, 'video_blobs', 'container', 'VARCHAR(20)')
+    add_column(engine, 'video_blobs', 'duration', 'FLOAT')
+    add_column(engine, 'video_blobs', 'video_codec', 'VARCHAR(50)')
+    add_column(engine, 'video_blobs', 'audio_codec', 'VARCHAR(50)')
+    add_column(engine, 'video_blobs', 'width', 'INTEGER')
+    add_column(engine, 'video_blobs', 'height', 'INTEGER')
+    add_column(engine, 'video_blobs', 'media_index', 'TEXT')
+    add_column(engine, 'video_blobs', 'indexed_at', 'TIMESTAMP')
+
+
+@migration(6, 'shared counters (room code sequence)')
+def add_counters(engine):
+    from models import Counter
+    Counter.__table__.create(engine, checkfirst=True)
+
+
+@migration(7, 'room activity stamp')
+def add_room_last_active_at(engine):
+    add_column(engine, 'rooms', 'last_active_at', 'TIMESTAMP')
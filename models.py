@@ -1,10 +1,8 @@
 from datetime import datetime
-import random
-import string
 from app import db
 
 from flask_login import UserMixin
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import Index, UniqueConstraint, func
 
 
 class User(UserMixin, db.Model):
@@ -17,8 +15,8 @@ class User(UserMixin, db.Model):
     last_name = db.Column(db.String(100), nullable=True)
     
     # Admin and status fields
-    is_admin = db.Column(db.Boolean, default=False)
-    is_banned = db.Column(db.Boolean, default=False)
+    is_admin = db.Column(db.Boolean, default=False, index=True)
+    is_banned = db.Column(db.Boolean, default=False, index=True)
 
     created_at = db.Column(db.DateTime, default=datetime.now)
     updated_at = db.Column(db.DateTime,
@@ -69,6 +67,8 @@ class Room(db.Model):
     
     created_at = db.Column(db.DateTime, default=datetime.now)
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+    # Stamped periodically by every worker that has sockets in the room
+    last_active_at = db.Column(db.DateTime, nullable=True)
     
     # Relationships
     members = db.relationship('RoomMember', backref='room', lazy=True, cascade='all, delete-orphan')
@@ -76,16 +76,31 @@ class Room(db.Model):
     
     @staticmethod
     def generate_room_code():
-        """Generate a unique 6-character room code"""
-        while True:
-            code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-            if not Room.query.filter_by(room_code=code).first():
-                return code
+        """Next 6-character room code from the shared counter (in the current transaction)"""
+        from room_codes import room_codes
+        return room_codes.next_code()
     
     @property
     def member_count(self):
+        # List pages preload this for every room at once with load_member_counts()
+        count = getattr(self, '_member_count', None)
+        if count is not None:
+            return count
         return RoomMember.query.filter_by(room_id=self.id, is_approved=True).count()
     
+    @staticmethod
+    def load_member_counts(rooms):
+        """Fill in member_count for many rooms with a single grouped query"""
+        room_ids = [room.id for room in rooms]
+        counts = {}
+        if room_ids:
+            counts = dict(db.session.query(RoomMember.room_id, func.count(RoomMember.id))
+                          .filter(RoomMember.room_id.in_(room_ids), RoomMember.is_approved == True)
+                          .group_by(RoomMember.room_id).all())
+        for room in rooms:
+            room._member_count = counts.get(room.id, 0)
+        return rooms
+    
     def get_member(self, user_id):
         return RoomMember.query.filter_by(room_id=self.id, user_id=user_id).first()
     
@@ -106,7 +121,13 @@ class RoomMember(db.Model):
     joined_at = db.Column(db.DateTime, default=datetime.now)
     is_approved = db.Column(db.Boolean, default=False)
     
-    __table_args__ = (UniqueConstraint('room_id', 'user_id', name='uq_room_user'),)
+    # uq_room_user also serves (room_id, user_id) lookups; the other two back
+    # the approved-member roster of a room and the rooms list of a user
+    __table_args__ = (
+        UniqueConstraint('room_id', 'user_id', name='uq_room_user'),
+        Index('ix_room_members_room_id_is_approved', 'room_id', 'is_approved'),
+        Index('ix_room_members_user_id_is_approved', 'user_id', 'is_approved'),
+    )
 
 
 class ChatMessage(db.Model):
@@ -119,9 +140,68 @@ class ChatMessage(db.Model):
     message_type = db.Column(db.String(20), default='user')  # 'user' or 'system'
     created_at = db.Column(db.DateTime, default=datetime.now)
     
+    # Chat history is read per room in id order (after_id polling, latest N)
+    __table_args__ = (Index('ix_chat_messages_room_id_id', 'room_id', 'id'),)
+    
     @property
     def formatted_time(self):
         return self.created_at.strftime('%H:%M')
+    
+    def to_dict(self, user_name=None):
+        """Serialize for the chat API and Socket.IO broadcasts"""
+        if user_name is None:
+            user_name = self.user.display_name if self.user else 'System'
+        return {
+            'id': self.id,
+            'user_name': user_name,
+            'message': self.message,
+            'time': self.formatted_time,
+            'type': self.message_type
+        }
+
+
+class ArchivedChatMessage(db.Model):
+    """A chat message moved out of ``chat_messages`` by the retention job (same id)"""
+    __tablename__ = 'chat_messages_archive'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    room_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    message = db.Column(db.Text, nullable=False)
+    message_type = db.Column(db.String(20), default='user')
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    
+    # Only read by history scroll-back, per room in id order
+    __table_args__ = (Index('ix_chat_messages_archive_room_id_id', 'room_id', 'id'),)
+    
+    user = db.relationship('User')
+    
+    formatted_time = ChatMessage.formatted_time
+    to_dict = ChatMessage.to_dict
+
+
+class VideoBlob(db.Model):
+    """Stored video content, named by its SHA-256 and shared by every upload of the same bytes"""
+    __tablename__ = 'video_blobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    # Number of video_files rows pointing at this blob
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    
+    # Container facts filled in by video_index when the blob is first published
+    container = db.Column(db.String(20))
+    duration = db.Column(db.Float)
+    video_codec = db.Column(db.String(50))
+    audio_codec = db.Column(db.String(50))
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    # Header byte ranges and keyframe table (JSON); only read by video_index
+    media_index = db.deferred(db.Column(db.Text))
+    indexed_at = db.Column(db.DateTime)
 
 
 class VideoFile(db.Model):
@@ -134,8 +214,19 @@ class VideoFile(db.Model):
     file_size = db.Column(db.Integer, nullable=False)
     uploaded_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     room_id = db.Column(db.Integer, db.ForeignKey('rooms.id'), nullable=False)
+    # Null for uploads stored before content-addressed storage
+    blob_id = db.Column(db.Integer, db.ForeignKey('video_blobs.id'), nullable=True, index=True)
     created_at = db.Column(db.DateTime, default=datetime.now)
     
     # Relationships
     uploader = db.relationship('User', backref='uploaded_videos')
     room = db.relationship('Room', backref='video_files')
+    blob = db.relationship('VideoBlob')
+
+
+class Counter(db.Model):
+    """A named number incremented atomically in the database, shared by every worker"""
+    __tablename__ = 'counters'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
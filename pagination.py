@@ -0,0 +1,40 @@
+"""
+Keyset (cursor) pagination.
+
+``paginate_keyset`` pages through a query by an indexed, unique, increasing
+column (the primary key) with ``WHERE id > :after`` / ``WHERE id < :before``
+and ``LIMIT per_page + 1`` instead of ``OFFSET`` and ``COUNT(*)``, so every
+page costs the same however deep it is. Totals, where shown, come from the
+cached aggregates in :mod:`admin_stats` and are approximate.
+"""
+
+
+class KeysetPage:
+    """One page of rows in ascending key order, with cursors to its neighbours"""
+
+    __slots__ = ('items', 'has_prev', 'has_next', 'prev_cursor', 'next_cursor', 'total')
+
+    def __init__(self, items, key, has_prev, has_next, total=None):
+        self.items = items
+        self.has_prev = has_prev and bool(items)
+        self.has_next = has_next and bool(items)
+        self.prev_cursor = key(items[0]) if items else None
+        self.next_cursor = key(items[-1]) if items else None
+        self.total = total
+
+
+def paginate_keyset(query, column, per_page, after=None, before=None, last=False, total=None):
+    """Page ``query`` by ``column``: the rows after ``after``, before ``before``, the last page or the first"""
+    key = lambda item: getattr(item, column.key)
+    if before is not None or last:
+        if before is not None:
+            query = query.filter(column < before)
+        rows = query.order_by(column.desc()).limit(per_page + 1).all()
+        items = rows[:per_page][::-1]
+        return KeysetPage(items, key, has_prev=len(rows) > per_page, has_next=before is not None, total=total)
+
+    if after is not None:
+        query = query.filter(column > after)
+    rows = query.order_by(column.asc()).limit(per_page + 1).all()
+    return KeysetPage(rows[:per_page], key, has_prev=after is not None,
+                      has_next=len(rows) > per_page, total=total)
@@ -0,0 +1,418 @@
+"""
+In-memory playback state for rooms.
+
+Socket.IO control events and host heartbeats update the records held here
+instead of writing the ``Room`` row on every event. Dirty records are written
+back to the database in one batch every ``PLAYBACK_FLUSH_INTERVAL`` seconds
+and once more when the process exits.
+
+A second background task broadcasts a compact ``sync_tick`` to every room
+with connected sockets every ``SYNC_TICK_INTERVAL`` seconds, so drift
+correction costs one emit per active room rather than one request per viewer.
+
+Host commands are broadcast through a per-room coalescing window: the first
+command after a quiet period goes out at once, later ones inside
+``CONTROL_COALESCE_MS`` only replace a pending command, and the final state
+is broadcast once when the window closes. Scrubbing the timeline therefore
+costs viewers one seek instead of dozens.
+
+When several workers share a Socket.IO message queue, each keeps its own
+copy of this state. The worker that last applied a command owns the record
+for ``STATE_REPLICA_TTL`` seconds and is the only one broadcasting ticks
+for it; other workers treat their copy as a replica and re-read it from the
+database once it is older than the TTL.
+
+Every ``ACTIVITY_INTERVAL`` seconds the flush task also stamps
+``rooms.last_active_at`` for the rooms this process has sockets in, so other
+workers (and the idle-room purge) can tell a room is in use.
+
+Records are dropped from memory again once a room has no connected sockets,
+its state has been flushed and nothing has read it for a flush interval, so
+only rooms in use stay resident.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import update
+
+from app import db, socketio
+from video_index import video_indexer
+
+# Seconds between rooms.last_active_at stamps for rooms with connected sockets
+ACTIVITY_INTERVAL = 60
+
+# Wall-clock anchor for the monotonic clock, fixed at import so server
+# timestamps never jump when the system clock is adjusted
+_MONOTONIC_EPOCH = time.time() - time.monotonic()
+
+
+def server_time_ms():
+    """Monotonic server clock in epoch milliseconds (what clients sync against)"""
+    return (time.monotonic() + _MONOTONIC_EPOCH) * 1000
+
+
+class PlaybackState:
+    """Compact playback record for a single room"""
+
+    __slots__ = ('room_id', 'video_url', 'video_type', 'video_time',
+                 'is_playing', 'last_sync_time', 'sync_ms', 'dirty',
+                 'owned_until', 'loaded_ms', 'used_ms')
+
+    def __init__(self, room_id, video_url=None, video_type=None, video_time=0.0,
+                 is_playing=False, last_sync_time=None):
+        self.room_id = room_id
+        self.video_url = video_url
+        self.video_type = video_type
+        self.video_time = video_time or 0.0
+        self.is_playing = bool(is_playing)
+        self.last_sync_time = last_sync_time or datetime.now()
+        # last_sync_time is the naive local time persisted on the Room row;
+        # sync_ms is the same instant on the monotonic server clock
+        age_ms = (datetime.now() - self.last_sync_time).total_seconds() * 1000
+        self.sync_ms = server_time_ms() - age_ms
+        self.dirty = False
+        self.owned_until = 0  # server time until which this process owns the record
+        self.loaded_ms = self.used_ms = server_time_ms()
+
+    @classmethod
+    def from_room(cls, room):
+        return cls(room.id,
+                   video_url=room.current_video_url,
+                   video_type=room.current_video_type,
+                   video_time=room.current_video_time,
+                   is_playing=room.is_playing,
+                   last_sync_time=room.last_sync_time)
+
+    def position(self, at=None):
+        """Expected playback position in seconds at server time ``at`` (default now)"""
+        if self.is_playing:
+            if at is None:
+                at = server_time_ms()
+            return self.video_time + (at - self.sync_ms) / 1000
+        return self.video_time
+
+    def snapshot(self):
+        """Timestamped state for clients to apply with their clock offset"""
+        now = server_time_ms()
+        return {
+            'video_url': self.video_url,
+            'video_type': self.video_type,
+            'position': self.position(now),
+            'is_playing': self.is_playing,
+            'server_time': now
+        }
+
+    def is_stale(self, ttl):
+        """True for a clean replica older than ``ttl`` seconds (never when ttl is None)"""
+        if ttl is None or self.dirty:
+            return False
+        now = server_time_ms()
+        return now > self.owned_until and now - self.loaded_ms > ttl * 1000
+
+    def is_owned(self, ttl):
+        return ttl is None or server_time_ms() <= self.owned_until
+
+    def tick(self):
+        """Compact form of :meth:`snapshot` for the periodic sync broadcast"""
+        now = server_time_ms()
+        return {'t': round(self.position(now), 3), 'p': self.is_playing, 's': round(now)}
+
+    def to_row(self):
+        """Column values for a bulk ``UPDATE rooms`` by primary key"""
+        return {
+            'id': self.room_id,
+            'current_video_url': self.video_url,
+            'current_video_type': self.video_type,
+            'current_video_time': self.video_time,
+            'is_playing': self.is_playing,
+            'last_sync_time': self.last_sync_time,
+        }
+
+
+class PlaybackStore:
+    """Process-wide registry of playback state keyed by room code"""
+
+    def __init__(self):
+        self._states = {}
+        self._lock = threading.Lock()
+        self._app = None
+        self._ticker_app = None
+        self._windows = {}  # room_code -> pending (user_id, skip_sid, merged) or None
+        self._activity_stamped = 0  # monotonic time of the last last_active_at stamp
+
+    def get(self, room_code, room=None):
+        """Return the state for a room, loading it from the database on first use or when stale"""
+        room_code = room_code.upper()
+        ttl = current_app.config.get('STATE_REPLICA_TTL')
+        with self._lock:
+            state = self._states.get(room_code)
+        if state is not None and not state.is_stale(ttl):
+            state.used_ms = server_time_ms()
+            return state
+
+        if room is None:
+            from models import Room
+            room = Room.query.filter_by(room_code=room_code).first()
+            if not room:
+                return None
+
+        loaded = PlaybackState.from_room(room)
+        with self._lock:
+            # Another thread may have loaded (and modified) it meanwhile
+            current = self._states.get(room_code)
+            if current is not None and (current is not state or not current.is_stale(ttl)):
+                return current
+            self._states[room_code] = loaded
+        self._ensure_flusher()
+        return loaded
+
+    def change_video(self, room_code, video_url, video_type, room=None):
+        """Switch the room to a new video, paused at the start"""
+        state = self.get(room_code, room)
+        if state is None:
+            return None
+
+        with self._lock:
+            state.video_url = video_url
+            state.video_type = video_type
+            state.video_time = 0.0
+            state.is_playing = False
+            state.last_sync_time = datetime.now()
+            state.sync_ms = server_time_ms()
+            state.dirty = True
+            self._claim(state)
+            # Put back a record evicted while this command was in flight
+            self._states.setdefault(room_code.upper(), state)
+        self._ensure_flusher()
+        return state
+
+    def control(self, room_code, action, time, room=None):
+        """Apply a play/pause/seek/heartbeat command at the given position"""
+        state = self.get(room_code, room)
+        if state is None:
+            return None
+        time = float(time or 0)
+        if state.video_type == 'local':
+            # Kept inside the video once its container has been indexed
+            time = video_indexer.clamp(state.video_url, time)
+
+        with self._lock:
+            if action == 'play':
+                state.is_playing = True
+            elif action == 'pause':
+                state.is_playing = False
+            state.video_time = time
+            state.last_sync_time = datetime.now()
+            state.sync_ms = server_time_ms()
+            state.dirty = True
+            self._claim(state)
+            # Put back a record evicted while this command was in flight
+            self._states.setdefault(room_code.upper(), state)
+        self._ensure_flusher()
+        return state
+
+    def broadcast_control(self, room_code, action, time, user_id, skip_sid=None):
+        """Broadcast a host command, coalescing bursts; returns False if it was merged"""
+        window = current_app.config.get('CONTROL_COALESCE_MS', 0) / 1000
+        if window:
+            with self._lock:
+                if room_code in self._windows:
+                    pending = self._windows[room_code]
+                    self._windows[room_code] = (user_id, skip_sid, pending[2] + 1 if pending else 1)
+                    return False
+                self._windows[room_code] = None
+            socketio.start_background_task(self._coalesce_loop, current_app._get_current_object(),
+                                           room_code, window)
+        self._emit_control(room_code, action, time, user_id, skip_sid)
+        return True
+
+    def _coalesce_loop(self, app, room_code, window):
+        while True:
+            socketio.sleep(window)
+            with self._lock:
+                pending = self._windows.get(room_code)
+                if pending is None:
+                    self._windows.pop(room_code, None)
+                    return
+                # Keep the window open for as long as commands keep arriving
+                self._windows[room_code] = None
+            user_id, skip_sid, merged = pending
+            with app.app_context():
+                try:
+                    self._emit_control(room_code, None, None, user_id, skip_sid, merged)
+                except Exception as e:
+                    logging.error(f"Error broadcasting coalesced control for {room_code}: {e}")
+
+    def _emit_control(self, room_code, action, time, user_id, skip_sid, merged=0):
+        """Send viewers the command, timestamped and scheduled PLAYBACK_LEAD_MS ahead"""
+        state = self.get(room_code)
+        if state is None:
+            return
+        if action is None:
+            # Merged commands collapse into the room's final state
+            action = 'play' if state.is_playing else 'pause'
+            time = state.video_time
+        server_time = server_time_ms()
+        execute_at = server_time + current_app.config['PLAYBACK_LEAD_MS']
+        payload = {
+            'action': action,
+            'time': time,
+            'position': state.position(execute_at),
+            'is_playing': state.is_playing,
+            'server_time': server_time,
+            'execute_at': execute_at,
+            'controlled_by': user_id,
+            'merged': merged
+        }
+        if state.video_type == 'local' and (action == 'seek' or merged):
+            # Bytes from the keyframe before the target, fetched during the lead time
+            hints = video_indexer.hints(state.video_url, payload['position'])
+            if hints:
+                payload['prefetch'] = hints['prefetch']
+        socketio.emit('video_control_update', payload, to=room_code, skip_sid=skip_sid)
+
+    def _claim(self, state):
+        """Mark a record as owned by this process after a local write"""
+        ttl = current_app.config.get('STATE_REPLICA_TTL')
+        if ttl is not None:
+            state.owned_until = state.sync_ms + ttl * 1000
+
+    def forget(self, room_code):
+        """Drop a room's state without writing it back (e.g. room deleted)"""
+        with self._lock:
+            self._states.pop(room_code.upper(), None)
+
+    def stamp_activity(self):
+        """Set last_active_at on the rooms with sockets here, at most once per ACTIVITY_INTERVAL"""
+        from models import Room
+        from presence import presence_registry
+
+        now = time.monotonic()
+        if now - self._activity_stamped < ACTIVITY_INTERVAL:
+            return 0
+        self._activity_stamped = now
+        room_codes = presence_registry.active_rooms()
+        if not room_codes:
+            return 0
+        try:
+            # updated_at is passed through so the stamp does not count as a change
+            db.session.execute(update(Room).where(Room.room_code.in_(room_codes))
+                               .values(last_active_at=datetime.now(), updated_at=Room.updated_at)
+                               .execution_options(synchronize_session=False))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return len(room_codes)
+
+    def evict_idle(self, max_idle):
+        """Drop clean records of rooms without connected sockets unused for ``max_idle`` seconds"""
+        from presence import presence_registry
+
+        active = set(presence_registry.active_rooms())
+        cutoff = server_time_ms() - max_idle * 1000
+        with self._lock:
+            idle = [room_code for room_code, state in self._states.items()
+                    if not state.dirty and state.used_ms < cutoff
+                    and room_code not in active and room_code not in self._windows]
+            for room_code in idle:
+                del self._states[room_code]
+        return len(idle)
+
+    def flush(self):
+        """Write every dirty record to its ``Room`` row in a single transaction"""
+        from models import Room
+
+        with self._lock:
+            dirty = [state for state in self._states.values() if state.dirty]
+            rows = [state.to_row() for state in dirty]
+            for state in dirty:
+                state.dirty = False
+
+        if not rows:
+            return 0
+
+        try:
+            db.session.execute(update(Room), rows)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            with self._lock:
+                for state in dirty:
+                    state.dirty = True
+            raise
+        return len(rows)
+
+    def _ensure_flusher(self):
+        """Start the background flush task the first time state changes"""
+        if self._app is not None:
+            return
+        with self._lock:
+            if self._app is not None:
+                return
+            self._app = current_app._get_current_object()
+        socketio.start_background_task(self._flush_loop)
+        atexit.register(self._flush_on_exit)
+
+    def _flush_loop(self):
+        from presence import presence_registry
+
+        interval = self._app.config.get('PLAYBACK_FLUSH_INTERVAL', 5)
+        while True:
+            socketio.sleep(interval)
+            with self._app.app_context():
+                try:
+                    count = self.flush()
+                    if count:
+                        logging.debug(f"Flushed playback state for {count} room(s)")
+                    self.stamp_activity()
+                    # Rooms nobody is connected to leave memory once written back
+                    evicted = self.evict_idle(interval) + presence_registry.evict_idle(interval)
+                    if evicted:
+                        logging.debug(f"Evicted {evicted} idle room record(s)")
+                except Exception as e:
+                    logging.error(f"Error flushing playback state: {e}")
+
+    def start_ticker(self):
+        """Start the periodic sync_tick broadcast the first time a socket joins a room"""
+        if self._ticker_app is not None:
+            return
+        with self._lock:
+            if self._ticker_app is not None:
+                return
+            self._ticker_app = current_app._get_current_object()
+        if self._ticker_app.config.get('SYNC_TICK_INTERVAL'):
+            socketio.start_background_task(self._tick_loop)
+
+    def _tick_loop(self):
+        from presence import presence_registry
+
+        interval = self._ticker_app.config['SYNC_TICK_INTERVAL']
+        ttl = self._ticker_app.config.get('STATE_REPLICA_TTL')
+        while True:
+            socketio.sleep(interval)
+            with self._ticker_app.app_context():
+                try:
+                    # Rooms without connected sockets are skipped entirely
+                    for room_code in presence_registry.active_rooms():
+                        state = self.get(room_code)
+                        # Only the owning worker ticks; the queue delivers it everywhere
+                        if state is not None and state.video_url and state.is_owned(ttl):
+                            socketio.emit('sync_tick', state.tick(), to=room_code)
+                except Exception as e:
+                    logging.error(f"Error broadcasting sync ticks: {e}")
+
+    def _flush_on_exit(self):
+        with self._app.app_context():
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Error flushing playback state on exit: {e}")
+
+
+playback_store = PlaybackStore()
@@ -0,0 +1,315 @@
+"""
+Live room presence.
+
+Keeps, per room, the roster of approved members (loaded from the database
+once) and the set of connected sockets for each of them. It is maintained
+by the Socket.IO connect/join/disconnect handlers and by the HTTP routes
+that add or remove members, so member counts and lists can be served
+without touching the database.
+
+With several workers behind a message queue each process holds its own
+registry: rosters are re-read from the database every ``STATE_REPLICA_TTL``
+seconds (and immediately when an unknown user joins) so members added or
+removed through another worker are picked up, while online counts only
+cover the sockets connected to this process.
+
+A room's roster is dropped once no socket is connected to it and it has not
+been read for a while (see ``PlaybackStore._flush_loop``).
+
+Each socket also gets a compact :class:`SocketSession` once it has joined a
+room, so Socket.IO events can be authorised and routed without queries.
+"""
+
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy.orm import joinedload
+
+
+class MemberInfo:
+    """Compact roster entry for an approved room member"""
+
+    __slots__ = ('user_id', 'display_name', 'username', 'role', 'joined_at')
+
+    def __init__(self, user_id, display_name, username, role, joined_at):
+        self.user_id = user_id
+        self.display_name = display_name
+        self.username = username
+        self.role = role
+        self.joined_at = joined_at
+
+    @classmethod
+    def from_member(cls, member, user):
+        return cls(user.id, user.display_name, user.username, member.role, member.joined_at)
+
+    def to_dict(self, online=False):
+        return {
+            'id': self.user_id,
+            'display_name': self.display_name,
+            'username': self.username,
+            'role': self.role,
+            'joined_at': self.joined_at.isoformat(),
+            'online': online
+        }
+
+
+class SocketSession:
+    """What a connected socket is allowed to do, cached when it joins a room"""
+
+    __slots__ = ('user_id', 'room_code', 'room_id', 'role', 'display_name', 'checked_at')
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.clear()
+
+    def clear(self):
+        self.room_code = None
+        self.room_id = None
+        self.role = None
+        self.display_name = None
+        self.checked_at = 0
+
+    def bind(self, room_code, room_id, info):
+        self.room_code = room_code
+        self.room_id = room_id
+        self.role = info.role
+        self.display_name = info.display_name
+        self.checked_at = time.monotonic()
+
+    @property
+    def is_host(self):
+        return self.role == 'host'
+
+
+class RoomPresence:
+    """Stored members of a room and which of them are connected"""
+
+    __slots__ = ('room_id', 'members', 'online', 'loaded_at', 'used_at')
+
+    def __init__(self, room_id, members):
+        self.room_id = room_id
+        self.members = members  # user_id -> MemberInfo
+        self.online = {}  # user_id -> set of sids
+        self.loaded_at = self.used_at = time.monotonic()
+
+    def is_stale(self, ttl):
+        return ttl is not None and time.monotonic() - self.loaded_at > ttl
+
+    def counts(self):
+        return {'count': len(self.members), 'online_count': len(self.online)}
+
+    def member_list(self):
+        return [info.to_dict(info.user_id in self.online)
+                for info in sorted(self.members.values(), key=lambda info: info.joined_at)]
+
+
+class PresenceRegistry:
+    """Process-wide map of sockets to users and rooms"""
+
+    def __init__(self):
+        self._sockets = {}  # sid -> SocketSession
+        self._rooms = {}  # room_code -> RoomPresence
+        self._lock = threading.Lock()
+
+    def roster(self, room_code, room=None, refresh=False):
+        """Return the room's presence, loading its approved members on first use or when stale"""
+        room_code = room_code.upper()
+        ttl = current_app.config.get('STATE_REPLICA_TTL')
+        with self._lock:
+            presence = self._rooms.get(room_code)
+        if presence is not None and not refresh and not presence.is_stale(ttl):
+            presence.used_at = time.monotonic()
+            return presence
+
+        from models import Room, RoomMember
+        if room is None:
+            room = Room.query.filter_by(room_code=room_code).first()
+            if not room:
+                return None
+
+        members = RoomMember.query.options(joinedload(RoomMember.user))\
+                                  .filter_by(room_id=room.id, is_approved=True).all()
+        # Banned users keep their membership rows but are left out of the live roster
+        loaded = {member.user_id: MemberInfo.from_member(member, member.user)
+                  for member in members if not member.user.is_banned}
+        with self._lock:
+            presence = self._rooms.get(room_code)
+            if presence is None:
+                presence = self._rooms[room_code] = RoomPresence(room.id, loaded)
+            else:
+                # Keep the connected sockets, replace only the stored members
+                presence.members = loaded
+                presence.loaded_at = presence.used_at = time.monotonic()
+            return presence
+
+    def get_member(self, room_code, user_id, room=None):
+        """Return ``(presence, member_info)``; presence is None if the room does not exist"""
+        presence = self.roster(room_code, room)
+        if presence is None:
+            return None, None
+        info = presence.members.get(user_id)
+        if info is None:
+            # May have been approved (or unbanned) through another worker since the roster was loaded
+            presence = self.roster(room_code, refresh=True)
+            info = presence.members.get(user_id) if presence is not None else None
+        return presence, info
+
+    def member_list(self, presence):
+        with self._lock:
+            return presence.member_list()
+
+    def counts(self, presence):
+        with self._lock:
+            return presence.counts()
+
+    def active_rooms(self):
+        """Codes of rooms that currently have at least one connected member"""
+        with self._lock:
+            return [room_code for room_code, presence in self._rooms.items() if presence.online]
+
+    def evict_idle(self, max_idle):
+        """Drop rosters of rooms with no connected sockets that went unused for ``max_idle`` seconds"""
+        cutoff = time.monotonic() - max_idle
+        with self._lock:
+            idle = [room_code for room_code, presence in self._rooms.items()
+                    if not presence.online and presence.used_at < cutoff]
+            for room_code in idle:
+                del self._rooms[room_code]
+        return len(idle)
+
+    def connect(self, sid, user_id):
+        with self._lock:
+            self._sockets[sid] = SocketSession(user_id)
+
+    def session(self, sid):
+        """
+        Cached session of a socket that has joined a room, or None.
+
+        With several workers the record is re-checked against the roster
+        every ``STATE_REPLICA_TTL`` seconds, so removals made elsewhere apply.
+        """
+        with self._lock:
+            entry = self._sockets.get(sid)
+        if entry is None or entry.room_code is None:
+            return None
+
+        ttl = current_app.config.get('STATE_REPLICA_TTL')
+        if ttl is not None and time.monotonic() - entry.checked_at > ttl:
+            presence, info = self.get_member(entry.room_code, entry.user_id)
+            if info is None:
+                self.leave(sid)
+                return None
+            with self._lock:
+                entry.bind(entry.room_code, presence.room_id, info)
+        return entry
+
+    def join(self, sid, room_code):
+        """
+        Mark a socket as present in a room.
+
+        Returns ``(presence, member_info, came_online)``; member_info is None
+        when the socket's user is not an approved member of the room.
+        """
+        room_code = room_code.upper()
+        with self._lock:
+            entry = self._sockets.get(sid)
+        if entry is None or entry.user_id is None:
+            return None, None, False
+
+        # Switching rooms on the same socket counts as leaving the old one
+        if entry.room_code and entry.room_code != room_code:
+            self.leave(sid)
+
+        presence, info = self.get_member(room_code, entry.user_id)
+        if info is None:
+            return presence, None, False
+
+        with self._lock:
+            entry.bind(room_code, presence.room_id, info)
+            sids = presence.online.setdefault(info.user_id, set())
+            came_online = not sids
+            sids.add(sid)
+        return presence, info, came_online
+
+    def leave(self, sid):
+        """
+        Remove a socket from its room.
+
+        Returns ``(room_code, user_id, went_offline)`` or None if the socket
+        was not in a room.
+        """
+        with self._lock:
+            entry = self._sockets.get(sid)
+            if entry is None or entry.room_code is None:
+                return None
+            user_id, room_code = entry.user_id, entry.room_code
+            entry.clear()
+            presence = self._rooms.get(room_code)
+            if presence is None:
+                return None
+            sids = presence.online.get(user_id)
+            if not sids:
+                return None
+            sids.discard(sid)
+            went_offline = not sids
+            if went_offline:
+                del presence.online[user_id]
+        return room_code, user_id, went_offline
+
+    def disconnect(self, sid):
+        result = self.leave(sid)
+        with self._lock:
+            self._sockets.pop(sid, None)
+        return result
+
+    def add_member(self, room_code, member, user):
+        """Record a newly approved member (no-op if the roster isn't loaded yet)"""
+        with self._lock:
+            presence = self._rooms.get(room_code.upper())
+            if presence is None:
+                return None, None
+            info = MemberInfo.from_member(member, user)
+            presence.members[info.user_id] = info
+        return presence, info
+
+    def remove_member(self, room_code, user_id):
+        """Drop a member from the roster; returns the sids they had in the room"""
+        with self._lock:
+            presence = self._rooms.get(room_code.upper())
+            if presence is None:
+                return presence, set()
+            presence.members.pop(user_id, None)
+            sids = presence.online.pop(user_id, set())
+            for sid in sids:
+                entry = self._sockets.get(sid)
+                if entry is not None:
+                    entry.clear()
+        return presence, sids
+
+    def user_sids(self, user_id):
+        """Every socket this process holds for a user"""
+        with self._lock:
+            return [sid for sid, entry in self._sockets.items() if entry.user_id == user_id]
+
+    def user_rooms(self, user_id):
+        """Codes of loaded rooms that list the user as a member"""
+        with self._lock:
+            return [room_code for room_code, presence in self._rooms.items()
+                    if user_id in presence.members]
+
+    def forget_room(self, room_code):
+        """Drop a room entirely (e.g. deleted); returns the sids that were in it"""
+        with self._lock:
+            presence = self._rooms.pop(room_code.upper(), None)
+            if presence is None:
+                return set()
+            sids = set().union(*presence.online.values()) if presence.online else set()
+            for sid in sids:
+                entry = self._sockets.get(sid)
+                if entry is not None:
+                    entry.clear()
+        return sids
+
+
+presence_registry = PresenceRegistry()
@@ -0,0 +1,173 @@
+"""
+Set-based room deletion.
+
+Deleting a room used to load every member, chat message and video row into
+the ORM and delete them one at a time. :func:`delete_rooms` instead issues a
+``DELETE ... WHERE room_id IN (...)`` per child table (lowering the
+reference counts of the video blobs they point at) and then deletes the
+rooms, all in one transaction, and afterwards drops the rooms' in-memory
+state (playback, presence, cached lookups) and closes their Socket.IO rooms.
+
+Bulk deletes from the admin API run as a :class:`PurgeJob` in a background
+task, one transaction per ``BATCH_SIZE`` rooms, so a large purge never holds
+one long transaction and its progress can be polled.
+"""
+
+import itertools
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, or_, select
+
+from admin_stats import admin_stats
+from app import db, socketio
+from video_store import video_store
+
+# Rooms deleted per transaction by a purge job
+BATCH_SIZE = 50
+
+# Finished jobs are kept this long (seconds) so their result can still be polled
+JOB_RETENTION = 3600
+
+
+def delete_rooms(room_ids):
+    """Delete rooms and everything that belongs to them; returns the deleted room codes"""
+    from models import ArchivedChatMessage, ChatMessage, Room, RoomMember, VideoFile
+
+    room_ids = list(room_ids)
+    if not room_ids:
+        return []
+    room_codes = db.session.execute(
+        select(Room.room_code).where(Room.id.in_(room_ids))).scalars().all()
+    try:
+        # Blob reference counts drop in the same transaction as the rows
+        video_store.drop_references(VideoFile.room_id.in_(room_ids))
+        for model in (ChatMessage, ArchivedChatMessage, RoomMember, VideoFile, Room):
+            column = model.id if model is Room else model.room_id
+            db.session.execute(delete(model).where(column.in_(room_ids))
+                               .execution_options(synchronize_session=False))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    for room_code in room_codes:
+        forget_room(room_code)
+    admin_stats.invalidate()
+    return room_codes
+
+
+def forget_room(room_code):
+    """Drop a deleted room's in-memory state and close its Socket.IO room"""
+    from playback import playback_store
+    from presence import presence_registry
+    from room_context import room_contexts
+
+    playback_store.forget(room_code)
+    presence_registry.forget_room(room_code)
+    room_contexts.invalidate(room_code)
+    socketio.close_room(room_code)
+
+
+def idle_room_ids(idle_for):
+    """
+    Ids of rooms with no state change, no chat and nobody connected since ``idle_for`` ago.
+
+    Connections are judged from ``last_active_at``, which every worker stamps
+    for its rooms every ``ACTIVITY_INTERVAL`` seconds; rooms stamped within
+    the last two intervals, and rooms with sockets in this process, are
+    never idle whatever ``idle_for`` is.
+    """
+    from models import ChatMessage, Room
+    from playback import ACTIVITY_INTERVAL
+    from presence import presence_registry
+
+    now = datetime.now()
+    cutoff = now - idle_for
+    active_cutoff = min(cutoff, now - timedelta(seconds=2 * ACTIVITY_INTERVAL))
+    recent_chat = select(ChatMessage.id).where(ChatMessage.room_id == Room.id,
+                                               ChatMessage.created_at >= cutoff)
+    rows = db.session.execute(select(Room.id, Room.room_code)
+                              .where(Room.updated_at < cutoff, ~recent_chat.exists(),
+                                     or_(Room.last_active_at.is_(None),
+                                         Room.last_active_at < active_cutoff))
+                              .order_by(Room.id)).all()
+    active = set(presence_registry.active_rooms())
+    return [room_id for room_id, room_code in rows if room_code not in active]
+
+
+class PurgeJob:
+    """Progress of one bulk delete (``processed`` ids, of which ``deleted`` still existed)"""
+
+    __slots__ = ('id', 'room_ids', 'processed', 'deleted', 'status', 'error', 'started_at', 'finished_at')
+
+    def __init__(self, id, room_ids):
+        self.id = id
+        self.room_ids = room_ids
+        self.processed = 0
+        self.deleted = 0
+        self.status = 'pending'
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'total': len(self.room_ids),
+            'processed': self.processed,
+            'deleted': self.deleted,
+            'error': self.error,
+        }
+
+
+class PurgeJobs:
+    """Process-wide registry of bulk delete jobs"""
+
+    def __init__(self):
+        self._jobs = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def start(self, room_ids):
+        """Queue a background delete of ``room_ids`` and return its job"""
+        now = time.time()
+        with self._lock:
+            for job_id in [job.id for job in self._jobs.values()
+                           if job.finished_at and now - job.finished_at > JOB_RETENTION]:
+                del self._jobs[job_id]
+            job = PurgeJob(next(self._ids), list(room_ids))
+            self._jobs[job.id] = job
+        socketio.start_background_task(self._run, current_app._get_current_object(), job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, app, job):
+        job.status = 'running'
+        with app.app_context():
+            try:
+                for start in range(0, len(job.room_ids), BATCH_SIZE):
+                    batch = job.room_ids[start:start + BATCH_SIZE]
+                    job.deleted += len(delete_rooms(batch))
+                    job.processed += len(batch)
+                    # Let sockets and requests run between batches
+                    socketio.sleep(0)
+                job.status = 'done'
+            except Exception as e:
+                logging.error(f"Room purge job {job.id} failed: {e}")
+                job.status = 'failed'
+                job.error = str(e)
+            finally:
+                db.session.remove()
+                job.finished_at = time.time()
+        logging.info(f"Room purge job {job.id} {job.status}: {job.deleted} of {len(job.room_ids)} rooms deleted")
+
+
+purge_jobs = PurgeJobs()
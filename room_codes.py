@@ -0,0 +1,106 @@
+"""
+Room code allocation without probing the database.
+
+Codes are six base-36 characters, i.e. numbers below 36**6. Each code is
+the next value of the ``room_codes`` row of the ``counters`` table mapped
+through a keyed permutation of that range (a 32-bit Feistel network with
+cycle walking), so consecutive codes look unrelated. The counter is shared
+by every worker and survives restarts, and the key is derived from
+``SECRET_KEY``, so as long as the secret stays the same no two rooms are
+ever given the same code. Only codes from the old random generator (or from
+before a secret change) can still clash; ``create_room`` relies on the
+unique index for those and simply takes the next code.
+"""
+
+import hashlib
+import string
+import threading
+
+from flask import current_app
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+
+ALPHABET = string.ascii_uppercase + string.digits
+CODE_LENGTH = 6
+CODE_SPACE = len(ALPHABET) ** CODE_LENGTH  # 2,176,782,336 < 2**32
+COUNTER_NAME = 'room_codes'
+
+
+def encode(number):
+    """Fixed-width base-36 representation of a number below CODE_SPACE"""
+    chars = []
+    for _ in range(CODE_LENGTH):
+        number, digit = divmod(number, len(ALPHABET))
+        chars.append(ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+
+class RoomCodeAllocator:
+    """Hands out distinct room codes from a keyed permutation of a shared counter"""
+
+    ROUNDS = 4
+
+    def __init__(self, key=None):
+        self._key = self._derive(key) if key is not None else None
+        self._derived = {}  # SECRET_KEY -> permutation key
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _derive(secret):
+        if isinstance(secret, str):
+            secret = secret.encode()
+        return hashlib.blake2b(secret, digest_size=16, person=b'room-codes').digest()
+
+    @property
+    def key(self):
+        """Permutation key: fixed at construction, else derived from the app's SECRET_KEY"""
+        if self._key is not None:
+            return self._key
+        secret = current_app.config['SECRET_KEY']
+        with self._lock:
+            key = self._derived.get(secret)
+            if key is None:
+                key = self._derived[secret] = self._derive(secret)
+        return key
+
+    def next_code(self):
+        """Code for the next counter value, taken in the caller's transaction"""
+        return encode(self.permute(self.next_number()))
+
+    def next_number(self):
+        """Increment the shared counter and return its previous value"""
+        from models import Counter
+
+        bump = update(Counter).where(Counter.name == COUNTER_NAME)\
+                              .values(value=Counter.value + 1).returning(Counter.value)
+        value = db.session.execute(bump).scalar()
+        if value is None:
+            # First code on a database whose counter row has not been created yet
+            try:
+                with db.session.begin_nested():
+                    db.session.add(Counter(name=COUNTER_NAME, value=0))
+            except IntegrityError:
+                pass  # created by another worker meanwhile
+            value = db.session.execute(bump).scalar_one()
+        return (value - 1) % CODE_SPACE
+
+    def permute(self, number):
+        """Bijection on [0, CODE_SPACE): Feistel over 32 bits, re-applied until in range"""
+        key = self.key
+        number = self._feistel(number, key)
+        while number >= CODE_SPACE:
+            number = self._feistel(number, key)
+        return number
+
+    def _feistel(self, number, key):
+        left, right = number >> 16, number & 0xFFFF
+        for round_number in range(self.ROUNDS):
+            digest = hashlib.blake2b(bytes((round_number,)) + right.to_bytes(2, 'big'),
+                                     key=key, digest_size=2).digest()
+            left, right = right, left ^ int.from_bytes(digest, 'big')
+        return (left << 16) | right
+
+
+room_codes = RoomCodeAllocator()
@@ -0,0 +1,118 @@
+"""
+Room and membership lookup for the ``/room/<room_code>/...`` routes.
+
+``room_contexts.resolve`` loads a room together with the caller's membership
+in one joined query and keeps the compact result in a process-wide map for
+``ROOM_CONTEXT_TTL`` seconds, so polling endpoints answer without touching
+the database. Entries are dropped whenever a membership changes in this
+process; with several workers the TTL bounds how long another worker's
+change can go unnoticed.
+"""
+
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import and_
+
+from app import db
+
+# Expired entries are swept once the map grows past this many keys
+MAX_ENTRIES = 10000
+
+
+class RoomRef:
+    """The room columns the routes and room template need"""
+
+    __slots__ = ('id', 'room_code', 'name', 'host_id')
+
+    def __init__(self, id, room_code, name, host_id):
+        self.id = id
+        self.room_code = room_code
+        self.name = name
+        self.host_id = host_id
+
+
+class MemberRef:
+    """The caller's membership row, if any"""
+
+    __slots__ = ('id', 'role', 'is_approved')
+
+    def __init__(self, id, role, is_approved):
+        self.id = id
+        self.role = role
+        self.is_approved = is_approved
+
+
+class RoomContext:
+    """A room as seen by one user"""
+
+    __slots__ = ('room', 'member', 'expires_at')
+
+    def __init__(self, room, member, expires_at):
+        self.room = room
+        self.member = member
+        self.expires_at = expires_at
+
+    @property
+    def is_member(self):
+        return self.member is not None and bool(self.member.is_approved)
+
+    @property
+    def is_host(self):
+        return self.is_member and self.member.role == 'host'
+
+
+class RoomContextCache:
+    """Process-wide TTL map of (room_code, user_id) -> RoomContext"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, room_code, user_id):
+        """Return the RoomContext for a user, or None if the room does not exist"""
+        key = (room_code.upper(), user_id)
+        now = time.monotonic()
+        with self._lock:
+            context = self._entries.get(key)
+        if context is not None and context.expires_at > now:
+            return context
+
+        from models import Room, RoomMember
+        row = db.session.query(Room.id, Room.room_code, Room.name, Room.host_id,
+                               RoomMember.id, RoomMember.role, RoomMember.is_approved)\
+                        .outerjoin(RoomMember, and_(RoomMember.room_id == Room.id,
+                                                    RoomMember.user_id == user_id))\
+                        .filter(Room.room_code == key[0]).first()
+        if row is None:
+            self.invalidate(key[0], user_id)
+            return None
+
+        member = MemberRef(*row[4:]) if row[4] is not None else None
+        context = RoomContext(RoomRef(*row[:4]), member,
+                              now + current_app.config.get('ROOM_CONTEXT_TTL', 30))
+        with self._lock:
+            if len(self._entries) >= MAX_ENTRIES:
+                self._entries = {k: v for k, v in self._entries.items() if v.expires_at > now}
+            self._entries[key] = context
+        return context
+
+    def invalidate(self, room_code, user_id=None):
+        """Drop one user's entry for a room, or every entry for the room"""
+        room_code = room_code.upper()
+        with self._lock:
+            if user_id is not None:
+                self._entries.pop((room_code, user_id), None)
+            else:
+                for key in [key for key in self._entries if key[0] == room_code]:
+                    del self._entries[key]
+
+    def invalidate_user(self, user_id):
+        """Drop every entry for a user (e.g. banned)"""
+        with self._lock:
+            for key in [key for key in self._entries if key[1] == user_id]:
+                del self._entries[key]
+
+
+room_contexts = RoomContextCache()
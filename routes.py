@@ -1,21 +1,42 @@
+import logging
 import os
 import re
-from datetime import datetime
+from datetime import datetime, timedelta
 from urllib.parse import urlparse, parse_qs
-from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask import (
-    session, render_template, request, redirect, url_for, 
-    flash, jsonify, send_from_directory, abort
+    Blueprint, current_app, session, render_template, request, redirect, url_for, 
+    flash, jsonify, abort
 )
 from flask_login import login_user, logout_user, login_required, current_user
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 
-from app import app, db
-from models import Room, RoomMember, ChatMessage, VideoFile, User
+from app import db, socketio, broadcast_member_left, evict_sockets
+from models import Room, RoomMember, ChatMessage, ArchivedChatMessage, VideoFile, User
+from playback import playback_store, server_time_ms
+from presence import presence_registry
+from admin_stats import admin_stats
+from chat_retention import chat_retention
+from chat_writer import chat_writer
+from chunked_upload import OffsetMismatch, upload_sessions
+from pagination import paginate_keyset
+from room_cleanup import delete_rooms, idle_room_ids, purge_jobs
+from room_context import room_contexts
+from storage_sweeper import storage_sweeper
+from user_cache import user_cache
+from video_index import video_indexer
+from video_serving import video_server
+from video_store import video_store
 
-from dotenv import load_dotenv
-load_dotenv()
-app.secret_key = os.environ.get("SESSION_SECRET", "fallback_key")
+bp = Blueprint('main', __name__)
+
+# Chat messages per page (room load, polling, scroll-back) and the most a client may ask for
+MESSAGE_PAGE_SIZE = 50
+MAX_MESSAGE_PAGE_SIZE = 200
+
+# Rows per page of the admin user and room tables
+ADMIN_PAGE_SIZE = 20
 
 # Admin decorator
 def admin_required(f):
@@ -24,15 +45,19 @@ def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if not current_user.is_authenticated:
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
         if not hasattr(current_user, 'is_admin') or not current_user.is_admin:
             flash('Admin access required', 'error')
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
         return f(*args, **kwargs)
     return decorated_function
 
+def broadcast_chat_message(room_code, message, user_name=None):
+    """Push a committed chat message to every socket in the room"""
+    socketio.emit('new_message', message.to_dict(user_name), to=room_code)
+
 # Make session permanent
-@app.before_request
+@bp.before_app_request
 def make_session_permanent():
     session.permanent = True
 
@@ -40,7 +65,7 @@ def make_session_permanent():
 
 
 
-@app.route('/')
+@bp.route('/')
 def index():
     """Landing page for logged out users, home page for logged in users"""
     if not current_user.is_authenticated:
@@ -48,7 +73,9 @@ def index():
     
     # Show user's rooms
     user_rooms = []
-    memberships = RoomMember.query.filter_by(user_id=current_user.id, is_approved=True).all()
+    memberships = RoomMember.query.options(joinedload(RoomMember.room))\
+                                  .filter_by(user_id=current_user.id, is_approved=True).all()
+    Room.load_member_counts([membership.room for membership in memberships])
     for membership in memberships:
         user_rooms.append({
             'room': membership.room,
@@ -58,11 +85,11 @@ def index():
     return render_template('index.html', show_landing=False, user_rooms=user_rooms)
 
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     """Login page"""
     if current_user.is_authenticated:
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     
     if request.method == 'POST':
         username = request.form.get('username', '').strip()
@@ -75,20 +102,23 @@ def login():
         user = User.query.filter_by(username=username).first()
         
         if user and user.check_password(password):
+            if user.is_banned:
+                flash('This account has been banned', 'error')
+                return render_template('auth/login.html')
             login_user(user, remember=True)
             next_page = request.args.get('next')
-            return redirect(next_page) if next_page else redirect(url_for('index'))
+            return redirect(next_page) if next_page else redirect(url_for('main.index'))
         else:
             flash('Invalid username or password', 'error')
     
     return render_template('auth/login.html')
 
 
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     """Registration page"""
     if current_user.is_authenticated:
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     
     if request.method == 'POST':
         username = request.form.get('username', '').strip()
@@ -128,21 +158,21 @@ def register():
         
         login_user(user, remember=True)
         flash('Registration successful! Welcome to WatchWithMe!', 'success')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     
     return render_template('auth/register.html')
 
 
-@app.route('/logout')
+@bp.route('/logout')
 @login_required
 def logout():
     """Logout user"""
     logout_user()
     flash('You have been logged out', 'info')
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
 
-@app.route('/create-room', methods=['GET', 'POST'])
+@bp.route('/create-room', methods=['GET', 'POST'])
 @login_required
 def create_room():
     """Create a new room"""
@@ -152,22 +182,31 @@ def create_room():
         
         if not room_name:
             flash('Room name is required', 'error')
-            return redirect(url_for('index'))
-        
-        # Generate unique room code
-        room_code = Room.generate_room_code()
+            return redirect(url_for('main.index'))
         
         # Create new room
         room = Room()
-        room.room_code = room_code
         room.name = room_name
         room.host_id = current_user.id
         
         if room_password:
             room.password = generate_password_hash(room_password)
         
-        db.session.add(room)
-        db.session.commit()
+        # Codes come from a collision-free sequence shared by all workers; only a
+        # code left by the old random generator can clash, which costs a retry
+        for _ in range(5):
+            room.room_code = Room.generate_room_code()
+            try:
+                with db.session.begin_nested():
+                    db.session.add(room)
+                break
+            except IntegrityError:
+                continue
+        else:
+            db.session.rollback()
+            flash('Could not allocate a room code, please try again', 'error')
+            return redirect(url_for('main.index'))
+        room_code = room.room_code
         
         # Add host as approved member
         host_member = RoomMember()
@@ -186,12 +225,12 @@ def create_room():
         db.session.commit()
         
         flash(f'Room created successfully! Room code: {room_code}', 'success')
-        return redirect(url_for('room', room_code=room_code))
+        return redirect(url_for('main.room', room_code=room_code))
     
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
 
-@app.route('/join-room', methods=['POST'])
+@bp.route('/join-room', methods=['POST'])
 @login_required
 def join_room():
     """Join an existing room"""
@@ -200,27 +239,27 @@ def join_room():
     
     if not room_code:
         flash('Room code is required', 'error')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     
     room = Room.query.filter_by(room_code=room_code).first()
     if not room:
         flash('Room not found', 'error')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     
     # Check if user is already a member
     existing_member = room.get_member(current_user.id)
     if existing_member:
         if existing_member.is_approved:
-            return redirect(url_for('room', room_code=room_code))
+            return redirect(url_for('main.room', room_code=room_code))
         else:
             flash('Your request to join this room is pending approval', 'info')
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
     
     # Check password if required
     if room.password:
         if not room_password or not check_password_hash(room.password, room_password):
             flash('Incorrect room password', 'error')
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
     
     # Add user as member
     member = RoomMember()
@@ -237,168 +276,176 @@ def join_room():
     join_msg.message_type = 'system'
     db.session.add(join_msg)
     db.session.commit()
+    broadcast_chat_message(room.room_code, join_msg)
     
-    return redirect(url_for('room', room_code=room_code))
+    room_contexts.invalidate(room.room_code, current_user.id)
+    presence, info = presence_registry.add_member(room.room_code, member, current_user)
+    if info is not None:
+        socketio.emit('member_joined',
+                      dict(presence_registry.counts(presence), member=info.to_dict()),
+                      to=room.room_code)
+    
+    return redirect(url_for('main.room', room_code=room_code))
 
 
-@app.route('/room/<room_code>')
+@bp.route('/room/<room_code>')
 @login_required
 def room(room_code):
     """Display room interface"""
-    room = Room.query.filter_by(room_code=room_code.upper()).first()
-    if not room:
+    context = room_contexts.resolve(room_code, current_user.id)
+    if context is None:
         flash('Room not found', 'error')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     
     # Check if user is a member
-    member = room.get_member(current_user.id)
-    if not member or not member.is_approved:
+    if not context.is_member:
         flash('You are not authorized to access this room', 'error')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
+    room = context.room
+    playback = playback_store.get(room.room_code)
+    if playback is None:
+        flash('Room not found', 'error')
+        return redirect(url_for('main.index'))
+    chat_retention.ensure_started()
+    storage_sweeper.ensure_started()
     
     # Get room members
-    members = RoomMember.query.filter_by(room_id=room.id, is_approved=True).all()
+    presence = presence_registry.roster(room.room_code)
+    members = presence_registry.member_list(presence)
     
-    # Get recent chat messages (last 50)
-    messages = ChatMessage.query.filter_by(room_id=room.id)\
-                                .order_by(ChatMessage.created_at.desc())\
-                                .limit(50).all()
+    # Get recent chat messages (older ones load on scroll-back)
+    messages = ChatMessage.query.options(joinedload(ChatMessage.user))\
+                                .filter_by(room_id=room.id)\
+                                .order_by(ChatMessage.id.desc())\
+                                .limit(MESSAGE_PAGE_SIZE).all()
     messages.reverse()  # Show oldest first
     
     return render_template('room.html', 
                           room=room, 
-                          member=member, 
+                          member=context.member, 
                           members=members,
-                          messages=messages)
+                          messages=messages,
+                          playback=playback)
 
 
-@app.route('/room/<room_code>/send-message', methods=['POST'])
+@bp.route('/room/<room_code>/send-message', methods=['POST'])
 @login_required
 def send_message(room_code):
     """Send a chat message"""
-    room = Room.query.filter_by(room_code=room_code.upper()).first()
-    if not room:
+    context = room_contexts.resolve(room_code, current_user.id)
+    if context is None:
         return jsonify({'error': 'Room not found'}), 404
     
-    member = room.get_member(current_user.id)
-    if not member or not member.is_approved:
+    if not context.is_member:
         return jsonify({'error': 'Not authorized'}), 403
+    room = context.room
     
     data = request.get_json() or {}
     message_text = data.get('message', '').strip()
     if not message_text:
         return jsonify({'error': 'Message cannot be empty'}), 400
     
-    # Create message
-    message = ChatMessage()
-    message.room_id = room.id
-    message.user_id = current_user.id
-    message.message = message_text
-    message.message_type = 'user'
-    db.session.add(message)
-    db.session.commit()
+    # Create message (group-committed with other messages sent at the same time)
+    try:
+        message = chat_writer.save(room.id, current_user.id, message_text)
+    except Exception:
+        logging.exception("Error saving chat message")
+        return jsonify({'error': 'Message could not be saved'}), 500
+    broadcast_chat_message(room.room_code, message, current_user.display_name)
     
-    return jsonify({
-        'id': message.id,
-        'user_name': current_user.display_name,
-        'message': message.message,
-        'time': message.formatted_time,
-        'type': message.message_type
-    })
+    return jsonify(message.to_dict(current_user.display_name))
 
 
-@app.route('/room/<room_code>/messages')
+@bp.route('/room/<room_code>/messages')
 @login_required
 def get_messages(room_code):
-    """Get recent chat messages (for polling)"""
-    room = Room.query.filter_by(room_code=room_code.upper()).first()
-    if not room:
+    """Get chat messages after an ID (polling fallback) or before one (history scroll-back)"""
+    context = room_contexts.resolve(room_code, current_user.id)
+    if context is None:
         return jsonify({'error': 'Room not found'}), 404
     
-    member = room.get_member(current_user.id)
-    if not member or not member.is_approved:
+    if not context.is_member:
         return jsonify({'error': 'Not authorized'}), 403
+    room = context.room
     
-    # Get messages after a certain ID (for polling)
-    after_id = request.args.get('after_id', 0, type=int)
-    messages = ChatMessage.query.filter_by(room_id=room.id)\
-                                .filter(ChatMessage.id > after_id)\
-                                .order_by(ChatMessage.created_at.asc())\
-                                .all()
+    # Oldest first either way; fewer than limit messages means there are no more.
+    # Without a cursor this is the latest page, as on the room page
+    after_id = request.args.get('after_id', type=int)
+    before_id = request.args.get('before_id', type=int)
+    limit = max(1, min(request.args.get('limit', MESSAGE_PAGE_SIZE, type=int), MAX_MESSAGE_PAGE_SIZE))
+    page = paginate_keyset(ChatMessage.query.options(joinedload(ChatMessage.user)).filter_by(room_id=room.id),
+                           ChatMessage.id, limit, after=after_id, before=before_id,
+                           last=after_id is None and before_id is None)
+    messages = page.items
     
-    return jsonify([{
-        'id': msg.id,
-        'user_name': msg.user.display_name if msg.user else 'System',
-        'message': msg.message,
-        'time': msg.formatted_time,
-        'type': msg.message_type
-    } for msg in messages])
+    # Scroll-back continues into the archive once the hot table runs out;
+    # archived ids are always below the ones still in chat_messages
+    if before_id is not None and len(messages) < limit:
+        older_than = messages[0].id if messages else before_id
+        archived = ArchivedChatMessage.query.options(joinedload(ArchivedChatMessage.user))\
+                                            .filter_by(room_id=room.id)\
+                                            .filter(ArchivedChatMessage.id < older_than)\
+                                            .order_by(ArchivedChatMessage.id.desc())\
+                                            .limit(limit - len(messages)).all()
+        messages = archived[::-1] + messages
+    
+    return jsonify([msg.to_dict() for msg in messages])
 
 
-@app.route('/room/<room_code>/video-sync')
+@bp.route('/room/<room_code>/video-sync')
 @login_required
 def get_video_sync(room_code):
     """Get current video state for synchronization"""
-    room = Room.query.filter_by(room_code=room_code.upper()).first()
-    if not room:
+    context = room_contexts.resolve(room_code, current_user.id)
+    if context is None:
         return jsonify({'error': 'Room not found'}), 404
     
-    member = room.get_member(current_user.id)
-    if not member or not member.is_approved:
+    if not context.is_member:
         return jsonify({'error': 'Not authorized'}), 403
+    room = context.room
     
-    # Calculate current time based on when the video was last synced
-    current_time = room.current_video_time or 0
-    if room.is_playing and room.last_sync_time:
-        elapsed_seconds = (datetime.now() - room.last_sync_time).total_seconds()
-        current_time += elapsed_seconds
+    # Current time is extrapolated from when the video was last synced
+    state = playback_store.get(room.room_code)
+    if state is None:
+        # Deleted while another worker's room context still had it cached
+        return jsonify({'error': 'Room not found'}), 404
+    server_time = server_time_ms()
     
     return jsonify({
-        'video_url': room.current_video_url,
-        'video_type': room.current_video_type,
-        'current_time': current_time,
-        'is_playing': room.is_playing,
-        'last_sync': room.last_sync_time.isoformat() if room.last_sync_time else None
+        'video_url': state.video_url,
+        'video_type': state.video_type,
+        'current_time': state.position(server_time),
+        'is_playing': state.is_playing,
+        'server_time': server_time,
+        'last_sync': state.last_sync_time.isoformat() if state.last_sync_time else None
     })
 
 
-@app.route('/room/<room_code>/video-control', methods=['POST'])
+@bp.route('/room/<room_code>/video-control', methods=['POST'])
 @login_required
 def video_control(room_code):
     """Control video playback (host only)"""
-    room = Room.query.filter_by(room_code=room_code.upper()).first()
-    if not room:
+    context = room_contexts.resolve(room_code, current_user.id)
+    if context is None:
         return jsonify({'error': 'Room not found'}), 404
     
-    member = room.get_member(current_user.id)
-    if not member or not member.is_approved:
+    if not context.is_member:
         return jsonify({'error': 'You must be an approved member to control video'}), 403
+    room = context.room
     
     # Only host can control video playback
-    if member.role != 'host':
+    if not context.is_host:
         return jsonify({'error': 'Only the host can control video playback'}), 403
     
     data = request.get_json() or {}
     action = data.get('action')
     
-    if action == 'play':
-        room.is_playing = True
-        room.current_video_time = data.get('time', 0)
-        room.last_sync_time = datetime.now()
-        
-    elif action == 'pause':
-        room.is_playing = False
-        room.current_video_time = data.get('time', 0)
-        room.last_sync_time = datetime.now()
-        
-    elif action == 'seek':
-        room.current_video_time = data.get('time', 0)
-        room.last_sync_time = datetime.now()
-        
-    elif action == 'heartbeat':
-        # Host sending current video position to keep time synced
-        room.current_video_time = data.get('time', 0)
-        room.last_sync_time = datetime.now()
+    # Playback changes only touch the in-memory state; the playback
+    # flusher writes them back to the rooms table in batches
+    if action in ('play', 'pause', 'seek', 'heartbeat'):
+        # Heartbeat: host sending current video position to keep time synced
+        if playback_store.control(room.room_code, action, data.get('time', 0)) is None:
+            return jsonify({'error': 'Room not found'}), 404
         
     elif action == 'load_youtube':
         youtube_url = data.get('url', '').strip()
@@ -406,11 +453,8 @@ def video_control(room_code):
         if not video_id:
             return jsonify({'error': 'Invalid YouTube URL'}), 400
         
-        room.current_video_url = youtube_url
-        room.current_video_type = 'youtube'
-        room.current_video_time = 0
-        room.is_playing = False
-        room.last_sync_time = datetime.now()
+        if playback_store.change_video(room.room_code, youtube_url, 'youtube') is None:
+            return jsonify({'error': 'Room not found'}), 404
         
         # Add system message
         system_msg = ChatMessage()
@@ -418,30 +462,36 @@ def video_control(room_code):
         system_msg.message = f"{current_user.display_name} loaded a new YouTube video"
         system_msg.message_type = 'system'
         db.session.add(system_msg)
+        db.session.commit()
+        broadcast_chat_message(room.room_code, system_msg)
     
     else:
         return jsonify({'error': 'Invalid action'}), 400
     
-    db.session.commit()
     return jsonify({'success': True})
 
 
-@app.route('/room/<room_code>/upload-video', methods=['POST'])
+@bp.route('/room/<room_code>/upload-video', methods=['POST'])
 @login_required
 def upload_video(room_code):
     """Upload a local video file (host only)"""
-    room = Room.query.filter_by(room_code=room_code.upper()).first()
-    if not room:
+    context = room_contexts.resolve(room_code, current_user.id)
+    if context is None:
         return jsonify({'error': 'Room not found'}), 404
     
-    member = room.get_member(current_user.id)
-    if not member or not member.is_approved:
+    if not context.is_member:
         return jsonify({'error': 'You must be an approved member to upload videos'}), 403
+    room = context.room
     
     # Only host can upload videos
-    if member.role != 'host':
+    if not context.is_host:
         return jsonify({'error': 'Only the host can upload videos'}), 403
     
+    # Checked before the body is read, from the declared request size
+    quota_error = video_store.quota_error(room.id, current_user.id, request.content_length or 0)
+    if quota_error:
+        return jsonify({'error': quota_error}), 413
+    
     if 'video' not in request.files:
         return jsonify({'error': 'No video file provided'}), 400
     
@@ -450,64 +500,198 @@ def upload_video(room_code):
         return jsonify({'error': 'No file selected'}), 400
     
     if file and file.filename and allowed_video_file(file.filename):
-        filename = secure_filename(file.filename)
-        # Add timestamp to avoid conflicts
-        filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{filename}"
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
-        # Ensure upload directory exists
-        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-        
-        file.save(file_path)
-        
-        # Save video info to database
-        video_file = VideoFile()
-        video_file.filename = filename
-        video_file.original_filename = file.filename
-        video_file.file_path = file_path
-        video_file.file_size = os.path.getsize(file_path)
-        video_file.uploaded_by = current_user.id
-        video_file.room_id = room.id
-        db.session.add(video_file)
-        
-        # Update room video state
-        video_url = url_for('serve_video', filename=filename)
-        room.current_video_url = video_url
-        room.current_video_type = 'local'
-        room.current_video_time = 0
-        room.is_playing = False
-        room.last_sync_time = datetime.now()
+        # Hash while copying out of Werkzeug's spool; duplicates are stored once
+        part_path, digest, _ = upload_sessions.spool(file.stream)
+        blob = video_store.store(part_path, digest, file.filename)
         
-        # Add system message
-        system_msg = ChatMessage()
-        system_msg.room_id = room.id
-        system_msg.message = f"{current_user.display_name} uploaded video: {file.filename}"
-        system_msg.message_type = 'system'
-        db.session.add(system_msg)
-        db.session.commit()
-        
-        return jsonify({'success': True, 'video_url': room.current_video_url})
+        video_url = publish_uploaded_video(room, blob, file.filename)
+        return jsonify({'success': True, 'video_url': video_url})
     
     return jsonify({'error': 'Invalid file type'}), 400
 
 
-@app.route('/uploads/<filename>')
+def publish_uploaded_video(room, blob, original_filename):
+    """Record an upload of a referenced blob, switch the room to it and post it in chat; returns the URL"""
+    # Save video info to database
+    video_file = VideoFile()
+    video_file.filename = blob.filename
+    video_file.original_filename = original_filename
+    video_file.file_path = video_store.path(blob)
+    video_file.file_size = blob.size
+    video_file.uploaded_by = current_user.id
+    video_file.room_id = room.id
+    video_file.blob_id = blob.id
+    db.session.add(video_file)
+    
+    # Update room video state
+    video_url = url_for('main.serve_video', filename=blob.filename)
+    playback_store.change_video(room.room_code, video_url, 'local')
+    
+    # Add system message
+    system_msg = ChatMessage()
+    system_msg.room_id = room.id
+    system_msg.message = f"{current_user.display_name} uploaded video: {original_filename}"
+    system_msg.message_type = 'system'
+    db.session.add(system_msg)
+    db.session.commit()
+    broadcast_chat_message(room.room_code, system_msg)
+    
+    # Duration, codecs and keyframe table, once per stored content, outside the transaction
+    video_indexer.schedule(blob)
+    return video_url
+
+
+def announce_video_change(room_code, video_url, skip_sid=None):
+    """Tell the room's sockets (except the uploader's, which switches itself) about a new upload"""
+    payload = {
+        'video_url': video_url,
+        'video_type': 'local',
+        'changed_by': current_user.id
+    }
+    payload.update(video_indexer.hints(video_url, 0, header=True) or {})
+    socketio.emit('video_changed', payload, to=room_code, skip_sid=skip_sid)
+
+
+def host_upload_context(room_code):
+    """(room context, error response) for the chunked upload routes, which are host only"""
+    context = room_contexts.resolve(room_code, current_user.id)
+    if context is None:
+        return None, (jsonify({'error': 'Room not found'}), 404)
+    if not context.is_host:
+        return None, (jsonify({'error': 'Only the host can upload videos'}), 403)
+    return context, None
+
+
+def owned_upload(room_code, upload_id):
+    """The current user's upload in progress for this room, or None"""
+    upload = upload_sessions.get(upload_id)
+    if upload is None or upload.room_code != room_code.upper() or upload.user_id != current_user.id:
+        return None
+    return upload
+
+
+@bp.route('/room/<room_code>/uploads', methods=['POST'])
+@login_required
+def start_upload(room_code):
+    """Open a chunked upload (host only), or publish at once if the given sha256 is already stored"""
+    context, error = host_upload_context(room_code)
+    if error:
+        return error
+    
+    data = request.get_json(silent=True) or {}
+    filename = (data.get('filename') or '').strip()
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'File size is required'}), 400
+    
+    if not filename or not allowed_video_file(filename):
+        return jsonify({'error': 'Invalid file type'}), 400
+    if size <= 0 or size > current_app.config['MAX_CONTENT_LENGTH']:
+        return jsonify({'error': 'File is empty or too large'}), 400
+    
+    quota_error = video_store.quota_error(context.room.id, current_user.id, size)
+    if quota_error:
+        return jsonify({'error': quota_error}), 413
+    
+    # A browser that hashed the file first skips the upload when the content is already stored
+    digest = data.get('sha256')
+    blob = video_store.claim(digest, size) if digest and re.fullmatch(r'[0-9a-fA-F]{64}', digest) else None
+    if blob is not None:
+        video_url = publish_uploaded_video(context.room, blob, filename)
+        announce_video_change(context.room.room_code, video_url, skip_sid=data.get('sid'))
+        return jsonify({'success': True, 'video_url': video_url, 'deduplicated': True})
+    
+    upload = upload_sessions.start(context.room.room_code, current_user.id, filename, size)
+    return jsonify(dict(upload.to_dict(), chunk_size=current_app.config['UPLOAD_CHUNK_SIZE'])), 201
+
+
+@bp.route('/room/<room_code>/uploads/<upload_id>', methods=['GET'])
+@login_required
+def upload_status(room_code, upload_id):
+    """How much of an upload the server has, so the client can resume from there"""
+    upload = owned_upload(room_code, upload_id)
+    if upload is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    return jsonify(upload.to_dict())
+
+
+@bp.route('/room/<room_code>/uploads/<upload_id>', methods=['PUT'])
+@login_required
+def upload_chunk(room_code, upload_id):
+    """Append the raw request body to an upload at ?offset=N"""
+    upload = owned_upload(room_code, upload_id)
+    if upload is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    
+    offset = request.args.get('offset', type=int)
+    if offset is None:
+        return jsonify({'error': 'offset is required'}), 400
+    try:
+        upload_sessions.write(upload, offset, request.stream)
+    except OffsetMismatch as e:
+        return jsonify({'error': 'Offset does not match the stored upload', 'offset': e.offset}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(upload.to_dict())
+
+
+@bp.route('/room/<room_code>/uploads/<upload_id>', methods=['DELETE'])
+@login_required
+def cancel_upload(room_code, upload_id):
+    """Abandon an upload and delete its stored chunks"""
+    upload = owned_upload(room_code, upload_id)
+    if upload is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    upload_sessions.discard(upload)
+    return jsonify({'success': True})
+
+
+@bp.route('/room/<room_code>/uploads/<upload_id>/finalize', methods=['POST'])
+@login_required
+def finalize_upload(room_code, upload_id):
+    """Publish a complete upload as the room's video and tell the room to switch to it"""
+    context, error = host_upload_context(room_code)
+    if error:
+        return error
+    upload = owned_upload(room_code, upload_id)
+    if upload is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    
+    data = request.get_json(silent=True) or {}
+    # Checked again: other uploads may have finished since this one started
+    quota_error = video_store.quota_error(context.room.id, current_user.id, upload.size)
+    if quota_error:
+        upload_sessions.discard(upload)
+        return jsonify({'error': quota_error}), 413
+    try:
+        part_path, digest = upload_sessions.finish(upload)
+    except OffsetMismatch as e:
+        return jsonify({'error': 'Upload is incomplete', 'offset': e.offset}), 409
+    blob = video_store.store(part_path, digest, upload.filename)
+    
+    video_url = publish_uploaded_video(context.room, blob, upload.filename)
+    announce_video_change(context.room.room_code, video_url, skip_sid=data.get('sid'))
+    return jsonify({'success': True, 'video_url': video_url, 'sha256': digest, 'size': upload.size})
+
+
+@bp.route('/uploads/<filename>')
 def serve_video(filename):
-    """Serve uploaded video files"""
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    """Serve uploaded video files (ranges, conditional requests, sendfile or proxy offload)"""
+    return video_server.send(current_app.config['UPLOAD_FOLDER'], filename)
 
 
-@app.route('/room/<room_code>/leave', methods=['POST'])
+@bp.route('/room/<room_code>/leave', methods=['POST'])
 @login_required
 def leave_room(room_code):
     """Leave a room"""
-    room = Room.query.filter_by(room_code=room_code.upper()).first()
-    if not room:
+    context = room_contexts.resolve(room_code, current_user.id)
+    if context is None:
         flash('Room not found', 'error')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
+    room = context.room
     
-    member = room.get_member(current_user.id)
-    if member:
+    if context.member:
         # Add system message
         leave_msg = ChatMessage()
         leave_msg.room_id = room.id
@@ -516,11 +700,17 @@ def leave_room(room_code):
         db.session.add(leave_msg)
         
         # Remove member
-        db.session.delete(member)
+        RoomMember.query.filter_by(id=context.member.id).delete()
         db.session.commit()
+        room_contexts.invalidate(room.room_code, current_user.id)
+        broadcast_chat_message(room.room_code, leave_msg)
+        
+        _, sids = presence_registry.remove_member(room.room_code, current_user.id)
+        evict_sockets(sids, room.room_code)
+        broadcast_member_left((room.room_code, current_user.id, True), removed=True)
     
     flash('You have left the room', 'info')
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
 
 def extract_youtube_id(url):
@@ -536,17 +726,17 @@ def allowed_video_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
 
-@app.errorhandler(404)
+@bp.app_errorhandler(404)
 def not_found(error):
     return render_template('403.html', error_message="Page not found"), 404
 
 
-@app.errorhandler(500)
+@bp.app_errorhandler(500)
 def internal_error(error):
     return render_template('403.html', error_message="Internal server error"), 500
 
 # Admin creation route (secure - requires environment variables)
-@app.route('/create-admin')
+@bp.route('/create-admin')
 def create_admin():
     """Secure route to create admin user using environment variables"""
     try:
@@ -584,22 +774,26 @@ def create_admin():
 
 # ==================== ADMIN ROUTES ====================
 
-@app.route('/admin')
+@bp.route('/admin')
 @login_required
 @admin_required
 def admin_dashboard():
     """Admin dashboard"""
     try:
-        # Get statistics
-        total_users = User.query.count()
-        total_rooms = Room.query.count()
-        active_rooms = Room.query.filter(Room.members.any(RoomMember.is_approved == True)).count()
-        admin_users = User.query.filter_by(is_admin=True).count()
-        banned_users = User.query.filter_by(is_banned=True).count()
-        
-        # Get recent users and rooms
-        recent_users = User.query.order_by(User.created_at.desc()).limit(10).all()
-        recent_rooms = Room.query.order_by(Room.created_at.desc()).limit(10).all()
+        # Get statistics (one cached aggregate query each)
+        user_stats = admin_stats.users()
+        room_stats = admin_stats.rooms()
+        storage_stats = admin_stats.storage()
+        storage_sweeper.ensure_started()
+        total_users = user_stats['total_users']
+        total_rooms = room_stats['total_rooms']
+        active_rooms = room_stats['active_rooms']
+        admin_users = user_stats['admin_users']
+        banned_users = user_stats['banned_users']
+        
+        # Get recent users and rooms (ids follow creation order and are indexed)
+        recent_users = User.query.order_by(User.id.desc()).limit(10).all()
+        recent_rooms = Room.load_member_counts(Room.query.order_by(Room.id.desc()).limit(10).all())
         
         print(f"🔍 Admin Dashboard Data:")
         print(f"   Total Users: {total_users}")
@@ -616,6 +810,8 @@ def admin_dashboard():
                              active_rooms=active_rooms,
                              admin_users=admin_users,
                              banned_users=banned_users,
+                             storage_stats=storage_stats,
+                             last_sweep=storage_sweeper.last_report,
                              recent_users=recent_users,
                              recent_rooms=recent_rooms)
     except Exception as e:
@@ -624,35 +820,32 @@ def admin_dashboard():
         traceback.print_exc()
         return "Error loading admin dashboard", 500
 
-@app.route('/admin/users')
+@bp.route('/admin/users')
 @login_required
 @admin_required
 def admin_users():
     """Admin users management page"""
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
-    
-    users = User.query.paginate(
-        page=page, per_page=per_page, error_out=False
-    )
+    users = paginate_keyset(User.query, User.id, ADMIN_PAGE_SIZE,
+                            after=request.args.get('after', type=int),
+                            before=request.args.get('before', type=int),
+                            total=admin_stats.users()['total_users'])
     
     return render_template('admin/users.html', users=users)
 
-@app.route('/admin/rooms')
+@bp.route('/admin/rooms')
 @login_required
 @admin_required
 def admin_rooms():
     """Admin rooms management page"""
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
-    
-    rooms = Room.query.paginate(
-        page=page, per_page=per_page, error_out=False
-    )
+    rooms = paginate_keyset(Room.query.options(joinedload(Room.host)), Room.id, ADMIN_PAGE_SIZE,
+                            after=request.args.get('after', type=int),
+                            before=request.args.get('before', type=int),
+                            total=admin_stats.rooms()['total_rooms'])
+    Room.load_member_counts(rooms.items)
     
     return render_template('admin/rooms.html', rooms=rooms)
 
-@app.route('/admin/api/promote_user', methods=['POST'])
+@bp.route('/admin/api/promote_user', methods=['POST'])
 @login_required
 @admin_required
 def admin_promote_user():
@@ -667,6 +860,8 @@ def admin_promote_user():
         user.is_admin = True
         user.updated_at = datetime.now()
         db.session.commit()
+        user_cache.invalidate(user.id)
+        admin_stats.invalidate()
         
         return jsonify({'success': True, 'message': 'User promoted to admin successfully'})
         
@@ -674,7 +869,7 @@ def admin_promote_user():
         db.session.rollback()
         return jsonify({'success': False, 'message': 'Server error occurred'})
 
-@app.route('/admin/api/ban_user', methods=['POST'])
+@bp.route('/admin/api/ban_user', methods=['POST'])
 @login_required
 @admin_required
 def admin_ban_user():
@@ -689,6 +884,16 @@ def admin_ban_user():
         user.is_banned = True
         user.updated_at = datetime.now()
         db.session.commit()
+        user_cache.invalidate(user.id)
+        admin_stats.invalidate()
+        
+        # Drop the user from live rosters and cached room lookups, then close their sockets
+        room_contexts.invalidate_user(user.id)
+        for room_code in presence_registry.user_rooms(user.id):
+            presence_registry.remove_member(room_code, user.id)
+            broadcast_member_left((room_code, user.id, True), removed=True)
+        for sid in presence_registry.user_sids(user.id):
+            socketio.server.disconnect(sid, namespace='/')
         
         return jsonify({'success': True, 'message': 'User banned successfully'})
         
@@ -696,7 +901,7 @@ def admin_ban_user():
         db.session.rollback()
         return jsonify({'success': False, 'message': 'Server error occurred'})
 
-@app.route('/admin/api/unban_user', methods=['POST'])
+@bp.route('/admin/api/unban_user', methods=['POST'])
 @login_required
 @admin_required
 def admin_unban_user():
@@ -711,6 +916,8 @@ def admin_unban_user():
         user.is_banned = False
         user.updated_at = datetime.now()
         db.session.commit()
+        user_cache.invalidate(user.id)
+        admin_stats.invalidate()
         
         return jsonify({'success': True, 'message': 'User unbanned successfully'})
         
@@ -718,7 +925,7 @@ def admin_unban_user():
         db.session.rollback()
         return jsonify({'success': False, 'message': 'Server error occurred'})
 
-@app.route('/admin/api/delete_room', methods=['POST'])
+@bp.route('/admin/api/delete_room', methods=['POST'])
 @login_required
 @admin_required
 def admin_delete_room():
@@ -727,31 +934,11 @@ def admin_delete_room():
         room_id = request.json.get('room_id')
         print(f"🔍 Attempting to delete room ID: {room_id}")
         
-        room = Room.query.get(room_id)
-        
-        if not room:
+        # Members, chat and video rows go with it in set-based deletes
+        if not delete_rooms([room_id]):
             print(f"❌ Room not found with ID: {room_id}")
             return jsonify({'success': False, 'message': 'Room not found'})
         
-        print(f"✅ Found room: {room.name} (Code: {room.room_code})")
-        print(f"   Members: {len(room.members)}")
-        print(f"   Chat messages: {len(room.chat_messages)}")
-        print(f"   Video files: {len(room.video_files)}")
-        
-        # Delete related data first
-        for member in room.members:
-            db.session.delete(member)
-        
-        for message in room.chat_messages:
-            db.session.delete(message)
-        
-        for video_file in room.video_files:
-            db.session.delete(video_file)
-        
-        # Now delete the room
-        db.session.delete(room)
-        db.session.commit()
-        
         print(f"✅ Room deleted successfully")
         return jsonify({'success': True, 'message': 'Room deleted successfully'})
         
@@ -762,20 +949,47 @@ def admin_delete_room():
         db.session.rollback()
         return jsonify({'success': False, 'message': f'Server error occurred: {str(e)}'})
 
-@app.route('/admin/api/get_user_stats')
+@bp.route('/admin/api/delete_rooms', methods=['POST'])
+@login_required
+@admin_required
+def admin_delete_rooms():
+    """Delete many rooms (given ids, or every room idle for idle_days) in a background job"""
+    data = request.get_json(silent=True) or {}
+    try:
+        if data.get('idle_days') is not None:
+            idle_days = float(data['idle_days'])
+            if idle_days < 0:
+                raise ValueError
+            room_ids = idle_room_ids(timedelta(days=idle_days))
+        else:
+            room_ids = [int(room_id) for room_id in data.get('room_ids') or []]
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Invalid room_ids or idle_days'}), 400
+    
+    if not room_ids:
+        return jsonify({'success': True, 'message': 'No rooms to delete', 'total': 0})
+    
+    job = purge_jobs.start(room_ids)
+    return jsonify({'success': True, 'message': f'Deleting {len(room_ids)} room(s)', **job.to_dict()})
+
+@bp.route('/admin/api/delete_rooms/<int:job_id>')
+@login_required
+@admin_required
+def admin_delete_rooms_progress(job_id):
+    """Progress of a bulk room delete"""
+    job = purge_jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    return jsonify({'success': True, **job.to_dict()})
+
+@bp.route('/admin/api/get_user_stats')
 @login_required
 @admin_required
 def admin_get_user_stats():
     """Get user statistics for admin dashboard"""
     try:
-        # Get user statistics
-        total_users = User.query.count()
-        admin_users = User.query.filter_by(is_admin=True).count()
-        banned_users = User.query.filter_by(is_banned=True).count()
-        active_users = User.query.filter_by(is_banned=False).count()
-        
         # Get recent registrations
-        recent_users = User.query.order_by(User.created_at.desc()).limit(5).all()
+        recent_users = User.query.order_by(User.id.desc()).limit(5).all()
         recent_users_data = [{
             'id': user.id,
             'username': user.username,
@@ -787,31 +1001,22 @@ def admin_get_user_stats():
         
         return jsonify({
             'success': True,
-            'stats': {
-                'total_users': total_users,
-                'admin_users': admin_users,
-                'banned_users': banned_users,
-                'active_users': active_users
-            },
+            'stats': admin_stats.users(),
             'recent_users': recent_users_data
         })
         
     except Exception as e:
         return jsonify({'success': False, 'message': 'Server error occurred'})
 
-@app.route('/admin/api/get_room_stats')
+@bp.route('/admin/api/get_room_stats')
 @login_required
 @admin_required
 def admin_get_room_stats():
     """Get room statistics for admin dashboard"""
     try:
-        # Get room statistics
-        total_rooms = Room.query.count()
-        active_rooms = Room.query.filter(Room.members.any(RoomMember.is_approved == True)).count()
-        empty_rooms = Room.query.filter(~Room.members.any()).count()
-        
         # Get recent rooms
-        recent_rooms = Room.query.order_by(Room.created_at.desc()).limit(5).all()
+        recent_rooms = Room.load_member_counts(Room.query.options(joinedload(Room.host))
+                                                         .order_by(Room.id.desc()).limit(5).all())
         recent_rooms_data = [{
             'id': room.id,
             'name': room.name,
@@ -823,18 +1028,25 @@ def admin_get_room_stats():
         
         return jsonify({
             'success': True,
-            'stats': {
-                'total_rooms': total_rooms,
-                'active_rooms': active_rooms,
-                'empty_rooms': empty_rooms
-            },
+            'stats': admin_stats.rooms(),
             'recent_rooms': recent_rooms_data
         })
         
     except Exception as e:
         return jsonify({'success': False, 'message': 'Server error occurred'})
 
-@app.route('/admin/change-password', methods=['GET', 'POST'])
+@bp.route('/admin/api/storage')
+@login_required
+@admin_required
+def admin_storage_stats():
+    """Upload storage totals and the last sweep's figures (from this worker)"""
+    return jsonify({
+        'success': True,
+        'stats': admin_stats.storage(),
+        'last_sweep': storage_sweeper.last_report
+    })
+
+@bp.route('/admin/change-password', methods=['GET', 'POST'])
 @login_required
 @admin_required
 def admin_change_password():
@@ -844,8 +1056,11 @@ def admin_change_password():
         new_password = request.form.get('new_password', '')
         confirm_password = request.form.get('confirm_password', '')
         
+        # current_user is a cached identity record; password checks need the row
+        user = db.session.get(User, current_user.id)
+        
         # Validate current password
-        if not current_user.check_password(current_password):
+        if not user.check_password(current_password):
             flash('Current password is incorrect', 'error')
             return render_template('admin/change_password.html')
         
@@ -860,60 +1075,42 @@ def admin_change_password():
             return render_template('admin/change_password.html')
         
         # Update password
-        current_user.set_password(new_password)
+        user.set_password(new_password)
         db.session.commit()
+        user_cache.invalidate(user.id)
         
         flash('Password changed successfully!', 'success')
-        return redirect(url_for('admin_dashboard'))
+        return redirect(url_for('main.admin_dashboard'))
     
     return render_template('admin/change_password.html')
 
-@app.route('/room/<room_code>/member-count')
+@bp.route('/room/<room_code>/member-count')
 @login_required
 def get_member_count(room_code):
-    """Get current member count for the room"""
-    room = Room.query.filter_by(room_code=room_code.upper()).first()
-    if not room:
+    """Get current member count for the room (served from the presence registry)"""
+    context = room_contexts.resolve(room_code, current_user.id)
+    if context is None:
         return jsonify({'success': False, 'error': 'Room not found'}), 404
     
-    member = room.get_member(current_user.id)
-    if not member or not member.is_approved:
+    if not context.is_member:
         return jsonify({'success': False, 'error': 'Not authorized'}), 403
+    presence = presence_registry.roster(context.room.room_code)
     
-    # Count approved members
-    member_count = RoomMember.query.filter_by(room_id=room.id, is_approved=True).count()
-    
-    return jsonify({
-        'success': True,
-        'count': member_count
-    })
+    return jsonify(dict(presence_registry.counts(presence), success=True))
 
-@app.route('/room/<room_code>/members')
+@bp.route('/room/<room_code>/members')
 @login_required
 def get_room_members(room_code):
-    """Get current members list for the room"""
-    room = Room.query.filter_by(room_code=room_code.upper()).first()
-    if not room:
+    """Get current members list for the room (served from the presence registry)"""
+    context = room_contexts.resolve(room_code, current_user.id)
+    if context is None:
         return jsonify({'success': False, 'error': 'Room not found'}), 404
     
-    member = room.get_member(current_user.id)
-    if not member or not member.is_approved:
+    if not context.is_member:
         return jsonify({'success': False, 'error': 'Not authorized'}), 403
-    
-    # Get approved members
-    members = RoomMember.query.filter_by(room_id=room.id, is_approved=True).all()
-    members_data = []
-    
-    for member in members:
-        members_data.append({
-            'id': member.user.id,
-            'display_name': member.user.display_name,
-            'username': member.user.username,
-            'role': member.role,
-            'joined_at': member.joined_at.isoformat()
-        })
+    presence = presence_registry.roster(context.room.room_code)
     
     return jsonify({
         'success': True,
-        'members': members_data
+        'members': presence_registry.member_list(presence)
     })
@@ -11,9 +11,11 @@ from datetime import datetime
 # Add the current directory to the Python path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from app import app, db
+from app import create_app, db
 from models import User
 
+app = create_app()
+
 def create_admin_user():
     """Create the first admin user"""
     with app.app_context():
@@ -64,7 +66,7 @@ def main():
         print("=" * 50)
         print("✅ Setup completed successfully!")
         print("\n📋 Next steps:")
-        print("1. Run your Flask application: python app.py")
+        print("1. Run your Flask application: python main.py")
         print("2. Go to http://localhost:5000")
         print("3. Login with admin/admin123")
         print("4. Change the admin password immediately!")
@@ -0,0 +1,62 @@
+"""
+In-process stand-in for a Socket.IO message queue.
+
+``SOCKETIO_MESSAGE_QUEUE=local://`` selects this manager instead of Redis,
+Kafka, ZeroMQ or a Kombu broker. Every ``LocalManager`` created in the same
+process on the same channel receives every message, exactly as separate
+workers would through a real broker, which makes it possible to exercise
+cross-worker fan-out with several Socket.IO servers in one test process.
+Messages are JSON-encoded on publish like a real broker would.
+
+Managers are held weakly by the channel, and :meth:`LocalManager.close`
+unsubscribes one and ends its listener, so a manager replaced by a new app
+(or dropped by a test) stops collecting messages.
+"""
+
+import queue
+import threading
+import weakref
+
+import socketio
+
+
+class LocalManager(socketio.PubSubManager):
+    """Pub/sub client manager backed by in-memory queues"""
+
+    name = 'local'
+
+    _subscribers = {}  # channel -> WeakSet of managers, shared by all instances
+    _subscribers_lock = threading.Lock()
+
+    def __init__(self, url='local://', channel='flask-socketio', write_only=False,
+                 logger=None, json=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self.url = url
+        self._inbox = queue.Queue()
+        if not write_only:
+            with self._subscribers_lock:
+                self._subscribers.setdefault(channel, weakref.WeakSet()).add(self)
+
+    def close(self):
+        """Stop receiving messages and end the listener"""
+        with self._subscribers_lock:
+            subscribers = self._subscribers.get(self.channel)
+            if subscribers is not None:
+                subscribers.discard(self)
+                if not subscribers:
+                    del self._subscribers[self.channel]
+        self._inbox.put(None)
+
+    def _publish(self, data):
+        message = self.json.dumps(data)
+        with self._subscribers_lock:
+            managers = list(self._subscribers.get(self.channel, ()))
+        for manager in managers:
+            manager._inbox.put(message)
+
+    def _listen(self):
+        while True:
+            message = self._inbox.get()
+            if message is None:
+                return
+            yield message
@@ -3,8 +3,21 @@
 let youtubePlayer = null;
 let localVideo = null;
 let lastMessageId = 0;
+let oldestMessageId = 0; // scroll-back cursor into older chat history
+let loadingHistory = false;
+let historyExhausted = false;
 let syncInterval = null;
 let chatPollInterval = null;
+let chatPollInFlight = false;
+let memberPollIntervals = [];
+let roomMembers = new Map(); // user id -> member (with online flag)
+let clockOffset = 0; // server clock minus local clock, in ms
+let clockRtt = null; // round trip of the best clock sample, in ms
+let clockSyncInterval = null;
+let heartbeatInterval = null;
+let latestPlaybackState = null; // playback snapshot from the join acknowledgement
+let videoPrefetch = null; // video prefetch request being fetched
+let pendingVideoPrefetch = null; // the newest prefetch request made meanwhile
 let roomCode = '';
 let isHost = false;
 let currentVideoType = '';
@@ -114,21 +127,84 @@ document.addEventListener('DOMContentLoaded', function() {
 
 // Initialize Socket.IO connection
 function initializeSocketIO() {
-    // Connect to Socket.IO server
-    socket = io();
+    // Connect to Socket.IO server; skipping the polling handshake lets any
+    // worker accept the connection without sticky sessions
+    socket = io({ transports: window.socketTransports || ['polling', 'websocket'] });
     
     // Connection events
     socket.on('connect', function() {
         console.log('Connected to Socket.IO server');
         
-        // Join the room
+        // Join the room; the acknowledgement carries the member list
         socket.emit('join_room', {
             room_code: roomCode
+        }, function(data) {
+            if (data && data.error) {
+                // Not admitted to the socket room; keep the room usable over HTTP
+                console.error('Could not join room over Socket.IO:', data.error);
+                startFallbackPolling();
+                return;
+            }
+            if (data && data.members) {
+                updateMemberList(data.members);
+                updateMemberCount(data.count);
+                lastMemberCount = data.count;
+            }
+            if (data && data.playback) {
+                latestPlaybackState = data.playback;
+                if (data.playback.video_type === 'local') {
+                    prefetchVideoRanges(data.playback.video_url, data.playback.prefetch);
+                }
+                syncFromSnapshot(data.playback);
+            }
         });
+        
+        // Estimate the server clock offset now and refresh it every minute
+        syncClock();
+        if (!clockSyncInterval) {
+            clockSyncInterval = setInterval(syncClock, 60000);
+        }
+        
+        // Chat and presence are pushed over the socket now; catch up on
+        // anything missed while disconnected and stop the fallback polling
+        stopFallbackPolling();
+        pollChatMessages();
     });
     
     socket.on('disconnect', function() {
         console.log('Disconnected from Socket.IO server');
+        startFallbackPolling();
+    });
+    
+    socket.on('connect_error', function() {
+        startFallbackPolling();
+    });
+    
+    // Presence deltas
+    socket.on('member_joined', function(data) {
+        roomMembers.set(String(data.member.id), data.member);
+        renderMemberList();
+        updateMemberCount(data.count);
+        lastMemberCount = data.count;
+    });
+    
+    socket.on('member_left', function(data) {
+        const key = String(data.user_id);
+        if (data.removed) {
+            roomMembers.delete(key);
+        } else if (roomMembers.has(key)) {
+            roomMembers.get(key).online = false;
+        }
+        renderMemberList();
+        if (data.count !== undefined) {
+            updateMemberCount(data.count);
+            lastMemberCount = data.count;
+        }
+    });
+    
+    // Chat messages pushed by the server
+    socket.on('new_message', function(message) {
+        handleIncomingMessages([message]);
     });
     
     // Video change events
@@ -137,6 +213,11 @@ function initializeSocketIO() {
         
         const { video_url, video_type, changed_by } = data;
         
+        // Ask for the container headers first so the player's own requests hit the cache
+        if (video_type === 'local' && data.prefetch) {
+            prefetchVideoRanges(video_url, data.prefetch.slice(0, 1));
+        }
+        
         // Update video content for all users
         updateVideoContent(video_url, video_type);
         
@@ -153,30 +234,137 @@ function initializeSocketIO() {
     // Video control events
     socket.on('video_control_update', function(data) {
         console.log('Received video control event:', data);
-        
-        const { action, time, controlled_by } = data;
-        
-        // Apply video control based on action
-        if (action === 'play') {
-            if (currentVideoType === 'youtube' && youtubePlayer) {
-                youtubePlayer.playVideo();
-            } else if (currentVideoType === 'local' && localVideo) {
-                localVideo.play();
-            }
-        } else if (action === 'pause') {
-            if (currentVideoType === 'youtube' && youtubePlayer) {
-                youtubePlayer.pauseVideo();
-            } else if (currentVideoType === 'local' && localVideo) {
-                localVideo.pause();
+        // Seeks carry the bytes around the target; fetch them during the lead time
+        if (currentVideoType === 'local' && data.prefetch) {
+            prefetchVideoRanges(window.currentVideoUrl, data.prefetch.slice(0, 1), data.position);
+        }
+        scheduleVideoControl(data);
+    });
+    
+    // Periodic server position for drift correction (the host is the source)
+    socket.on('sync_tick', function(data) {
+        latestPlaybackState = { position: data.t, is_playing: data.p, server_time: data.s };
+        if (!isHost) {
+            syncFromSnapshot(latestPlaybackState);
+        }
+    });
+}
+
+// Clock synchronisation (NTP-style): keep the sample with the smallest
+// round trip, since its midpoint is the best estimate of the server time
+function syncClock(samples = 5) {
+    if (!socket || !socket.connected) return;
+    
+    let best = null;
+    let taken = 0;
+    
+    const probe = () => {
+        const t0 = Date.now();
+        socket.emit('time_sync', { t0: t0 }, function(data) {
+            const t3 = Date.now();
+            const rtt = t3 - t0;
+            if (data && data.server_time && (!best || rtt < best.rtt)) {
+                best = { rtt: rtt, offset: data.server_time - (t0 + t3) / 2 };
             }
-        } else if (action === 'seek') {
-            if (currentVideoType === 'youtube' && youtubePlayer) {
-                youtubePlayer.seekTo(time, true);
-            } else if (currentVideoType === 'local' && localVideo) {
-                localVideo.currentTime = time;
+            taken++;
+            if (taken < samples) {
+                probe();
+            } else if (best) {
+                clockOffset = best.offset;
+                clockRtt = best.rtt;
+                console.log(`Clock synced: offset ${clockOffset.toFixed(1)}ms, rtt ${clockRtt}ms`);
             }
+        });
+    };
+    probe();
+}
+
+function serverNow() {
+    return Date.now() + clockOffset;
+}
+
+// Position the server expects right now, compensating for transit delay
+function expectedPosition(data) {
+    let position = data.current_time;
+    if (data.is_playing && data.server_time) {
+        position += (serverNow() - data.server_time) / 1000;
+    }
+    return position;
+}
+
+// Apply a timestamped playback snapshot (join acknowledgement or sync)
+function syncFromSnapshot(snapshot) {
+    const data = {
+        current_time: snapshot.position,
+        is_playing: snapshot.is_playing,
+        server_time: snapshot.server_time
+    };
+    if (currentVideoType === 'youtube') {
+        syncYouTubePlayer(data);
+    } else if (currentVideoType === 'local') {
+        syncLocalVideo(data);
+    }
+}
+
+// Run a host command at its server-assigned execute-at time so every
+// viewer acts at the same instant regardless of their own latency
+function scheduleVideoControl(data) {
+    if (data.execute_at === undefined) {
+        applyVideoControl(data.action, data.time, 0);
+        return;
+    }
+    
+    const delay = data.execute_at - serverNow();
+    if (delay > 0) {
+        setTimeout(() => applyVideoControl(data.action, data.position, 0), delay);
+    } else {
+        applyVideoControl(data.action, data.position, -delay);
+    }
+}
+
+function applyVideoControl(action, position, lateMs) {
+    // A late play/seek catches up by however long it was late
+    const target = action === 'pause' ? position : position + lateMs / 1000;
+    
+    if (action === 'play') {
+        seekPlayerIfDrifted(target, 0.3);
+        playPlayer();
+    } else if (action === 'pause') {
+        pausePlayer();
+        seekPlayerIfDrifted(target, 0.3);
+    } else if (action === 'seek') {
+        seekPlayerIfDrifted(target, 0);
+    }
+}
+
+function seekPlayerIfDrifted(target, tolerance) {
+    if (currentVideoType === 'youtube' && youtubePlayer && typeof youtubePlayer.getCurrentTime === 'function') {
+        if (Math.abs(youtubePlayer.getCurrentTime() - target) > tolerance) {
+            youtubePlayer.seekTo(target, true);
         }
-    });
+    } else if (currentVideoType === 'local' && localVideo) {
+        if (Math.abs(localVideo.currentTime - target) > tolerance) {
+            localVideo.currentTime = target;
+        }
+    }
+}
+
+function playPlayer() {
+    if (currentVideoType === 'youtube' && youtubePlayer && typeof youtubePlayer.playVideo === 'function') {
+        youtubePlayer.playVideo();
+    } else if (currentVideoType === 'local' && localVideo) {
+        localVideo.play().catch(error => {
+            console.error('Error playing local video:', error);
+        });
+    }
+}
+
+function pausePlayer() {
+    if (currentVideoType === 'youtube' && youtubePlayer && typeof youtubePlayer.pauseVideo === 'function') {
+        youtubePlayer.pauseVideo();
+    } else if (currentVideoType === 'local' && localVideo) {
+        localVideo.pause();
+    }
 }
 
 // Initialize member data
@@ -204,9 +392,7 @@ function initializeMemberData() {
         }
     }
     
-    // Poll for updates immediately
-    pollMemberCount();
-    pollMemberList();
+    // Member list and count arrive with the socket join acknowledgement
 }
 
 // Setup functions
@@ -374,7 +560,11 @@ function createYouTubePlayer(videoId) {
 function onYouTubePlayerReady(event) {
     // Sync with current room state after a short delay to ensure player is fully loaded
     setTimeout(() => {
-        syncVideoState();
+        if (latestPlaybackState) {
+            syncFromSnapshot(latestPlaybackState);
+        } else {
+            syncVideoState();
+        }
     }, 1000);
 }
 
@@ -531,45 +721,6 @@ function setupMobileOptimizations() {
         }, 100);
     });
     
-    // Mobile-friendly upload progress
-    const fileInput = document.getElementById('videoFile');
-    if (fileInput) {
-        fileInput.addEventListener('change', function(e) {
-            const file = e.target.files[0];
-            if (file) {
-                // Show mobile upload progress
-                const mobileProgress = document.getElementById('mobileUploadProgress');
-                const mobileProgressBar = document.getElementById('mobileUploadBar');
-                const uploadPercentage = document.getElementById('uploadPercentage');
-                
-                if (mobileProgress && mobileProgressBar && uploadPercentage) {
-                    mobileProgress.classList.remove('hidden');
-                    
-                    // Enhanced progress animation
-                    let progress = 0;
-                    const interval = setInterval(() => {
-                        progress += Math.random() * 15;
-                        if (progress >= 100) {
-                            progress = 100;
-                            clearInterval(interval);
-                            
-                            // Hide progress after completion
-                            setTimeout(() => {
-                                mobileProgress.classList.add('hidden');
-                            }, 2000);
-                        }
-                        
-                        mobileProgressBar.style.width = progress + '%';
-                        uploadPercentage.textContent = Math.round(progress) + '%';
-                        
-                        // Add pulse animation to percentage
-                        uploadPercentage.style.animation = 'pulse 1s infinite';
-                    }, 200);
-                }
-            }
-        });
-    }
-    
     // Enhanced mobile button interactions
     const buttons = document.querySelectorAll('button');
     buttons.forEach(button => {
@@ -621,8 +772,7 @@ function loadYouTubeVideo() {
         socket.emit('change_video', {
             room_code: roomCode,
             video_url: url,
-            video_type: 'youtube',
-            user_id: window.currentUserId || 'unknown'
+            video_type: 'youtube'
         });
     }
     
@@ -678,17 +828,21 @@ function sendVideoControl(action, time = 0) {
     
     console.log(`Sending video control: ${action} at time ${time}`);
     
-    // Send via Socket.IO for real-time sync
+    // Send via Socket.IO for real-time sync; the server coalesces bursts
+    // and persists the state, so HTTP is only needed without a socket
     if (socket && socket.connected) {
         socket.emit('video_control', {
             room_code: roomCode,
             action: action,
-            time: time,
-            user_id: window.currentUserId || 'unknown'
+            time: time
+        }, function(data) {
+            if (data && data.error) {
+                console.error('Error sending video control:', data.error);
+            }
         });
+        return;
     }
     
-    // Also send via HTTP for database persistence
     fetch(`/room/${roomCode}/video-control`, {
         method: 'POST',
         headers: {
@@ -712,6 +866,47 @@ function sendVideoControl(action, time = 0) {
     });
 }
 
+// Warm the HTTP cache with byte ranges the server says the player needs
+// next (container headers, the keyframe before a seek target). Broadcasts
+// reach every viewer at once and each fetch holds a server stream slot, so a
+// client fetches one range at a time, only the newest request waits for it,
+// and nothing is fetched when the player already has ``position`` buffered.
+function prefetchVideoRanges(videoUrl, ranges, position = null) {
+    if (!videoUrl || !ranges || !ranges.length) return;
+    if (navigator.connection && navigator.connection.saveData) return;
+    if (position !== null && isVideoBufferedAt(videoUrl, position)) return;
+    
+    const request = { videoUrl, ranges: ranges.slice() };
+    if (videoPrefetch) {
+        pendingVideoPrefetch = request;
+    } else {
+        runVideoPrefetch(request);
+    }
+}
+
+function runVideoPrefetch(request) {
+    const [start, end] = request.ranges.shift();
+    videoPrefetch = request;
+    fetch(request.videoUrl, { headers: { Range: `bytes=${start}-${end}` }, credentials: 'same-origin' })
+        .then(response => response.ok ? response.arrayBuffer() : null)
+        .catch(error => console.log('Video prefetch failed:', error))
+        .then(() => {
+            const next = pendingVideoPrefetch || (request.ranges.length ? request : null);
+            pendingVideoPrefetch = null;
+            videoPrefetch = null;
+            if (next) runVideoPrefetch(next);
+        });
+}
+
+function isVideoBufferedAt(videoUrl, position) {
+    const video = document.getElementById('localVideo');
+    if (!video || video.src !== new URL(videoUrl, window.location.href).href) return false;
+    for (let i = 0; i < video.buffered.length; i++) {
+        if (video.buffered.start(i) <= position && position < video.buffered.end(i)) return true;
+    }
+    return false;
+}
+
 // Update video content dynamically without page refresh
 function updateVideoContent(videoUrl, videoType) {
     console.log('Updating video content:', { videoUrl, videoType });
@@ -868,8 +1063,8 @@ function checkForVideoChangeInMessages(messages) {
             // Mark this message as processed
             processedVideoMessages.add(messageKey);
             
-            // Only trigger if we're not already reloading and haven't processed this message
-            if (!isReloading && !disableAutoRefresh) {
+            // Only trigger if auto-refresh is enabled and we haven't processed this message
+            if (!disableAutoRefresh) {
                 // Trigger video change check for all users
                 setTimeout(() => {
                     checkForVideoChanges();
@@ -989,7 +1184,7 @@ function syncYouTubePlayer(data) {
     }
     
     const currentTime = youtubePlayer.getCurrentTime();
-    const targetTime = data.current_time;
+    const targetTime = expectedPosition(data);
     const timeDiff = Math.abs(currentTime - targetTime);
     const playerState = youtubePlayer.getPlayerState();
     
@@ -1038,7 +1233,7 @@ function syncLocalVideo(data) {
     localVideo = currentLocalVideo;
     
     const currentTime = localVideo.currentTime;
-    const targetTime = data.current_time;
+    const targetTime = expectedPosition(data);
     const timeDiff = Math.abs(currentTime - targetTime);
     
     console.log('Local video sync:', {
@@ -1092,6 +1287,66 @@ function initializeChat() {
     if (lastMessage && lastMessage.dataset.messageId) {
         lastMessageId = parseInt(lastMessage.dataset.messageId);
     }
+    
+    // And the first one, to page back through older history (which may all
+    // have been archived, so an empty chat asks for the latest page once)
+    const firstMessage = document.querySelector('#chatMessages .message:first-child');
+    if (firstMessage && firstMessage.dataset.messageId) {
+        oldestMessageId = parseInt(firstMessage.dataset.messageId);
+    } else {
+        oldestMessageId = 2147483647;
+        loadOlderMessages();
+    }
+    
+    const chatMessages = document.getElementById('chatMessages');
+    if (chatMessages) {
+        chatMessages.addEventListener('scroll', function() {
+            if (chatMessages.scrollTop < 100) {
+                loadOlderMessages();
+            }
+        });
+    }
+}
+
+// Infinite scroll: prepend the page of messages before the oldest one shown
+function loadOlderMessages() {
+    if (loadingHistory || historyExhausted) return;
+    loadingHistory = true;
+    
+    const limit = 50;
+    fetch(`/room/${roomCode}/messages?before_id=${oldestMessageId}&limit=${limit}`)
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+            return response.json();
+        })
+        .then(messages => {
+            if (messages.length < limit) {
+                historyExhausted = true;
+            }
+            if (messages.length === 0) return;
+            
+            // Keep the visible messages where they are while content grows above them
+            const chatMessages = document.getElementById('chatMessages');
+            const previousHeight = chatMessages.scrollHeight;
+            const fragment = document.createDocumentFragment();
+            messages.forEach(message => fragment.appendChild(createChatMessageElement(message)));
+            chatMessages.insertBefore(fragment, chatMessages.firstChild);
+            
+            const scrollBehavior = chatMessages.style.scrollBehavior;
+            chatMessages.style.scrollBehavior = 'auto';
+            chatMessages.scrollTop += chatMessages.scrollHeight - previousHeight;
+            chatMessages.style.scrollBehavior = scrollBehavior;
+            
+            oldestMessageId = messages[0].id;
+        })
+        .catch(error => {
+            console.error('Error loading older messages:', error);
+        })
+        .finally(() => {
+            loadingHistory = false;
+        });
 }
 
 function sendChatMessage(event) {
@@ -1104,6 +1359,23 @@ function sendChatMessage(event) {
     
     if (!message) return;
     
+    // Prefer the socket; the server acknowledges with the stored message
+    if (socket && socket.connected) {
+        socket.emit('send_message', {
+            room_code: roomCode,
+            message: message
+        }, function(data) {
+            if (data && data.id) {
+                chatInput.value = '';
+                handleIncomingMessages([data]);
+            } else {
+                console.error('Failed to send message:', data && data.error);
+                alert((data && data.error) || 'Failed to send message');
+            }
+        });
+        return;
+    }
+    
     fetch(`/room/${roomCode}/send-message`, {
         method: 'POST',
         headers: {
@@ -1120,8 +1392,7 @@ function sendChatMessage(event) {
     .then(data => {
         if (data.id) {
             chatInput.value = '';
-            addChatMessage(data);
-            lastMessageId = data.id;
+            handleIncomingMessages([data]);
         } else {
             console.error('Failed to send message:', data.error);
             alert(data.error || 'Failed to send message');
@@ -1133,8 +1404,7 @@ function sendChatMessage(event) {
     });
 }
 
-function addChatMessage(messageData) {
-    const chatMessages = document.getElementById('chatMessages');
+function createChatMessageElement(messageData) {
     const messageDiv = document.createElement('div');
     messageDiv.className = 'message';
     messageDiv.dataset.messageId = messageData.id;
@@ -1159,12 +1429,59 @@ function addChatMessage(messageData) {
         `;
     }
     
-    chatMessages.appendChild(messageDiv);
+    return messageDiv;
+}
+
+function addChatMessage(messageData) {
+    const chatMessages = document.getElementById('chatMessages');
+    chatMessages.appendChild(createChatMessageElement(messageData));
     chatMessages.scrollTop = chatMessages.scrollHeight;
 }
 
+// Render messages from the socket or a poll, skipping ones already shown
+function handleIncomingMessages(messages) {
+    const newMessages = messages.filter(message =>
+        !document.querySelector(`#chatMessages [data-message-id="${message.id}"]`)
+    );
+    
+    newMessages.forEach(message => {
+        addChatMessage(message);
+        lastMessageId = Math.max(lastMessageId, message.id);
+    });
+    
+    if (newMessages.length === 0) {
+        return;
+    }
+    
+    // Check for video change notifications in new messages
+    checkForVideoChangeInMessages(newMessages);
+    
+    // Handle unread messages for mobile
+    if (!isChatVisible()) {
+        // Increment unread count
+        unreadCount += newMessages.length;
+        updateUnreadCount(unreadCount);
+        
+        // Show mobile notification for new messages
+        const now = Date.now();
+        if (now - lastNotificationTime > 5000) { // Limit notifications to every 5 seconds
+            const latestMessage = newMessages[newMessages.length - 1];
+            if (latestMessage && latestMessage.type !== 'system') {
+                showMobileNotification(latestMessage);
+                lastNotificationTime = now;
+            }
+        }
+    }
+}
+
+// Fetch every message after the newest one shown, a page at a time, so a
+// long disconnect is caught up in full
 function pollChatMessages() {
-    fetch(`/room/${roomCode}/messages?after_id=${lastMessageId}`)
+    if (chatPollInFlight) return;
+    chatPollInFlight = true;
+    
+    const limit = 200;
+    const fetchPage = afterId => fetch(`/room/${roomCode}/messages?after_id=${afterId}&limit=${limit}`)
         .then(response => {
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
@@ -1172,42 +1489,78 @@ function pollChatMessages() {
             return response.json();
         })
         .then(messages => {
-            let newMessages = 0;
-            let hasVideoChange = false;
-            
-            messages.forEach(message => {
-                addChatMessage(message);
-                lastMessageId = Math.max(lastMessageId, message.id);
-                newMessages++;
-            });
-            
-            // Check for video change notifications in new messages
-            if (newMessages > 0) {
-                hasVideoChange = checkForVideoChangeInMessages(messages);
+            handleIncomingMessages(messages);
+            // A full page means more are waiting. Continue from this page rather
+            // than lastMessageId, which socket messages may have moved past the gap
+            if (messages.length === limit) {
+                return fetchPage(messages[messages.length - 1].id);
             }
-            
-            // Handle unread messages for mobile
-            if (newMessages > 0 && !isChatVisible()) {
-                // Increment unread count
-                unreadCount += newMessages;
-                updateUnreadCount(unreadCount);
-                
-                // Show mobile notification for new messages
-                const now = Date.now();
-                if (now - lastNotificationTime > 5000) { // Limit notifications to every 5 seconds
-                    const latestMessage = messages[messages.length - 1];
-                    if (latestMessage && latestMessage.type !== 'system') {
-                        showMobileNotification(latestMessage);
-                        lastNotificationTime = now;
-                    }
-                }
-            }
-        })
+        });
+    
+    fetchPage(lastMessageId)
         .catch(error => {
             console.error('Error polling chat messages:', error);
+        })
+        .finally(() => {
+            chatPollInFlight = false;
         });
 }
 
+// Chat polling is only a fallback for when the socket is unavailable
+function startChatPolling() {
+    if (!chatPollInterval) {
+        chatPollInterval = setInterval(pollChatMessages, 5000);
+    }
+}
+
+function stopChatPolling() {
+    if (chatPollInterval) {
+        clearInterval(chatPollInterval);
+        chatPollInterval = null;
+    }
+}
+
+// Member polling is likewise only a fallback for presence deltas
+function startMemberPolling() {
+    if (memberPollIntervals.length === 0) {
+        memberPollIntervals = [
+            setInterval(pollMemberCount, 10000),
+            setInterval(pollMemberList, 15000)
+        ];
+    }
+}
+
+function stopMemberPolling() {
+    memberPollIntervals.forEach(interval => clearInterval(interval));
+    memberPollIntervals = [];
+}
+
+// Video state polling is replaced by timestamped socket commands
+function startSyncPolling() {
+    if (!syncInterval) {
+        syncInterval = setInterval(syncVideoState, 10000);
+    }
+}
+
+function stopSyncPolling() {
+    if (syncInterval) {
+        clearInterval(syncInterval);
+        syncInterval = null;
+    }
+}
+
+function startFallbackPolling() {
+    startChatPolling();
+    startMemberPolling();
+    startSyncPolling();
+}
+
+function stopFallbackPolling() {
+    stopChatPolling();
+    stopMemberPolling();
+    stopSyncPolling();
+}
+
 // File Upload
 function setupFileUpload() {
     const fileInput = document.getElementById('videoFile');
@@ -1237,113 +1590,243 @@ function handleVideoUpload(event) {
     uploadVideoFile(file);
 }
 
-function uploadVideoFile(file) {
-    const formData = new FormData();
-    formData.append('video', file);
-    
-    const progressDiv = document.getElementById('uploadProgress');
-    const progressBar = document.getElementById('uploadBar');
-    
-    if (progressDiv && progressBar) {
-        progressDiv.classList.remove('hidden');
-        progressBar.style.width = '0%';
+// Chunked, resumable upload: open an upload, PUT the file chunk by chunk at the
+// offset the server holds, then finalize. A failed chunk is retried from the
+// server's offset, and an interrupted upload of the same file resumes later.
+const UPLOAD_RETRIES = 5;
+// Files up to this size are hashed first so content the server already has is
+// not sent again; larger ones start uploading at once (the server still stores
+// duplicate content only once)
+const UPLOAD_HASH_LIMIT = 64 * 1024 * 1024;
+// Bytes read from the file per hashing step
+const UPLOAD_HASH_SLICE = 4 * 1024 * 1024;
+
+const SHA256_K = new Uint32Array([
+    0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+    0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+    0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+    0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+    0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+    0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+    0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+    0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2
+]);
+
+// Incremental SHA-256: crypto.subtle.digest only takes the whole input at
+// once, which for a video means holding all of it in memory
+class Sha256 {
+    constructor() {
+        this.state = new Uint32Array([
+            0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19
+        ]);
+        this.words = new Uint32Array(64);
+        this.buffer = new Uint8Array(64);
+        this.buffered = 0;
+        this.length = 0;
+    }
+    
+    update(bytes) {
+        this.length += bytes.length;
+        let pos = 0;
+        if (this.buffered) {
+            pos = Math.min(64 - this.buffered, bytes.length);
+            this.buffer.set(bytes.subarray(0, pos), this.buffered);
+            this.buffered += pos;
+            if (this.buffered < 64) return this;
+            this.block(this.buffer, 0);
+        }
+        for (; pos + 64 <= bytes.length; pos += 64) {
+            this.block(bytes, pos);
+        }
+        this.buffer.set(bytes.subarray(pos));
+        this.buffered = bytes.length - pos;
+        return this;
     }
     
-    fetch(`/room/${roomCode}/upload-video`, {
-        method: 'POST',
-        body: formData
-    })
-    .then(response => {
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
+    block(bytes, offset) {
+        const w = this.words;
+        for (let i = 0; i < 16; i++) {
+            const j = offset + i * 4;
+            w[i] = (bytes[j] << 24) | (bytes[j + 1] << 16) | (bytes[j + 2] << 8) | bytes[j + 3];
         }
-        return response.json();
-    })
-    .then(data => {
-        if (progressDiv && progressBar) {
-            progressDiv.classList.add('hidden');
+        for (let i = 16; i < 64; i++) {
+            const x = w[i - 15], y = w[i - 2];
+            const s0 = ((x >>> 7) | (x << 25)) ^ ((x >>> 18) | (x << 14)) ^ (x >>> 3);
+            const s1 = ((y >>> 17) | (y << 15)) ^ ((y >>> 19) | (y << 13)) ^ (y >>> 10);
+            w[i] = (w[i - 16] + s0 + w[i - 7] + s1) | 0;
         }
-        
-        if (data.success) {
-            console.log('Video uploaded successfully');
-            
-            // Emit Socket.IO event for real-time sync
-            if (socket && socket.connected) {
-                socket.emit('change_video', {
-                    room_code: roomCode,
-                    video_url: data.video_url,
-                    video_type: 'local',
-                    user_id: window.currentUserId || 'unknown'
-                });
-            }
-            
-            // Update video content dynamically for host
-            updateVideoContent(data.video_url, 'local');
-            
-            // Show notification
-            showVideoChangeNotification();
-        } else {
-            console.error('Upload failed:', data.error);
-            alert('Upload failed: ' + data.error);
+        const s = this.state;
+        let a = s[0], b = s[1], c = s[2], d = s[3], e = s[4], f = s[5], g = s[6], h = s[7];
+        for (let i = 0; i < 64; i++) {
+            const S1 = ((e >>> 6) | (e << 26)) ^ ((e >>> 11) | (e << 21)) ^ ((e >>> 25) | (e << 7));
+            const t1 = (h + S1 + ((e & f) ^ (~e & g)) + SHA256_K[i] + w[i]) | 0;
+            const S0 = ((a >>> 2) | (a << 30)) ^ ((a >>> 13) | (a << 19)) ^ ((a >>> 22) | (a << 10));
+            const t2 = (S0 + ((a & b) ^ (a & c) ^ (b & c))) | 0;
+            h = g; g = f; f = e; e = (d + t1) | 0;
+            d = c; c = b; b = a; a = (t1 + t2) | 0;
         }
-    })
-    .catch(error => {
-        console.error('Upload error:', error);
-        if (progressDiv && progressBar) {
-            progressDiv.classList.add('hidden');
+        s[0] += a; s[1] += b; s[2] += c; s[3] += d;
+        s[4] += e; s[5] += f; s[6] += g; s[7] += h;
+    }
+    
+    hex() {
+        const bits = this.length * 8;
+        const padding = new Uint8Array((this.buffered < 56 ? 64 : 128) - this.buffered);
+        padding[0] = 0x80;
+        const view = new DataView(padding.buffer);
+        view.setUint32(padding.length - 8, Math.floor(bits / 0x100000000));
+        view.setUint32(padding.length - 4, bits >>> 0);
+        this.update(padding);
+        return Array.from(this.state, word => word.toString(16).padStart(8, '0')).join('');
+    }
+}
+
+// Hash the file a slice at a time, so memory stays at one slice
+async function fileDigest(file) {
+    if (file.size > UPLOAD_HASH_LIMIT) return null;
+    try {
+        const hash = new Sha256();
+        for (let offset = 0; offset < file.size; offset += UPLOAD_HASH_SLICE) {
+            const slice = file.slice(offset, offset + UPLOAD_HASH_SLICE);
+            hash.update(new Uint8Array(await slice.arrayBuffer()));
         }
-        alert('Upload failed');
-    });
+        return hash.hex();
+    } catch (error) {
+        return null;
+    }
+}
+
+function uploadResumeKey(file) {
+    return `upload:${roomCode}:${file.name}:${file.size}:${file.lastModified}`;
+}
+
+async function uploadRequest(url, options) {
+    const response = await fetch(url, options);
+    const data = await response.json().catch(() => ({}));
+    if (!response.ok && response.status !== 409) {
+        const error = new Error(data.error || `HTTP error! status: ${response.status}`);
+        error.status = response.status;
+        throw error;
+    }
+    return { status: response.status, data };
+}
+
+async function openUpload(file) {
+    const baseUrl = `/room/${roomCode}/uploads`;
+    const savedId = localStorage.getItem(uploadResumeKey(file));
+    if (savedId) {
+        try {
+            const { data } = await uploadRequest(`${baseUrl}/${savedId}`);
+            return data;
+        } catch (error) {
+            localStorage.removeItem(uploadResumeKey(file));
+        }
+    }
     
-    // Simulate upload progress (since we can't track real progress with fetch)
-    if (progressBar) {
-        simulateUploadProgress(progressBar);
+    const { data } = await uploadRequest(baseUrl, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+            filename: file.name,
+            size: file.size,
+            sha256: await fileDigest(file),
+            sid: socket && socket.connected ? socket.id : null
+        })
+    });
+    // Already stored: the server published it without an upload
+    if (!data.deduplicated) {
+        localStorage.setItem(uploadResumeKey(file), data.upload_id);
     }
+    return data;
+}
+
+function setUploadProgress(fraction) {
+    const percent = Math.round(fraction * 100) + '%';
+    const progressBar = document.getElementById('uploadBar');
+    const mobileProgressBar = document.getElementById('mobileUploadBar');
+    const uploadPercentage = document.getElementById('uploadPercentage');
+    if (progressBar) progressBar.style.width = percent;
+    if (mobileProgressBar) mobileProgressBar.style.width = percent;
+    if (uploadPercentage) uploadPercentage.textContent = percent;
 }
 
+function showUploadProgress(visible) {
+    ['uploadProgress', 'mobileUploadProgress'].forEach(id => {
+        const element = document.getElementById(id);
+        if (element) element.classList.toggle('hidden', !visible);
+    });
+}
 
+function finishVideoUpload(videoUrl) {
+    // The server has switched the room and told the other viewers
+    showUploadProgress(false);
+    console.log('Video uploaded successfully');
+    updateVideoContent(videoUrl, 'local');
+    showVideoChangeNotification();
+}
 
-function simulateUploadProgress(progressBar) {
-    let progress = 0;
-    const interval = setInterval(() => {
-        progress += Math.random() * 10;
-        if (progress >= 95) {
-            clearInterval(interval);
+async function uploadVideoFile(file) {
+    showUploadProgress(true);
+    
+    try {
+        const upload = await openUpload(file);
+        if (upload.deduplicated) {
+            finishVideoUpload(upload.video_url);
             return;
         }
-        progressBar.style.width = progress + '%';
-    }, 200);
+        const uploadUrl = `/room/${roomCode}/uploads/${upload.upload_id}`;
+        const chunkSize = upload.chunk_size || 8 * 1024 * 1024;
+        let offset = upload.offset;
+        let failures = 0;
+        setUploadProgress(offset / file.size);
+        
+        while (offset < file.size) {
+            try {
+                const { data } = await uploadRequest(`${uploadUrl}?offset=${offset}`, {
+                    method: 'PUT',
+                    body: file.slice(offset, offset + chunkSize)
+                });
+                // On 409 the server reports where it actually is; continue from there
+                offset = data.offset;
+                failures = 0;
+            } catch (error) {
+                if (error.status && error.status < 500) throw error;
+                if (++failures > UPLOAD_RETRIES) throw error;
+                await new Promise(resolve => setTimeout(resolve, 1000 * failures));
+                const { data } = await uploadRequest(uploadUrl);
+                offset = data.offset;
+            }
+            setUploadProgress(offset / file.size);
+        }
+        
+        const { data } = await uploadRequest(`${uploadUrl}/finalize`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ sid: socket && socket.connected ? socket.id : null })
+        });
+        if (!data.success) throw new Error(data.error);
+        localStorage.removeItem(uploadResumeKey(file));
+        finishVideoUpload(data.video_url);
+    } catch (error) {
+        console.error('Upload error:', error);
+        showUploadProgress(false);
+        alert('Upload failed: ' + error.message);
+    }
 }
 
 // Polling Functions
 function startPolling() {
-    // Only sync video state for play/pause/time sync, not for video changes
-    // Video changes will be handled by immediate sync after upload/load
-    syncInterval = setInterval(syncVideoState, 10000);
-    
-    // Poll chat messages every 5 seconds to prevent too frequent checks
-    chatPollInterval = setInterval(pollChatMessages, 5000);
-    
-    // Poll member count every 10 seconds (reduced from 5 seconds)
-    setInterval(pollMemberCount, 10000);
-    
-    // Poll member list every 15 seconds (reduced from 8 seconds)
-    setInterval(pollMemberList, 15000);
+    // Chat and presence arrive over Socket.IO; poll only without a socket
+    if (!socket || !socket.connected) {
+        startFallbackPolling();
+    }
     
     // Heartbeat to update video position every 5 seconds (reduced from 3 seconds)
-    setInterval(sendHeartbeat, 5000);
-    
-    // Check if YouTube player is ready every 15 seconds (reduced from 8 seconds)
-    if (!isHost && currentVideoType === 'youtube') {
-        setInterval(checkYouTubePlayerReady, 15000);
-    }
-}
-
-function checkYouTubePlayerReady() {
-    if (youtubePlayer && typeof youtubePlayer.getPlayerState === 'function') {
-        // Force a sync when player becomes ready
-        syncVideoState();
+    if (!heartbeatInterval) {
+        heartbeatInterval = setInterval(sendHeartbeat, 5000);
     }
+    
+    // Viewers are kept in sync by the server's sync_tick broadcast
 }
 
 function sendHeartbeat() {
@@ -1368,15 +1851,7 @@ function sendHeartbeat() {
 }
 
 function stopPolling() {
-    if (syncInterval) {
-        clearInterval(syncInterval);
-        syncInterval = null;
-    }
-    
-    if (chatPollInterval) {
-        clearInterval(chatPollInterval);
-        chatPollInterval = null;
-    }
+    stopFallbackPolling();
 }
 
 // Utility Functions
@@ -1478,14 +1953,20 @@ function pollMemberCount() {
 
 // Member list functions
 function updateMemberList(members) {
+    roomMembers = new Map(members.map(member => [String(member.id), member]));
+    renderMemberList();
+}
+
+function renderMemberList() {
     const memberListContainer = document.querySelector('.mobile-members .space-y-2');
     if (!memberListContainer) return;
     
     memberListContainer.innerHTML = '';
     
-    members.forEach(member => {
+    roomMembers.forEach(member => {
         const memberDiv = document.createElement('div');
-        memberDiv.className = 'flex items-center space-x-2';
+        memberDiv.className = 'flex items-center space-x-2' + (member.online ? '' : ' opacity-50');
+        memberDiv.dataset.memberId = member.id;
         
         // Since User model doesn't have profile_image_url, always use default avatar
         const profileHtml = `<div class="w-6 h-6 bg-discord-accent rounded-full flex items-center justify-center">
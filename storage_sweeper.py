@@ -0,0 +1,210 @@
+"""
+Upload storage sweeper.
+
+Files used to stay in ``UPLOAD_FOLDER`` forever: deleting a room removed
+its ``video_files`` rows but not the files, and a room that switched to
+another video kept the old one. A background task now runs every
+``STORAGE_SWEEP_INTERVAL`` seconds and, ``STORAGE_SWEEP_BATCH`` rows per
+transaction:
+
+1. expires uploads a room has moved on from: ``video_files`` rows older
+   than ``STORAGE_REPLACED_AFTER`` seconds that are not the room's current
+   video, lowering their blobs' reference counts;
+2. deletes blobs nothing references any more (``ref_count <= 0``), the row
+   first and then the file;
+3. reconciles the folder against the database: files that no blob (or
+   pre-blob ``video_files`` row) names are removed, and so are stale
+   partial uploads;
+4. indexes blobs stored before :mod:`video_index` existed.
+
+A file is only unlinked when it has not been modified for
+``STORAGE_ORPHAN_GRACE`` seconds. An upload renames its freshly written
+part file into place before its transaction commits, so this keeps the
+sweep away from content that is about to be referenced.
+
+The figures of the last run in this process are kept for the admin
+dashboard.
+"""
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, or_, select
+
+from app import db, socketio
+from video_store import video_store
+
+
+class StorageSweeper:
+    """Process-wide background cleaner of the upload folder"""
+
+    def __init__(self):
+        self._app = None
+        self._lock = threading.Lock()
+        self.last_report = None
+
+    def ensure_started(self):
+        """Start the background task the first time a room is used in this process"""
+        if self._app is not None:
+            return
+        with self._lock:
+            if self._app is not None:
+                return
+            self._app = current_app._get_current_object()
+        if self._app.config.get('STORAGE_SWEEP_INTERVAL'):
+            socketio.start_background_task(self._loop)
+
+    def _loop(self):
+        interval = self._app.config['STORAGE_SWEEP_INTERVAL']
+        while True:
+            socketio.sleep(interval)
+            with self._app.app_context():
+                try:
+                    report = self.run()
+                    if report['freed_bytes']:
+                        logging.info(f"Storage sweep freed {report['freed_bytes'] / 2 ** 20:.0f} MB")
+                except Exception as e:
+                    logging.error(f"Storage sweep failed: {e}")
+                finally:
+                    db.session.remove()
+
+    def run(self):
+        """Sweep once; returns (and keeps) the figures of this run"""
+        from chunked_upload import upload_sessions
+
+        config = current_app.config
+        batch_size = config.get('STORAGE_SWEEP_BATCH', 100)
+        grace_cutoff = time.time() - config.get('STORAGE_ORPHAN_GRACE', 3600)
+        started = time.monotonic()
+
+        expired = 0
+        if config.get('STORAGE_REPLACED_AFTER'):
+            expired = self._expire_replaced(
+                datetime.now() - timedelta(seconds=config['STORAGE_REPLACED_AFTER']), batch_size)
+        blobs, blob_bytes = self._delete_released_blobs(batch_size, grace_cutoff)
+        orphans, orphan_bytes, files, total = self._remove_orphan_files(batch_size, grace_cutoff)
+        upload_sessions.sweep()
+        indexed = self._index_pending(batch_size)
+
+        self.last_report = {
+            'expired_uploads': expired,
+            'deleted_blobs': blobs,
+            'orphan_files': orphans,
+            'indexed_blobs': indexed,
+            'freed_bytes': blob_bytes + orphan_bytes,
+            'files_on_disk': files,
+            'bytes_on_disk': total,
+            'seconds': round(time.monotonic() - started, 3),
+            'finished_at': datetime.now().isoformat(timespec='seconds'),
+        }
+        return self.last_report
+
+    @staticmethod
+    def _expire_replaced(cutoff, batch_size):
+        """Delete old uploads that are not their room's current video; returns how many"""
+        from models import Room, VideoFile
+
+        expired = 0
+        while True:
+            ids = db.session.execute(
+                select(VideoFile.id).join(Room, Room.id == VideoFile.room_id)
+                .where(VideoFile.created_at < cutoff,
+                       or_(Room.current_video_url.is_(None),
+                           ~Room.current_video_url.endswith('/' + VideoFile.filename)))
+                .order_by(VideoFile.id).limit(batch_size)).scalars().all()
+            if not ids:
+                return expired
+            video_store.drop_references(VideoFile.id.in_(ids))
+            db.session.execute(delete(VideoFile).where(VideoFile.id.in_(ids))
+                               .execution_options(synchronize_session=False))
+            db.session.commit()
+            expired += len(ids)
+            socketio.sleep(0)
+
+    def _delete_released_blobs(self, batch_size, grace_cutoff):
+        """Delete unreferenced blobs, rows then files; returns (blobs deleted, bytes freed)"""
+        from models import VideoBlob
+
+        deleted = freed = 0
+        while True:
+            ids = db.session.execute(select(VideoBlob.id).where(VideoBlob.ref_count <= 0)
+                                     .order_by(VideoBlob.id).limit(batch_size)).scalars().all()
+            if not ids:
+                return deleted, freed
+            # Re-checked in the DELETE: an upload may have taken a reference since
+            filenames = db.session.execute(
+                delete(VideoBlob).where(VideoBlob.id.in_(ids), VideoBlob.ref_count <= 0)
+                .returning(VideoBlob.filename)).scalars().all()
+            db.session.commit()
+            for filename in filenames:
+                freed += self._unlink(os.path.join(current_app.config['UPLOAD_FOLDER'], filename),
+                                      grace_cutoff) or 0
+            deleted += len(filenames)
+            socketio.sleep(0)
+
+    def _remove_orphan_files(self, batch_size, grace_cutoff):
+        """Unlink files nothing names; returns (removed, bytes freed, files kept, bytes kept)"""
+        from models import VideoBlob, VideoFile
+
+        folder = current_app.config['UPLOAD_FOLDER']
+        if not os.path.isdir(folder):
+            return 0, 0, 0, 0
+        referenced = set(db.session.execute(select(VideoBlob.filename)).scalars())
+        referenced.update(db.session.execute(
+            select(VideoFile.filename).where(VideoFile.blob_id.is_(None))).scalars())
+        db.session.commit()
+
+        removed = freed = files = total = 0
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                # Skips the .partial directory (swept by chunked_upload) and dotfiles
+                if entry.name.startswith('.') or not entry.is_file():
+                    continue
+                if entry.name not in referenced:
+                    unlinked = self._unlink(entry.path, grace_cutoff)
+                    if unlinked is not None:
+                        removed += 1
+                        freed += unlinked
+                        if removed % batch_size == 0:
+                            socketio.sleep(0)
+                        continue
+                files += 1
+                total += entry.stat().st_size
+        return removed, freed, files, total
+
+    @staticmethod
+    def _index_pending(batch_size):
+        """Index referenced blobs that have never been indexed; returns how many"""
+        from models import VideoBlob
+        from video_index import video_indexer
+
+        indexed = 0
+        while True:
+            blobs = VideoBlob.query.filter(VideoBlob.indexed_at.is_(None), VideoBlob.ref_count > 0)\
+                .order_by(VideoBlob.id).limit(batch_size).all()
+            if not blobs:
+                return indexed
+            for blob in blobs:
+                video_indexer.ensure(blob)
+                socketio.sleep(0)
+            db.session.commit()
+            indexed += len(blobs)
+
+    @staticmethod
+    def _unlink(path, grace_cutoff):
+        """Remove a file unless it changed within the grace period; returns the bytes freed, or None if kept"""
+        try:
+            stat = os.stat(path)
+            if stat.st_mtime >= grace_cutoff:
+                return None
+            os.remove(path)
+        except FileNotFoundError:
+            return 0
+        return stat.st_size
+
+
+storage_sweeper = StorageSweeper()
@@ -0,0 +1,146 @@
+"""
+Shared fixtures for the test suite.
+
+The extensions and the in-memory registries (playback state, presence,
+caches) are process-wide singletons, so the app is built once per session
+against a throwaway SQLite database. Each test gets freshly created tables
+and emptied registries.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PASSWORD = 'password'
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import create_app
+
+    workdir = tempfile.mkdtemp(prefix='watchwithme-tests-')
+    app = create_app({
+        'TESTING': True,
+        'SECRET_KEY': 'tests',
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'app.db'),
+        'UPLOAD_FOLDER': os.path.join(workdir, 'uploads'),
+        'SOCKETIO_ASYNC_MODE': 'threading',
+        'SOCKETIO_MESSAGE_QUEUE': None,
+        'STATE_REPLICA_TTL': None,
+        'SYNC_TICK_INTERVAL': 0,
+        'CHAT_RETENTION_INTERVAL': 0,
+        'STORAGE_SWEEP_INTERVAL': 0,
+    })
+    return app
+
+
+def reset_state():
+    """Recreate the tables, empty the upload folder and the in-memory registries (needs an app context)"""
+    from flask import current_app
+
+    from app import db
+    from admin_stats import admin_stats
+    from playback import playback_store
+    from presence import presence_registry
+    from room_context import room_contexts
+    from user_cache import user_cache
+    from video_index import video_indexer
+
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    shutil.rmtree(current_app.config['UPLOAD_FOLDER'], ignore_errors=True)
+    os.makedirs(current_app.config['UPLOAD_FOLDER'])
+    playback_store._states.clear()
+    playback_store._windows.clear()
+    presence_registry._rooms.clear()
+    presence_registry._sockets.clear()
+    room_contexts._entries.clear()
+    user_cache._entries.clear()
+    admin_stats.invalidate()
+    video_indexer._cache.clear()
+
+
+@pytest.fixture
+def db(app):
+    """
+    Empty tables and registries.
+
+    No app context stays pushed: requests made with the test client would
+    share it (and with it ``g`` and the logged-in user), so tests open
+    their own ``app.app_context()`` for direct database work.
+    """
+    from app import db
+
+    with app.app_context():
+        reset_state()
+    return db
+
+
+@pytest.fixture
+def reset(app, db):
+    """Start over with empty tables and registries within a test"""
+    def reset():
+        with app.app_context():
+            reset_state()
+    return reset
+
+
+def detached(db, *instances):
+    """Commit and return instances with their attributes loaded, usable outside the session"""
+    db.session.commit()
+    for instance in instances:
+        db.session.refresh(instance)
+        db.session.expunge(instance)
+    return instances[0] if len(instances) == 1 else instances
+
+
+@pytest.fixture
+def make_user(app, db):
+    from werkzeug.security import generate_password_hash
+    from models import User
+
+    password_hash = generate_password_hash(PASSWORD)
+
+    def make_user(username, **fields):
+        with app.app_context():
+            user = User(username=username, email=f'{username}@example.com',
+                        password_hash=password_hash, **fields)
+            db.session.add(user)
+            return detached(db, user)
+    return make_user
+
+
+@pytest.fixture
+def make_room(app, db):
+    from models import Room, RoomMember
+
+    def make_room(host, room_code='ROOM01', guests=()):
+        with app.app_context():
+            room = Room(room_code=room_code, name=f'Room {room_code}', host_id=host.id)
+            db.session.add(room)
+            db.session.flush()
+            db.session.add(RoomMember(room_id=room.id, user_id=host.id, role='host', is_approved=True))
+            for guest in guests:
+                db.session.add(RoomMember(room_id=room.id, user_id=guest.id, role='guest', is_approved=True))
+            return detached(db, room)
+    return make_room
+
+
+@pytest.fixture
+def login(app, db):
+    """A logged-in test client for ``username``"""
+    def login(username):
+        client = app.test_client()
+        response = client.post('/login', data={'username': username, 'password': PASSWORD})
+        assert response.status_code == 302, f'login as {username} failed'
+        with client.session_transaction() as session:
+            assert session.get('_user_id'), f'login as {username} failed'
+        return client
+    return login
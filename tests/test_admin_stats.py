@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+
+import pytest
+
+import admin_stats as admin_stats_module
+from admin_stats import admin_stats
+
+
+@pytest.fixture
+def clock(app, monkeypatch):
+    """A monotonic clock the test moves by hand, with a 60 second TTL"""
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(admin_stats_module, 'time', SimpleNamespace(monotonic=lambda: clock.now))
+    monkeypatch.setitem(app.config, 'ADMIN_STATS_TTL', 60)
+    return clock
+
+
+def test_stats_are_cached_until_they_expire(app, db, make_user, clock):
+    make_user('first')
+    with app.app_context():
+        assert admin_stats.users()['total_users'] == 1
+
+        make_user('second')
+        clock.now += 59
+        assert admin_stats.users()['total_users'] == 1
+
+        clock.now += 2
+        assert admin_stats.users()['total_users'] == 2
+
+
+def test_invalidate_recomputes(app, db, make_user, clock):
+    make_user('first')
+    with app.app_context():
+        assert admin_stats.rooms()['total_rooms'] == 0
+        assert admin_stats.users()['total_users'] == 1
+
+        make_user('second')
+        admin_stats.invalidate()
+        assert admin_stats.users()['total_users'] == 2
+
+
+def test_admin_actions_invalidate(app, db, make_user, login, clock):
+    make_user('admin', is_admin=True)
+    user = make_user('viewer')
+    with app.app_context():
+        assert admin_stats.users()['banned_users'] == 0
+
+    response = login('admin').post('/admin/api/ban_user', json={'user_id': user.id})
+    assert response.get_json()['success']
+    with app.app_context():
+        assert admin_stats.users()['banned_users'] == 1
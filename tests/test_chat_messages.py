@@ -0,0 +1,41 @@
+import pytest
+
+from models import ChatMessage
+
+
+@pytest.fixture
+def chat(app, db, make_user, make_room, login):
+    """A room with 120 messages and a logged-in member's client"""
+    host = make_user('host')
+    room = make_room(host)
+    with app.app_context():
+        db.session.add_all(ChatMessage(room_id=room.id, user_id=host.id, message=f'm{i}')
+                           for i in range(120))
+        db.session.commit()
+        ids = [message.id for message in ChatMessage.query.order_by(ChatMessage.id)]
+    return login('host'), f'/room/{room.room_code}/messages', ids
+
+
+def test_no_cursor_returns_latest_page_oldest_first(chat):
+    client, url, ids = chat
+    messages = client.get(url).get_json()
+    assert [message['id'] for message in messages] == ids[-50:]
+
+
+def test_after_id_pages_through_everything_missed(chat):
+    client, url, ids = chat
+    seen, after_id = [], ids[9]
+    # What the client does on reconnect: page until a short page comes back
+    while True:
+        page = client.get(f'{url}?after_id={after_id}&limit=50').get_json()
+        seen += [message['id'] for message in page]
+        if len(page) < 50:
+            break
+        after_id = page[-1]['id']
+    assert seen == ids[10:]
+
+
+def test_before_id_scrolls_back(chat):
+    client, url, ids = chat
+    messages = client.get(f'{url}?before_id={ids[30]}&limit=20').get_json()
+    assert [message['id'] for message in messages] == ids[10:30]
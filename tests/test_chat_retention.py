@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from chat_retention import chat_retention
+from models import ArchivedChatMessage, ChatMessage
+
+
+@pytest.fixture
+def rooms(make_user, make_room):
+    host = make_user('host')
+    return host, make_room(host, room_code='ROOMA1'), make_room(host, room_code='ROOMB1')
+
+
+@pytest.fixture
+def retention(app, monkeypatch):
+    """Only the rules a test enables, in batches of 3"""
+    monkeypatch.setitem(app.config, 'CHAT_MAX_AGE_DAYS', 0)
+    monkeypatch.setitem(app.config, 'CHAT_ROOM_CAP', 0)
+    monkeypatch.setitem(app.config, 'CHAT_RETENTION_BATCH', 3)
+    return app.config
+
+
+def post(db, room, user, count, days_old=0, message_type='user'):
+    created_at = datetime.now() - timedelta(days=days_old)
+    messages = [ChatMessage(room_id=room.id, user_id=user.id, message=f'{message_type} {i}',
+                            message_type=message_type, created_at=created_at) for i in range(count)]
+    db.session.add_all(messages)
+    db.session.commit()
+    return [message.id for message in messages]
+
+
+def ids(model, room):
+    return [row.id for row in model.query.filter_by(room_id=room.id).order_by(model.id)]
+
+
+def test_old_messages_are_archived(app, db, rooms, retention):
+    host, room, _ = rooms
+    retention['CHAT_MAX_AGE_DAYS'] = 30
+    with app.app_context():
+        old = post(db, room, host, 7, days_old=40)
+        young = post(db, room, host, 2, days_old=1)
+
+        assert chat_retention.run() == 7
+        assert ids(ChatMessage, room) == young
+        assert ids(ArchivedChatMessage, room) == old
+        archived = db.session.get(ArchivedChatMessage, old[0])
+        assert (archived.user_id, archived.message) == (host.id, 'user 0')
+
+
+def test_rooms_over_the_cap_lose_their_oldest(app, db, rooms, retention):
+    host, room, other = rooms
+    retention['CHAT_ROOM_CAP'] = 10
+    with app.app_context():
+        posted = post(db, room, host, 15)
+        kept = post(db, other, host, 10)
+
+        assert chat_retention.run() == 5
+        assert ids(ChatMessage, room) == posted[5:]
+        assert ids(ArchivedChatMessage, room) == posted[:5]
+        assert ids(ChatMessage, other) == kept
+        assert chat_retention.run() == 0
+
+
+def test_system_messages_are_deleted_not_archived(app, db, rooms, retention):
+    host, room, _ = rooms
+    retention['CHAT_MAX_AGE_DAYS'] = 30
+    with app.app_context():
+        system = post(db, room, host, 2, days_old=40, message_type='system')
+        user = post(db, room, host, 2, days_old=40)
+
+        assert chat_retention.run() == 4
+        assert ids(ChatMessage, room) == []
+        assert ids(ArchivedChatMessage, room) == user
+        assert not set(system) & set(ids(ArchivedChatMessage, room))
+
+
+def test_scroll_back_continues_into_the_archive(app, db, rooms, retention, login):
+    host, room, _ = rooms
+    retention['CHAT_ROOM_CAP'] = 25
+    with app.app_context():
+        post(db, room, host, 3, message_type='system')
+        posted = post(db, room, host, 60)
+        chat_retention.run()
+        live = ids(ChatMessage, room)
+        assert len(live) == 25 and ids(ArchivedChatMessage, room)
+
+    client = login('host')
+    url = f'/room/{room.room_code}/messages'
+    # No cursor: the newest page, all from the hot table
+    latest = [message['id'] for message in client.get(f'{url}?limit=10').get_json()]
+    assert latest == live[-10:]
+
+    # Page back as the client does until a short page comes back
+    seen, before_id = latest, latest[0]
+    while True:
+        page = [message['id'] for message in client.get(f'{url}?before_id={before_id}&limit=10').get_json()]
+        seen = page + seen
+        if len(page) < 10:
+            break
+        before_id = page[0]
+    # Every user message once, in order; the expired system messages are gone
+    assert seen == posted
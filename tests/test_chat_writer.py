@@ -0,0 +1,84 @@
+import threading
+
+from app import socketio
+from chat_writer import chat_writer
+from models import ChatMessage
+
+
+def send_concurrently(app, room_id, user_id, senders, per_sender):
+    """Each sender thread saves its messages in order; returns {sender: [(id, text)]}"""
+    results = {}
+    start = threading.Barrier(senders)
+
+    def sender(index):
+        with app.app_context():
+            start.wait()
+            results[index] = []
+            for number in range(per_sender):
+                text = f'{index}:{number}'
+                message = chat_writer.save(room_id, user_id, text)
+                results[index].append((message.id, message.message))
+
+    threads = [threading.Thread(target=sender, args=(index,)) for index in range(senders)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_group_commit_keeps_ids_matched_and_ordered(app, db, make_user, make_room, monkeypatch):
+    monkeypatch.setitem(app.config, 'CHAT_BATCH_MS', 20)
+    monkeypatch.setitem(app.config, 'CHAT_BATCH_SIZE', 8)
+    host = make_user('host')
+    room = make_room(host)
+
+    results = send_concurrently(app, room.id, host.id, senders=12, per_sender=10)
+
+    with app.app_context():
+        stored = {message.id: message.message
+                  for message in ChatMessage.query.filter_by(room_id=room.id)}
+    assert len(stored) == 12 * 10
+    for index, sent in results.items():
+        # Each id handed back is the row holding that sender's text
+        assert all(stored[message_id] == text for message_id, text in sent)
+        # A sender's messages are stored in the order it sent them
+        ids = [message_id for message_id, _ in sent]
+        assert ids == sorted(ids)
+        assert [text for _, text in sent] == [f'{index}:{number}' for number in range(10)]
+
+
+def test_unbatched_writes_return_the_stored_row(app, db, make_user, make_room, monkeypatch):
+    monkeypatch.setitem(app.config, 'CHAT_BATCH_MS', 0)
+    host = make_user('host')
+    room = make_room(host)
+    with app.app_context():
+        first = chat_writer.save(room.id, host.id, 'one')
+        second = chat_writer.save(room.id, host.id, 'two')
+        assert second.id > first.id
+        assert db.session.get(ChatMessage, second.id).message == 'two'
+
+
+def test_failed_save_is_logged_with_traceback_on_both_paths(app, db, make_user, make_room, login,
+                                                           monkeypatch, caplog):
+    host = make_user('host')
+    room = make_room(host)
+
+    def fail(*args):
+        raise RuntimeError('database is locked')
+    monkeypatch.setattr(chat_writer, 'save', fail)
+
+    client = login('host')
+    response = client.post(f'/room/{room.room_code}/send-message', json={'message': 'hi'})
+    assert response.status_code == 500
+
+    socket = socketio.test_client(app, flask_test_client=client)
+    try:
+        socket.emit('join_room', {'room_code': room.room_code}, callback=True)
+        assert socket.emit('send_message', {'message': 'hi'}, callback=True) == {'error': 'Message could not be saved'}
+    finally:
+        socket.disconnect()
+
+    failures = [record for record in caplog.records if record.getMessage() == 'Error saving chat message']
+    assert len(failures) == 2
+    assert all(record.exc_info and record.exc_info[0] is RuntimeError for record in failures)
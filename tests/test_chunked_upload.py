@@ -0,0 +1,85 @@
+import hashlib
+import os
+
+import pytest
+
+from app import socketio
+from chunked_upload import upload_sessions
+from models import VideoFile
+
+CHUNK = 64 * 1024
+
+
+@pytest.fixture
+def room(make_user, make_room):
+    host, viewer = make_user('host'), make_user('viewer')
+    return make_room(host, guests=[viewer])
+
+
+def start(client, url, data):
+    response = client.post(url, json={'filename': 'movie.mp4', 'size': len(data)})
+    assert response.status_code == 201
+    return response.get_json()['upload_id']
+
+
+def test_upload_resumes_from_the_stored_offset(app, room, login):
+    client = login('host')
+    data = os.urandom(3 * CHUNK + 123)
+    uploads = f'/room/{room.room_code}/uploads'
+    upload_id = start(client, uploads, data)
+    url = f'{uploads}/{upload_id}'
+
+    assert client.put(f'{url}?offset=0', data=data[:CHUNK]).get_json()['offset'] == CHUNK
+
+    # The connection dropped mid-chunk; the client retries from a stale offset
+    response = client.put(f'{url}?offset=0', data=data[:CHUNK])
+    assert response.status_code == 409
+    assert response.get_json()['offset'] == CHUNK
+    # ...or asks where to continue, possibly on another worker with no running hash
+    assert client.get(url).get_json()['offset'] == CHUNK
+    upload_sessions._hashers.clear()
+
+    offset = CHUNK
+    while offset < len(data):
+        offset = client.put(f'{url}?offset={offset}', data=data[offset:offset + CHUNK]).get_json()['offset']
+
+    response = client.post(f'{url}/finalize', json={})
+    assert response.status_code == 200
+    result = response.get_json()
+    assert result['sha256'] == hashlib.sha256(data).hexdigest()
+    assert result['size'] == len(data)
+    assert client.get(url).status_code == 404
+
+    with app.app_context():
+        video = VideoFile.query.one()
+        with open(video.file_path, 'rb') as f:
+            assert f.read() == data
+
+
+def test_finalize_before_the_last_byte_is_refused(room, login):
+    client = login('host')
+    data = os.urandom(2 * CHUNK)
+    uploads = f'/room/{room.room_code}/uploads'
+    url = f'{uploads}/{start(client, uploads, data)}'
+
+    client.put(f'{url}?offset=0', data=data[:CHUNK])
+    response = client.post(f'{url}/finalize', json={})
+    assert response.status_code == 409
+    assert response.get_json()['offset'] == CHUNK
+
+
+def test_lowercase_room_code_still_announces_to_the_room(app, room, login):
+    viewer = socketio.test_client(app, flask_test_client=login('viewer'))
+    viewer.emit('join_room', {'room_code': room.room_code}, callback=True)
+    viewer.get_received()
+
+    client = login('host')
+    data = os.urandom(CHUNK)
+    uploads = f'/room/{room.room_code.lower()}/uploads'
+    url = f'{uploads}/{start(client, uploads, data)}'
+    client.put(f'{url}?offset=0', data=data)
+    assert client.post(f'{url}/finalize', json={}).status_code == 200
+
+    changes = [packet for packet in viewer.get_received() if packet['name'] == 'video_changed']
+    assert len(changes) == 1
+    viewer.disconnect()
@@ -0,0 +1,55 @@
+import time
+
+import pytest
+
+from app import socketio
+
+
+@pytest.fixture
+def sockets(app, make_user, make_room, login):
+    """Host and viewer sockets joined to the same room"""
+    host, viewer = make_user('host'), make_user('viewer')
+    room = make_room(host, guests=[viewer])
+    clients = []
+    for username in ('host', 'viewer'):
+        client = socketio.test_client(app, flask_test_client=login(username))
+        assert client.emit('join_room', {'room_code': room.room_code}, callback=True)['members']
+        client.get_received()
+        clients.append(client)
+    yield clients
+    for client in clients:
+        client.disconnect()
+
+
+def control_updates(client):
+    return [packet['args'][0] for packet in client.get_received()
+            if packet['name'] == 'video_control_update']
+
+
+def test_burst_is_broadcast_once_then_as_final_state(app, sockets, monkeypatch):
+    host, viewer = sockets
+    monkeypatch.setitem(app.config, 'CONTROL_COALESCE_MS', 100)
+
+    for position in range(10):
+        assert host.emit('video_control', {'action': 'seek', 'time': position}, callback=True) == {'success': True}
+    assert host.emit('video_control', {'action': 'play', 'time': 42}, callback=True) == {'success': True}
+    time.sleep(0.35)
+
+    first, final = control_updates(viewer)
+    assert (first['action'], first['time'], first['merged']) == ('seek', 0.0, 0)
+    assert (final['action'], final['time'], final['merged']) == ('play', 42.0, 10)
+    assert final['is_playing']
+    # The sender never gets its own commands back
+    assert control_updates(host) == []
+
+
+def test_commands_after_quiet_period_go_out_immediately(app, sockets, monkeypatch):
+    host, viewer = sockets
+    monkeypatch.setitem(app.config, 'CONTROL_COALESCE_MS', 50)
+
+    host.emit('video_control', {'action': 'play', 'time': 1}, callback=True)
+    time.sleep(0.2)
+    host.emit('video_control', {'action': 'pause', 'time': 5}, callback=True)
+
+    updates = control_updates(viewer)
+    assert [(update['action'], update['merged']) for update in updates] == [('play', 0), ('pause', 0)]
@@ -0,0 +1,111 @@
+"""
+Query-count checks for the room, chat, member, home-page and admin routes.
+
+Seeds the database at two sizes (members per room, messages per room, rooms
+per user), requests every endpoint and counts the SQL statements it issues.
+An endpoint fails if its count changes with the size of the data (an N+1
+lazy load) or exceeds its budget.
+
+Counts are taken on a second, warm request so per-process caches (presence
+rosters, playback state) don't skew them.
+"""
+
+import pytest
+from sqlalchemy import event
+
+from models import ChatMessage, Room, RoomMember
+
+SIZES = (3, 30)
+
+# Maximum statements per warm request
+BUDGETS = {
+    'index': 2,
+    'room': 1,
+    'messages': 1,
+    'members': 0,
+    'member_count': 0,
+    'video_sync': 0,
+    'admin_dashboard': 3,
+    'admin_users': 1,
+    'admin_rooms': 2,
+    'admin_room_stats': 2,
+    'admin_user_stats': 1,
+    'admin_storage': 0,
+}
+
+
+def seed(db, make_user, size):
+    """One host with ``size`` rooms, the first of which has ``size`` members and messages"""
+    make_user('admin', is_admin=True)
+    host = make_user('host')
+    guests = [make_user(f'guest{i}') for i in range(size)]
+
+    rooms = [Room(room_code=f'R{i:05d}', name=f'Room {i}', host_id=host.id) for i in range(size)]
+    db.session.add_all(rooms)
+    db.session.flush()
+    for room in rooms:
+        db.session.add(RoomMember(room_id=room.id, user_id=host.id, role='host', is_approved=True))
+    for guest in guests:
+        db.session.add(RoomMember(room_id=rooms[0].id, user_id=guest.id, role='guest', is_approved=True))
+        db.session.add(ChatMessage(room_id=rooms[0].id, user_id=guest.id, message='hello'))
+    db.session.add(ChatMessage(room_id=rooms[0].id, message='system', message_type='system'))
+    db.session.commit()
+    return rooms[0].room_code
+
+
+def measure(app, db, make_user, login, size):
+    with app.app_context():
+        room_code = seed(db, make_user, size)
+    host, admin = login('host'), login('admin')
+    endpoints = {
+        'index': (host, '/'),
+        'room': (host, f'/room/{room_code}'),
+        'messages': (host, f'/room/{room_code}/messages'),
+        'members': (host, f'/room/{room_code}/members'),
+        'member_count': (host, f'/room/{room_code}/member-count'),
+        'video_sync': (host, f'/room/{room_code}/video-sync'),
+        'admin_dashboard': (admin, '/admin'),
+        'admin_users': (admin, '/admin/users'),
+        'admin_rooms': (admin, '/admin/rooms'),
+        'admin_room_stats': (admin, '/admin/api/get_room_stats'),
+        'admin_user_stats': (admin, '/admin/api/get_user_stats'),
+        'admin_storage': (admin, '/admin/api/storage'),
+    }
+
+    statements = []
+
+    def record(conn, cursor, statement, *rest):
+        statements.append(statement)
+
+    counts = {}
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        for name, (client, url) in endpoints.items():
+            client.get(url)  # warm per-process caches
+            statements.clear()
+            response = client.get(url)
+            assert response.status_code == 200, f'{url} returned {response.status_code}'
+            counts[name] = len(statements)
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    return counts
+
+
+@pytest.fixture
+def counts(app, db, make_user, login, reset):
+    results = {}
+    for size in SIZES:
+        reset()
+        results[size] = measure(app, db, make_user, login, size)
+    return results
+
+
+def test_query_counts_are_fixed_and_within_budget(counts):
+    failures = []
+    for name, budget in BUDGETS.items():
+        row = [counts[size][name] for size in SIZES]
+        if len(set(row)) != 1 or row[0] > budget:
+            failures.append(f'{name}: {dict(zip(SIZES, row))} (budget {budget})')
+    assert not failures, 'endpoints vary with data size or exceed their budget:\n' + '\n'.join(failures)
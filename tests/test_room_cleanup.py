@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, update
+
+from app import socketio
+from models import Room, RoomMember
+from playback import playback_store
+from presence import presence_registry
+from room_cleanup import idle_room_ids
+
+
+def age_rooms(db, days):
+    """Backdate every room's last change by ``days``"""
+    db.session.execute(update(Room).values(updated_at=datetime.now() - timedelta(days=days)))
+    db.session.commit()
+
+
+def test_room_live_on_another_worker_is_not_idle(app, db, make_user, make_room):
+    host = make_user('host')
+    live, stale, never = (make_room(host, room_code=code) for code in ('LIVE01', 'STALE1', 'NEVER1'))
+    with app.app_context():
+        age_rooms(db, 10)
+        # Stamps as written by the flush loop of whichever worker holds the sockets
+        db.session.execute(update(Room).where(Room.id == live.id)
+                           .values(last_active_at=datetime.now(), updated_at=Room.updated_at))
+        db.session.execute(update(Room).where(Room.id == stale.id)
+                           .values(last_active_at=datetime.now() - timedelta(days=9), updated_at=Room.updated_at))
+        db.session.commit()
+
+        assert idle_room_ids(timedelta(days=7)) == [stale.id, never.id]
+        # Even "idle for 0 days" spares rooms stamped within the last intervals
+        assert live.id not in idle_room_ids(timedelta(0))
+
+
+def test_stamp_covers_rooms_with_sockets_here(app, db, make_user, make_room, monkeypatch):
+    host = make_user('host')
+    room = make_room(host)
+    with app.app_context():
+        age_rooms(db, 10)
+        presence_registry.connect('sid-1', host.id)
+        presence_registry.join('sid-1', room.room_code)
+        monkeypatch.setattr(playback_store, '_activity_stamped', 0)
+
+        assert playback_store.stamp_activity() == 1
+        # Throttled to once per ACTIVITY_INTERVAL
+        assert playback_store.stamp_activity() == 0
+        db.session.expire_all()
+        room = db.session.get(Room, room.id)
+        assert room.last_active_at > datetime.now() - timedelta(minutes=1)
+        # The stamp is not a change to the room
+        assert room.updated_at < datetime.now() - timedelta(days=9)
+
+        presence_registry.disconnect('sid-1')
+        assert idle_room_ids(timedelta(days=7)) == []
+
+
+def test_room_deleted_by_another_worker_is_not_found(app, db, make_user, make_room, login):
+    host = make_user('host')
+    room = make_room(host)
+    client = login('host')
+    # Caches the room context, as the other worker's invalidation does not reach this one
+    assert client.get(f'/room/{room.room_code}/member-count').status_code == 200
+    with app.app_context():
+        db.session.execute(delete(RoomMember).where(RoomMember.room_id == room.id))
+        db.session.execute(delete(Room).where(Room.id == room.id))
+        db.session.commit()
+    playback_store._states.clear()
+
+    assert client.get(f'/room/{room.room_code}/video-sync').status_code == 404
+    response = client.post(f'/room/{room.room_code}/video-control', json={'action': 'seek', 'time': 5})
+    assert response.status_code == 404
+    response = client.post(f'/room/{room.room_code}/video-control',
+                           json={'action': 'load_youtube', 'url': 'https://youtu.be/dQw4w9WgXcQ'})
+    assert response.status_code == 404
+    assert client.get(f'/room/{room.room_code}').status_code == 302
+
+    socket = socketio.test_client(app, flask_test_client=client)
+    try:
+        assert socket.emit('join_room', {'room_code': room.room_code}, callback=True) == {'error': 'Room not found'}
+        assert socket.emit('video_control', {'action': 'seek', 'time': 1}, callback=True) == {'error': 'Not in a room'}
+    finally:
+        socket.disconnect()
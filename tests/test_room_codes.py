@@ -0,0 +1,45 @@
+from models import Counter, Room
+from room_codes import CODE_SPACE, COUNTER_NAME, RoomCodeAllocator, encode
+
+
+def test_permutation_is_a_bijection_on_a_sample():
+    allocator = RoomCodeAllocator(key=b'test')
+    numbers = [allocator.permute(number) for number in range(5000)]
+    assert len(set(numbers)) == len(numbers)
+    assert all(0 <= number < CODE_SPACE for number in numbers)
+
+
+def test_workers_and_restarts_share_one_sequence(app, db):
+    # Two allocators stand in for two workers, or one worker before and after a restart
+    first, second = RoomCodeAllocator(), RoomCodeAllocator()
+    with app.app_context():
+        codes = [allocator.next_code() for _ in range(50) for allocator in (first, second)]
+        db.session.commit()
+        assert len(set(codes)) == len(codes)
+        assert db.session.get(Counter, COUNTER_NAME).value == 100
+        # The key comes from SECRET_KEY, so a fresh process maps the counter the same way
+        assert codes[0] == encode(RoomCodeAllocator().permute(0))
+
+
+def test_create_room_skips_a_code_taken_by_the_old_generator(app, db, make_user, login):
+    host = make_user('host')
+    with app.app_context():
+        taken = encode(RoomCodeAllocator().permute(0))
+        db.session.add(Room(room_code=taken, name='Legacy', host_id=host.id))
+        db.session.commit()
+
+    response = login('host').post('/create-room', data={'room_name': 'New'})
+    assert response.status_code == 302
+    with app.app_context():
+        room = Room.query.filter_by(name='New').one()
+        assert room.room_code == encode(RoomCodeAllocator().permute(1))
+
+
+def test_counter_row_is_created_on_first_use(app, db):
+    with app.app_context():
+        Counter.query.delete()
+        db.session.commit()
+        assert RoomCodeAllocator().next_number() == 0
+        assert RoomCodeAllocator().next_number() == 1
+        db.session.commit()
+        assert db.session.get(Counter, COUNTER_NAME).value == 2
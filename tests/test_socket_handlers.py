@@ -0,0 +1,26 @@
+import pytest
+
+from app import socketio
+
+
+@pytest.fixture
+def socket(app, make_user, make_room, login):
+    host = make_user('host')
+    make_room(host)
+    client = socketio.test_client(app, flask_test_client=login('host'))
+    yield client
+    client.disconnect()
+
+
+@pytest.mark.parametrize('args', [(), (None,)])
+def test_events_without_a_payload_are_refused(socket, args):
+    assert socket.emit('join_room', *args, callback=True) == {'error': 'Room code is required'}
+    socket.emit('leave_room', *args)
+    assert socket.is_connected()
+
+    assert socket.emit('join_room', {'room_code': 'ROOM01'}, callback=True)['members']
+    assert socket.emit('send_message', *args, callback=True) == {'error': 'Message cannot be empty'}
+    assert socket.emit('video_control', *args, callback=True) == {'error': 'Invalid action'}
+    socket.emit('change_video', *args, callback=True)
+    socket.emit('leave_room', *args)
+    assert socket.is_connected()
@@ -0,0 +1,51 @@
+import gc
+import time
+
+import socketio
+
+from socket_queue import LocalManager
+
+CHANNEL = 'test-fanout'
+
+
+def server():
+    manager = LocalManager('local://', channel=CHANNEL)
+    sio = socketio.Server(client_manager=manager, async_mode='threading')
+    manager.initialize()  # normally on the first connection
+    return sio, manager
+
+
+def test_emit_on_one_server_reaches_a_room_on_another():
+    (first, first_manager), (second, second_manager) = server(), server()
+    try:
+        # A client of the second server in the room
+        sid = second_manager.connect('eio-1', '/')
+        second_manager.enter_room(sid, '/', 'ROOM01')
+        received = []
+        second._send_eio_packet = lambda eio_sid, packet: received.append((eio_sid, packet.data))
+
+        first.emit('new_message', {'message': 'hello'}, to='ROOM01')
+
+        deadline = time.monotonic() + 2
+        while not received and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert received == [('eio-1', '2["new_message",{"message":"hello"}]')]
+    finally:
+        first_manager.close()
+        second_manager.close()
+
+
+def test_closed_and_dropped_managers_stop_collecting():
+    (_, first_manager), (_, second_manager) = server(), server()
+    first_manager.close()
+    first_manager.thread.join(timeout=2)
+    assert not first_manager.thread.is_alive()
+    assert set(LocalManager._subscribers[CHANNEL]) == {second_manager}
+
+    second_manager.close()
+    assert CHANNEL not in LocalManager._subscribers
+
+    # Never initialized and no longer referenced: gone without close()
+    LocalManager('local://', channel=CHANNEL)
+    gc.collect()
+    assert not LocalManager._subscribers.get(CHANNEL)
@@ -0,0 +1,87 @@
+import io
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import update
+
+from models import VideoBlob, VideoFile
+from playback import playback_store
+from storage_sweeper import storage_sweeper
+
+
+@pytest.fixture
+def sweep_config(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'STORAGE_ORPHAN_GRACE', 60)
+    monkeypatch.setitem(app.config, 'STORAGE_REPLACED_AFTER', 3600)
+
+
+def upload(client, room, data):
+    response = client.post(f'/room/{room.room_code}/upload-video',
+                           data={'video': (io.BytesIO(data), 'movie.mp4')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    return response.get_json()['video_url']
+
+
+def age(path, seconds=3600):
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+
+def test_replaced_upload_is_expired_and_its_file_freed(app, db, sweep_config, make_user, make_room, login):
+    host = make_user('host')
+    room = make_room(host)
+    client = login('host')
+    old, current = os.urandom(30000), os.urandom(20000)
+    upload(client, room, old)
+    upload(client, room, current)
+
+    with app.app_context():
+        db_blobs = VideoBlob.query.order_by(VideoBlob.id).all()
+        paths = [os.path.join(app.config['UPLOAD_FOLDER'], blob.filename) for blob in db_blobs]
+        for path in paths:
+            age(path)
+        # Written back by the playback flusher within seconds of the switch
+        playback_store.flush()
+        db.session.execute(update(VideoFile).values(created_at=datetime.now() - timedelta(days=2)))
+        db.session.commit()
+
+        report = storage_sweeper.run()
+        assert report['expired_uploads'] == 1
+        assert report['deleted_blobs'] == 1
+        assert report['freed_bytes'] == len(old)
+        # The room's current video stays, with its reference
+        assert [(blob.filename, blob.ref_count) for blob in VideoBlob.query] == [(db_blobs[1].filename, 1)]
+    assert not os.path.exists(paths[0])
+    assert os.path.exists(paths[1])
+
+
+def test_orphan_files_are_removed_after_the_grace_period(app, db, sweep_config):
+    folder = app.config['UPLOAD_FOLDER']
+    stale, fresh = os.path.join(folder, 'stale.mp4'), os.path.join(folder, 'fresh.mp4')
+    for path in (stale, fresh):
+        with open(path, 'wb') as f:
+            f.write(b'x' * 100)
+    age(stale)
+
+    with app.app_context():
+        report = storage_sweeper.run()
+    assert report['orphan_files'] == 1
+    assert not os.path.exists(stale)
+    # Possibly an upload about to be committed
+    assert os.path.exists(fresh)
+
+
+def test_referenced_blob_is_never_deleted(app, sweep_config, make_user, make_room, login):
+    host = make_user('host')
+    room = make_room(host)
+    upload(login('host'), room, os.urandom(10000))
+    with app.app_context():
+        blob = VideoBlob.query.one()
+        path = os.path.join(app.config['UPLOAD_FOLDER'], blob.filename)
+        age(path)
+        report = storage_sweeper.run()
+        assert report['deleted_blobs'] == report['orphan_files'] == 0
+    assert os.path.exists(path)
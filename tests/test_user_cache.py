@@ -0,0 +1,41 @@
+from models import User
+from user_cache import user_cache
+
+
+def test_banned_user_is_logged_out_on_next_request(app, db, make_user, make_room, login):
+    make_user('admin', is_admin=True)
+    user = make_user('viewer')
+    room = make_room(user)
+    admin, viewer = login('admin'), login('viewer')
+    url = f'/room/{room.room_code}/member-count'
+
+    # Cache the viewer's identity
+    assert viewer.get(url).status_code == 200
+    assert user.id in user_cache._entries
+
+    response = admin.post('/admin/api/ban_user', json={'user_id': user.id})
+    assert response.get_json()['success']
+    assert user.id not in user_cache._entries
+
+    response = viewer.get(url)
+    assert response.status_code == 302
+    assert '/login' in response.location
+
+
+def test_cached_identity_is_reused_until_invalidated(app, db, make_user):
+    user = make_user('viewer')
+    with app.app_context():
+        first = user_cache.get(user.id)
+        # Changed behind the cache's back: still served from memory
+        db.session.get(User, user.id).first_name = 'Changed'
+        db.session.commit()
+        assert user_cache.get(user.id) is first
+
+        user_cache.invalidate(user.id)
+        assert user_cache.get(user.id).display_name == 'Changed'
+
+
+def test_unknown_user_is_not_cached(app, db):
+    with app.app_context():
+        assert user_cache.get(12345) is None
+    assert 12345 not in user_cache._entries
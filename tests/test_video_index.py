@@ -0,0 +1,165 @@
+import io
+import os
+import struct
+import time
+
+import pytest
+from sqlalchemy import select
+
+from app import db, socketio
+from models import VideoBlob
+from video_index import ContainerError, index_file, video_indexer
+
+TIMESCALE = 1000
+SAMPLES = 50
+
+
+def box(kind, *payload):
+    body = b''.join(payload)
+    return struct.pack('>I4s', 8 + len(body), kind) + body
+
+
+def full(kind, *payload):
+    """A box with version 0 and no flags"""
+    return box(kind, b'\0\0\0\0', *payload)
+
+
+def sample_sizes(size=1000):
+    return full(b'stsz', struct.pack('>II', 0, SAMPLES), struct.pack(f'>{SAMPLES}I', *[size] * SAMPLES))
+
+
+def mp4(sizes=None):
+    """A progressive MP4 of one video track: SAMPLES samples of 40ms, a sync sample every 10"""
+    entry = box(b'avc1', bytes(24), struct.pack('>HH', 640, 360), bytes(50))
+    stbl = box(b'stbl',
+               full(b'stsd', struct.pack('>I', 1), entry),
+               full(b'stts', struct.pack('>III', 1, SAMPLES, 40)),
+               full(b'stss', struct.pack('>6I', 5, 1, 11, 21, 31, 41)),
+               full(b'stsc', struct.pack('>IIII', 1, 1, SAMPLES, 1)),
+               sizes if sizes is not None else sample_sizes(),
+               full(b'stco', struct.pack('>II', 1, 4096)))
+    mdia = box(b'mdia',
+               full(b'mdhd', struct.pack('>IIII', 0, 0, TIMESCALE, SAMPLES * 40), bytes(4)),
+               full(b'hdlr', bytes(4), b'vide', bytes(12)),
+               box(b'minf', stbl))
+    trak = box(b'trak', full(b'tkhd', struct.pack('>III', 0, 0, 1), bytes(64)), mdia)
+    moov = box(b'moov', full(b'mvhd', struct.pack('>IIII', 0, 0, TIMESCALE, SAMPLES * 40), bytes(80)), trak)
+    data = box(b'ftyp', b'isom', bytes(4), b'isom') + moov
+    return data + box(b'mdat', bytes(4096 + SAMPLES * 1000 - len(data) - 8))
+
+
+def truncated_stz2():
+    """16-bit compact sample sizes: claims SAMPLES of them, holds three bytes"""
+    return full(b'stz2', b'\0\0\0\x10', struct.pack('>I', SAMPLES), b'\0\x10\0')
+
+
+def indexed_blob(app):
+    """(indexed_at, duration, media_index) of the only blob, once the background task ran"""
+    deadline = time.monotonic() + 5
+    while True:
+        with app.app_context():
+            row = db.session.execute(
+                select(VideoBlob.indexed_at, VideoBlob.duration, VideoBlob.media_index)).one()
+        if row.indexed_at is not None or time.monotonic() > deadline:
+            return row
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def write(tmp_path):
+    def write(data):
+        path = tmp_path / 'video.mp4'
+        path.write_bytes(data)
+        return str(path)
+    return write
+
+
+def test_keyframes_of_a_progressive_file(write):
+    index = index_file(write(mp4()))
+    assert index.container == 'mp4'
+    assert index.duration == 2.0
+    assert (index.video_codec, index.width, index.height) == ('avc1', 640, 360)
+    assert index.times == [0, 400, 800, 1200, 1600]
+    assert index.offsets == [4096 + i * 10000 for i in range(5)]
+
+
+def test_truncated_stz2_is_rejected(write):
+    with pytest.raises(ContainerError, match='overruns'):
+        index_file(write(mp4(sizes=truncated_stz2())))
+
+
+def test_sample_count_beyond_the_box_is_rejected(write):
+    stsz = full(b'stsz', struct.pack('>II', 0, 0xFFFFFFFF), struct.pack('>I', 1000))
+    with pytest.raises(ContainerError):
+        index_file(write(mp4(sizes=stsz)))
+
+
+def test_constant_size_count_beyond_the_file_is_rejected(write):
+    stsz = full(b'stsz', struct.pack('>II', 1, 0xFFFFFFFF))
+    with pytest.raises(ContainerError):
+        index_file(write(mp4(sizes=stsz)))
+
+
+@pytest.mark.parametrize('head', [b'', b'\0\0\0\x18ftyp', b'\x1a\x45\xdf\xa3', b'\x1a\x45\xdf\xa3\x9f'])
+def test_random_bytes_are_rejected(write, head):
+    data = head + os.urandom(20000)
+    with pytest.raises(ContainerError):
+        index_file(write(data))
+
+
+def test_malformed_upload_is_published_without_an_index(app, make_user, make_room, login):
+    host = make_user('host')
+    room = make_room(host)
+    response = login('host').post(f'/room/{room.room_code}/upload-video',
+                                  data={'video': (io.BytesIO(mp4(sizes=truncated_stz2())), 'movie.mp4')},
+                                  content_type='multipart/form-data')
+    assert response.status_code == 200
+
+    # Indexed by a background task after the upload committed
+    blob = indexed_blob(app)
+    assert blob.indexed_at is not None
+    assert blob.media_index is None
+
+
+def test_upload_is_indexed_in_the_background(app, make_user, make_room, login):
+    host = make_user('host')
+    room = make_room(host)
+    response = login('host').post(f'/room/{room.room_code}/upload-video',
+                                  data={'video': (io.BytesIO(mp4()), 'movie.mp4')},
+                                  content_type='multipart/form-data')
+    video_url = response.get_json()['video_url']
+
+    assert indexed_blob(app).duration == 2.0
+    with app.app_context():
+        assert video_indexer.get(video_url).times == [0, 400, 800, 1200, 1600]
+
+
+def test_broadcasts_carry_prefetch_hints(app, make_user, make_room, login):
+    host, viewer = make_user('host'), make_user('viewer')
+    room = make_room(host, guests=[viewer])
+    response = login('host').post(f'/room/{room.room_code}/upload-video',
+                                  data={'video': (io.BytesIO(mp4()), 'movie.mp4')},
+                                  content_type='multipart/form-data')
+    video_url = response.get_json()['video_url']
+    assert indexed_blob(app).duration == 2.0
+
+    sockets = []
+    for username in ('host', 'viewer'):
+        client = socketio.test_client(app, flask_test_client=login(username))
+        client.emit('join_room', {'room_code': room.room_code}, callback=True)
+        client.get_received()
+        sockets.append(client)
+    try:
+        host_socket, viewer_socket = sockets
+        host_socket.emit('change_video', {'video_url': video_url, 'video_type': 'local'})
+        host_socket.emit('video_control', {'action': 'seek', 'time': 1.0}, callback=True)
+        received = {packet['name']: packet['args'][0] for packet in viewer_socket.get_received()}
+    finally:
+        for client in sockets:
+            client.disconnect()
+
+    changed = received['video_changed']
+    assert changed['duration'] == 2.0
+    assert changed['prefetch'][0][0] == 0
+    # From the keyframe at 0.8s
+    assert received['video_control_update']['prefetch'][0][0] == 4096 + 2 * 10000
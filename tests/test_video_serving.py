@@ -0,0 +1,168 @@
+import hashlib
+import os
+import re
+
+import pytest
+from werkzeug.exceptions import NotFound
+from werkzeug.http import http_date
+
+from video_serving import video_server
+
+SIZE = 100000
+
+
+@pytest.fixture
+def video(app, db):
+    """(URL, bytes, ETag) of a content-addressed upload"""
+    data = os.urandom(SIZE)
+    digest = hashlib.sha256(data).hexdigest()
+    with open(os.path.join(app.config['UPLOAD_FOLDER'], digest + '.mp4'), 'wb') as f:
+        f.write(data)
+    return f'/uploads/{digest}.mp4', data, f'"{digest}"'
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def test_whole_file(client, video):
+    url, data, etag = video
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.data == data
+    assert response.headers['Content-Length'] == str(SIZE)
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert 'immutable' in response.headers['Cache-Control']
+    assert response.headers['ETag'] == etag
+
+
+def test_etag_is_the_content_hash_and_survives_a_copy(app, client, video):
+    url, data, etag = video
+    path = os.path.join(app.config['UPLOAD_FOLDER'], url.rsplit('/', 1)[1])
+    os.utime(path, (0, 0))
+    assert client.get(url).headers['ETag'] == etag
+
+
+def test_etag_of_older_uploads_is_size_and_mtime(app, client):
+    with open(os.path.join(app.config['UPLOAD_FOLDER'], '20240101_000000_movie.mp4'), 'wb') as f:
+        f.write(b'x' * 10)
+    etag = client.get('/uploads/20240101_000000_movie.mp4').headers['ETag']
+    assert re.fullmatch(r'"a-[0-9a-f]+"', etag)
+
+
+def test_single_range(client, video):
+    url, data, _ = video
+    response = client.get(url, headers={'Range': 'bytes=100-199'})
+    assert response.status_code == 206
+    assert response.data == data[100:200]
+    assert response.headers['Content-Range'] == f'bytes 100-199/{SIZE}'
+    assert response.headers['Content-Length'] == '100'
+
+
+def test_suffix_range(client, video):
+    url, data, _ = video
+    response = client.get(url, headers={'Range': 'bytes=-500'})
+    assert response.status_code == 206
+    assert response.data == data[-500:]
+    assert response.headers['Content-Range'] == f'bytes {SIZE - 500}-{SIZE - 1}/{SIZE}'
+
+
+def test_open_ended_range_is_clipped_to_the_file(client, video):
+    url, data, _ = video
+    response = client.get(url, headers={'Range': f'bytes={SIZE - 10}-{SIZE * 2}'})
+    assert response.status_code == 206
+    assert response.data == data[-10:]
+
+
+def test_several_ranges_are_multipart(client, video):
+    url, data, _ = video
+    response = client.get(url, headers={'Range': 'bytes=0-9,50-59,60-69,1000-1004'})
+    assert response.status_code == 206
+    boundary = response.mimetype_params['boundary']
+    assert response.mimetype == 'multipart/byteranges'
+    body = response.get_data()
+    assert response.headers['Content-Length'] == str(len(body))
+
+    parts = body.split(f'--{boundary}'.encode())[1:-1]
+    # Adjacent ranges are merged
+    assert len(parts) == 3
+    found = []
+    for part in parts:
+        head, payload = part.split(b'\r\n\r\n', 1)
+        start, stop = map(int, re.search(rb'Content-Range: bytes (\d+)-(\d+)/', head).groups())
+        payload = payload[:-2] if payload.endswith(b'\r\n') else payload
+        assert payload == data[start:stop + 1]
+        found.append((start, stop))
+    assert found == [(0, 9), (50, 69), (1000, 1004)]
+
+
+def test_if_none_match_is_not_modified(client, video):
+    url, _, etag = video
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert client.get(url, headers={'If-None-Match': '"other"'}).status_code == 200
+
+
+def test_unsatisfiable_range(client, video):
+    url, _, _ = video
+    response = client.get(url, headers={'Range': f'bytes={SIZE}-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{SIZE}'
+
+
+def test_if_range(app, client, video):
+    url, data, etag = video
+    response = client.get(url, headers={'Range': 'bytes=0-9', 'If-Range': etag})
+    assert (response.status_code, response.data) == (206, data[:10])
+
+    # A different version: the whole file
+    response = client.get(url, headers={'Range': 'bytes=0-9', 'If-Range': '"other"'})
+    assert (response.status_code, len(response.data)) == (200, SIZE)
+
+    last_modified = client.get(url).headers['Last-Modified']
+    response = client.get(url, headers={'Range': 'bytes=0-9', 'If-Range': last_modified})
+    assert response.status_code == 206
+    response = client.get(url, headers={'Range': 'bytes=0-9', 'If-Range': http_date(0)})
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize('path', ['/uploads/..%2Fapp.py', '/uploads/%2E%2E', '/uploads/missing.mp4'])
+def test_outside_or_missing_is_not_found(client, path):
+    assert client.get(path).status_code == 404
+
+
+def test_traversal_is_not_found(app):
+    with app.test_request_context('/uploads/x'):
+        for name in ('../app.py', '..', '/etc/passwd'):
+            with pytest.raises(NotFound):
+                video_server.send(app.config['UPLOAD_FOLDER'], name)
+
+
+def test_streams_past_the_limit_get_503(app, client, video, monkeypatch):
+    url, data, _ = video
+    monkeypatch.setitem(app.config, 'VIDEO_MAX_STREAMS', 1)
+    monkeypatch.setattr(video_server, '_slots', None)
+
+    # Not read yet, so it keeps its slot
+    first = client.get(url)
+    assert first.status_code == 200
+    busy = client.get(url, headers={'Range': 'bytes=0-9'})
+    assert busy.status_code == 503
+    assert busy.headers['Retry-After'] == '1'
+    # HEAD requests take no slot
+    assert client.head(url).status_code == 200
+
+    first.close()
+    assert client.get(url, headers={'Range': 'bytes=0-9'}).data == data[:10]
+
+
+def test_offload_sends_headers_only(app, client, video, monkeypatch):
+    url, _, etag = video
+    monkeypatch.setitem(app.config, 'VIDEO_OFFLOAD', 'x-accel')
+    response = client.get(url, headers={'Range': 'bytes=0-9'})
+    assert response.status_code == 200
+    assert response.headers['X-Accel-Redirect'] == app.config['VIDEO_ACCEL_PREFIX'] + url.rsplit('/', 1)[1]
+    assert response.headers['ETag'] == etag
+    assert response.data == b''
@@ -0,0 +1,76 @@
+import hashlib
+import io
+import os
+
+import pytest
+
+from models import VideoBlob, VideoFile
+from room_cleanup import delete_rooms
+
+
+@pytest.fixture
+def rooms(make_user, make_room):
+    host = make_user('host')
+    return make_room(host, room_code='ROOMA1'), make_room(host, room_code='ROOMB1')
+
+
+def upload(client, room, data, filename='movie.mp4'):
+    response = client.post(f'/room/{room.room_code}/upload-video',
+                           data={'video': (io.BytesIO(data), filename)},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['video_url']
+
+
+def blobs(app):
+    with app.app_context():
+        return [(blob.sha256, blob.ref_count) for blob in VideoBlob.query.order_by(VideoBlob.id)]
+
+
+def stored_files(app):
+    return sorted(name for name in os.listdir(app.config['UPLOAD_FOLDER']) if not name.startswith('.'))
+
+
+def test_same_content_is_stored_once_and_counted(app, rooms, login):
+    client = login('host')
+    data = os.urandom(50000)
+    digest = hashlib.sha256(data).hexdigest()
+
+    first = upload(client, rooms[0], data)
+    second = upload(client, rooms[1], data, filename='copy.mp4')
+
+    assert first == second
+    assert blobs(app) == [(digest, 2)]
+    assert stored_files(app) == [digest + '.mp4']
+    with app.app_context():
+        assert VideoFile.query.count() == 2
+
+
+def test_known_digest_skips_the_upload(app, rooms, login):
+    client = login('host')
+    data = os.urandom(50000)
+    digest = hashlib.sha256(data).hexdigest()
+    upload(client, rooms[0], data)
+
+    response = client.post(f'/room/{rooms[1].room_code}/uploads',
+                           json={'filename': 'again.mp4', 'size': len(data), 'sha256': digest})
+    assert response.get_json()['deduplicated']
+    assert blobs(app) == [(digest, 2)]
+
+    # A digest with the wrong size is not trusted
+    response = client.post(f'/room/{rooms[1].room_code}/uploads',
+                           json={'filename': 'again.mp4', 'size': len(data) + 1, 'sha256': digest})
+    assert response.status_code == 201
+    assert blobs(app) == [(digest, 2)]
+
+
+def test_deleting_rooms_releases_their_references(app, rooms, login):
+    client = login('host')
+    shared, own = os.urandom(40000), os.urandom(40000)
+    upload(client, rooms[0], shared)
+    upload(client, rooms[1], shared)
+    upload(client, rooms[0], own)
+
+    with app.app_context():
+        delete_rooms([rooms[0].id])
+    assert blobs(app) == [(hashlib.sha256(shared).hexdigest(), 1), (hashlib.sha256(own).hexdigest(), 0)]
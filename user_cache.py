@@ -0,0 +1,81 @@
+"""
+Identity records for Flask-Login.
+
+``load_user`` runs on every authenticated request (and Socket.IO connect),
+so instead of loading the ``User`` row each time it serves a compact,
+read-only :class:`CachedUser` from a bounded LRU map. Records expire after
+``USER_CACHE_TTL`` seconds and are dropped immediately by the admin
+endpoints that change them (promote, ban, unban, password change). With
+several workers the TTL bounds how long another worker keeps a stale record.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from flask_login import UserMixin
+
+from app import db
+
+
+class CachedUser(UserMixin):
+    """Read-only stand-in for ``User`` as ``current_user``"""
+
+    __slots__ = ('id', 'username', 'display_name', 'is_admin', 'is_banned', 'expires_at')
+
+    def __init__(self, id, username, display_name, is_admin, is_banned, expires_at):
+        self.id = id
+        self.username = username
+        self.display_name = display_name
+        self.is_admin = bool(is_admin)
+        self.is_banned = bool(is_banned)
+        self.expires_at = expires_at
+
+    @classmethod
+    def from_user(cls, user, expires_at):
+        return cls(user.id, user.username, user.display_name,
+                   user.is_admin, user.is_banned, expires_at)
+
+    @property
+    def is_active(self):
+        return not self.is_banned
+
+
+class UserCache:
+    """Process-wide LRU map of user id -> CachedUser"""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """Return the cached identity for a user, loading it on a miss (None if unknown)"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(user_id)
+            if cached is not None and cached.expires_at > now:
+                self._entries.move_to_end(user_id)
+                return cached
+
+        from models import User
+        user = db.session.get(User, user_id)
+        if user is None:
+            self.invalidate(user_id)
+            return None
+
+        cached = CachedUser.from_user(user, now + current_app.config.get('USER_CACHE_TTL', 30))
+        max_size = current_app.config.get('USER_CACHE_SIZE', 10000)
+        with self._lock:
+            self._entries[user_id] = cached
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > max_size:
+                self._entries.popitem(last=False)
+        return cached
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+user_cache = UserCache()
@@ -0,0 +1,810 @@
+"""
+Container indexes for uploaded videos.
+
+The server used to know nothing about an upload beyond its size, so it
+could not keep a seek inside the video, and a viewer seeking in a local
+video waited while the browser found the right byte offset through a
+series of range requests. When an upload is published its container is
+now parsed here, in pure Python and without external tools, by a
+background task started once the upload is committed (so a slow parse
+never holds the database's write lock):
+
+* MP4 / MOV: ``mvhd`` and ``mdhd`` give the duration, ``stsd`` the codecs
+  and picture size, and the sample tables of the first video track
+  (``stts``, ``stss``, ``stsc``, ``stsz``/``stz2``, ``stco``/``co64``) the
+  time and byte offset of every sync sample. Fragmented files are indexed
+  by fragment: each ``moof`` with the ``tfdt`` time of its video track.
+* WebM / Matroska: ``Info`` gives the duration, ``Tracks`` the codecs and
+  picture size, and ``Cues`` (found through the ``SeekHead`` when they
+  follow the clusters) the time and cluster position of each cue point.
+
+Only container metadata is read (a few hundred KB for a feature film),
+never the media data. The result is stored on the ``VideoBlob``, so content
+uploaded again is not indexed again: duration and codecs as columns, and in
+``media_index`` the byte ranges a player reads before it can start (``ftyp``
+and ``moov``, or the WebM headers and cues) plus a keyframe table of at
+most ``MAX_KEYFRAMES`` entries, delta-encoded JSON.
+
+:meth:`VideoIndexer.hints` turns a position into the byte ranges needed to
+play ``VIDEO_PREFETCH_SECONDS`` from there: from the keyframe at or before
+it to the first keyframe after the window, at most ``VIDEO_PREFETCH_MAX_MB``.
+``video_changed``, seek broadcasts and the join acknowledgement carry these
+hints, and browsers fetch them ahead of the media element so its own range
+requests are answered from the HTTP cache. On broadcasts each browser only
+fetches the first range, one request at a time, so a full room does not take
+every ``VIDEO_MAX_STREAMS`` slot at once. Seeks are clamped to the indexed
+duration.
+"""
+
+import bisect
+import json
+import logging
+import os
+import re
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from datetime import datetime
+from itertools import accumulate
+
+from flask import current_app
+from sqlalchemy import select
+
+from app import db, socketio
+from video_store import video_store
+
+# Keyframe table entries kept per video; denser tables are thinned evenly
+MAX_KEYFRAMES = 4096
+
+# Metadata boxes and elements larger than this are not read into memory
+MAX_METADATA = 64 * 1024 * 1024
+
+# Prefetch ranges closer together than this are fetched as one
+MERGE_GAP = 64 * 1024
+
+# Indexes of recently played videos kept in memory per process
+CACHE_SIZE = 256
+
+# Seconds a video without an index is remembered as such before it is looked up again
+MISSING_TTL = 60
+
+BLOB_URL = re.compile(r'/uploads/([0-9a-f]{64})(?:\.\w+)?$')
+
+# Matroska element ids (marker bits included)
+EBML = 0x1A45DFA3
+DOC_TYPE = 0x4282
+SEGMENT = 0x18538067
+SEEK_HEAD = 0x114D9B74
+SEEK = 0x4DBB
+SEEK_ID = 0x53AB
+SEEK_POSITION = 0x53AC
+INFO = 0x1549A966
+TIMECODE_SCALE = 0x2AD7B1
+DURATION = 0x4489
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_NUMBER = 0xD7
+TRACK_TYPE = 0x83
+CODEC_ID = 0x86
+VIDEO = 0xE0
+PIXEL_WIDTH = 0xB0
+PIXEL_HEIGHT = 0xBA
+CUES = 0x1C53BB6B
+CUE_POINT = 0xBB
+CUE_TIME = 0xB3
+CUE_TRACK_POSITIONS = 0xB7
+CUE_TRACK = 0xF7
+CUE_CLUSTER_POSITION = 0xF1
+CLUSTER = 0x1F43B675
+
+
+class ContainerError(ValueError):
+    """The file is not an MP4 or WebM/Matroska container this module can read"""
+
+
+class VideoIndex:
+    """Duration, codecs and keyframe table of one video file"""
+
+    __slots__ = ('container', 'duration', 'video_codec', 'audio_codec', 'width', 'height',
+                 'size', 'header', 'times', 'offsets')
+
+    def __init__(self, container, size, duration=None, video_codec=None, audio_codec=None,
+                 width=None, height=None, header=(), times=(), offsets=()):
+        self.container = container
+        self.size = size
+        self.duration = duration
+        self.video_codec = video_codec
+        self.audio_codec = audio_codec
+        self.width = width
+        self.height = height
+        self.header = [tuple(r) for r in header]  # (start, stop) ranges read before any media
+        self.times = list(times)  # keyframe times in milliseconds, ascending
+        self.offsets = list(offsets)  # byte offset to start reading at for each keyframe
+
+    @classmethod
+    def from_keyframes(cls, container, size, keyframes, **fields):
+        """Build an index from (seconds, offset) pairs, thinned to MAX_KEYFRAMES"""
+        keyframes = sorted(keyframes)
+        times = [round(seconds * 1000) for seconds, _ in keyframes]
+        kept = _thin(times)
+        return cls(container, size, times=[times[i] for i in kept],
+                   offsets=[keyframes[i][1] for i in kept], **fields)
+
+    def table_json(self):
+        """The ``media_index`` column value"""
+        return json.dumps({'size': self.size, 'header': self.header,
+                           't': _deltas(self.times), 'o': _deltas(self.offsets)},
+                          separators=(',', ':'))
+
+    @classmethod
+    def from_row(cls, row):
+        table = json.loads(row.media_index)
+        return cls(row.container, table['size'], row.duration, row.video_codec, row.audio_codec,
+                   row.width, row.height, table['header'],
+                   accumulate(table['t']), accumulate(table['o']))
+
+    def clamp(self, position):
+        """``position`` limited to the video's duration"""
+        position = max(position, 0.0)
+        return min(position, self.duration) if self.duration else position
+
+    def window(self, position, seconds, max_bytes):
+        """(start, stop) bytes from the keyframe at or before ``position`` to the one after ``seconds`` more"""
+        if not self.times:
+            return None
+        ms = position * 1000
+        first = max(bisect.bisect_right(self.times, ms) - 1, 0)
+        last = bisect.bisect_left(self.times, ms + seconds * 1000, first + 1)
+        start = self.offsets[first]
+        stop = self.offsets[last] if last < len(self.offsets) else self.size
+        if stop <= start:
+            stop = self.size
+        stop = min(stop, start + max_bytes, self.size)
+        return (start, stop) if stop > start else None
+
+    def prefetch(self, position, seconds, max_bytes, header=False):
+        """Byte ranges (inclusive ends, as in a Range header) to play ``seconds`` from ``position``"""
+        ranges = list(self.header) if header else []
+        window = self.window(position, seconds, max_bytes)
+        if window:
+            ranges.append(window)
+        ranges.sort()
+        merged = []
+        for start, stop in ranges:
+            if merged and start <= merged[-1][1] + MERGE_GAP:
+                merged[-1][1] = max(merged[-1][1], stop)
+            else:
+                merged.append([start, stop])
+        return [[start, stop - 1] for start, stop in merged]
+
+
+def _deltas(values):
+    return [value - previous for previous, value in zip([0] + values, values)]
+
+
+def _thin(times):
+    """Positions of at most about MAX_KEYFRAMES entries spread evenly over ``times``"""
+    if len(times) <= MAX_KEYFRAMES:
+        return range(len(times))
+    step = (times[-1] - times[0]) / MAX_KEYFRAMES
+    kept = []
+    mark = times[0]
+    for i, ms in enumerate(times):
+        if ms >= mark:
+            kept.append(i)
+            mark = ms + step
+    return kept
+
+
+def index_file(path):
+    """Index the MP4 or WebM/Matroska file at ``path``; raises ContainerError for anything else"""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        head = f.read(12)
+        try:
+            if head[:4] == struct.pack('>I', EBML):
+                return _index_matroska(f, size)
+            if head[4:8] in (b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide'):
+                return _index_mp4(f, size)
+        except ContainerError:
+            raise
+        except (struct.error, IndexError, UnicodeDecodeError, ValueError, OverflowError) as e:
+            raise ContainerError(f'Malformed container: {e}') from e
+    raise ContainerError('Not an MP4 or WebM/Matroska file')
+
+
+def _read(f, start, stop):
+    if stop - start > MAX_METADATA:
+        raise ContainerError('Metadata too large to index')
+    f.seek(start)
+    data = f.read(stop - start)
+    if len(data) != stop - start:
+        raise ContainerError('Truncated file')
+    return data
+
+
+# MP4 / MOV
+
+def _box_at(f, offset, stop):
+    """(type, payload start, end) of the box at file ``offset``"""
+    f.seek(offset)
+    head = f.read(16)
+    size, kind = struct.unpack_from('>I4s', head)
+    body = offset + 8
+    if size == 1:
+        size = struct.unpack_from('>Q', head, 8)[0]
+        body += 8
+    elif size == 0:
+        size = stop - offset
+    if size < body - offset:
+        raise ContainerError('Invalid box size')
+    return kind, body, min(offset + size, stop)
+
+
+def _boxes(data, start, stop):
+    """(type, payload start, end) of each box in ``data[start:stop]``"""
+    while start + 8 <= stop:
+        size, kind = struct.unpack_from('>I4s', data, start)
+        body = start + 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, body)[0]
+            body += 8
+        elif size == 0:
+            size = stop - start
+        if size < body - start or start + size > stop:
+            raise ContainerError(f'Truncated {kind!r} box')
+        yield kind, body, start + size
+        start += size
+
+
+def _child(data, start, stop, *path):
+    """(payload start, end) of the box at ``path`` below ``data[start:stop]``, or None"""
+    for kind in path:
+        for found, body, end in _boxes(data, start, stop):
+            if found == kind:
+                start, stop = body, end
+                break
+        else:
+            return None
+    return start, stop
+
+
+def _uints(data, start, stop, count, width=4):
+    """``count`` big-endian unsigned integers of ``width`` bytes in ``data[start:stop]``"""
+    end = start + count * width
+    if end > stop:
+        raise ContainerError('Sample table overruns its box')
+    values = array('I' if width == 4 else 'Q')
+    values.frombytes(data[start:end])
+    if sys.byteorder == 'little':
+        values.byteswap()
+    return values
+
+
+def _table(data, box, fields=1, width=4):
+    """Entries of a sample table box (entry count after version and flags, then the entries)"""
+    body, end = box
+    count = struct.unpack_from('>I', data, body + 4)[0]
+    return _uints(data, body + 8, end, count * fields, width)
+
+
+def _index_mp4(f, size):
+    movie = None
+    moov = mdat = None
+    fragments = []
+    offset = 0
+    while offset + 8 <= size:
+        kind, body, end = _box_at(f, offset, size)
+        if kind == b'moov' and movie is None:
+            data = _read(f, offset, end)
+            movie = _parse_moov(data, body - offset, end - offset)
+            moov = (offset, end)
+        elif kind == b'mdat' and mdat is None:
+            mdat = offset
+        elif kind == b'moof' and movie is not None and movie['video']:
+            seconds = _fragment_time(_read(f, offset, end), body - offset, end - offset,
+                                     movie['video'])
+            if seconds is not None:
+                fragments.append((seconds, offset))
+        offset = end
+    if movie is None:
+        raise ContainerError('No moov box')
+
+    # A player reads ftyp and moov first; when moov follows the media data that is two ranges
+    header = [(0, moov[1])] if mdat is None or moov[0] < mdat else [(0, mdat), moov]
+    video, audio = movie['video'], movie['audio']
+    keyframes = fragments or (_mp4_keyframes(video, size) if video else [])
+    return VideoIndex.from_keyframes(
+        'mp4', size, keyframes, duration=movie['duration'], header=header,
+        video_codec=video and video['codec'], audio_codec=audio and audio['codec'],
+        width=video and video['width'], height=video and video['height'])
+
+
+def _parse_moov(data, start, stop):
+    movie = {'duration': None, 'video': None, 'audio': None}
+    fragment_duration = None
+    timescale = 0
+    for kind, body, end in _boxes(data, start, stop):
+        if kind == b'mvhd':
+            if data[body] == 1:
+                timescale, duration = struct.unpack_from('>IQ', data, body + 20)
+            else:
+                timescale, duration = struct.unpack_from('>II', data, body + 12)
+            if timescale and duration and duration not in (0xFFFFFFFF, 0xFFFFFFFFFFFFFFFF):
+                movie['duration'] = duration / timescale
+        elif kind == b'mvex':
+            mehd = _child(data, body, end, b'mehd')
+            if mehd:
+                fmt = '>Q' if data[mehd[0]] == 1 else '>I'
+                fragment_duration = struct.unpack_from(fmt, data, mehd[0] + 4)[0]
+        elif kind == b'trak':
+            track = _parse_trak(data, body, end)
+            if track and movie[track['kind']] is None:
+                movie[track['kind']] = track
+    if not movie['duration'] and fragment_duration and timescale:
+        movie['duration'] = fragment_duration / timescale
+    return movie
+
+
+def _parse_trak(data, start, stop):
+    track = {}
+    tkhd = _child(data, start, stop, b'tkhd')
+    mdia = _child(data, start, stop, b'mdia')
+    if tkhd is None or mdia is None:
+        return None
+    id_at = tkhd[0] + (20 if data[tkhd[0]] == 1 else 12)
+    track['id'] = struct.unpack_from('>I', data, id_at)[0]
+
+    hdlr = _child(data, *mdia, b'hdlr')
+    mdhd = _child(data, *mdia, b'mdhd')
+    if hdlr is None or mdhd is None:
+        return None
+    handler = data[hdlr[0] + 8:hdlr[0] + 12]
+    track['kind'] = {b'vide': 'video', b'soun': 'audio'}.get(handler)
+    if track['kind'] is None:
+        return None
+    if data[mdhd[0]] == 1:
+        track['timescale'] = struct.unpack_from('>I', data, mdhd[0] + 20)[0]
+    else:
+        track['timescale'] = struct.unpack_from('>I', data, mdhd[0] + 12)[0]
+    if not track['timescale']:
+        return None
+
+    stbl = _child(data, *mdia, b'minf', b'stbl')
+    if stbl is None:
+        return None
+    track['codec'], track['width'], track['height'] = _sample_entry(data, stbl, track['kind'])
+    track['data'] = data
+    track['stbl'] = stbl
+    return track
+
+
+def _sample_entry(data, stbl, kind):
+    """(codec, width, height) from the first ``stsd`` entry"""
+    stsd = _child(data, *stbl, b'stsd')
+    if stsd is None or stsd[1] - stsd[0] < 16:
+        return None, None, None
+    entry_size, fourcc = struct.unpack_from('>I4s', data, stsd[0] + 8)
+    codec = fourcc.decode('latin-1').strip()
+    if kind != 'video':
+        return codec, None, None
+    entry = stsd[0] + 16  # after the entry header
+    width, height = struct.unpack_from('>HH', data, entry + 24)
+    # Visual sample entries end 78 bytes in; avcC follows with the profile and level
+    avcc = _child(data, entry + 78, min(stsd[0] + 8 + entry_size, stsd[1]), b'avcC')
+    if avcc and avcc[1] - avcc[0] >= 4:
+        codec += '.' + data[avcc[0] + 1:avcc[0] + 4].hex()
+    return codec, width, height
+
+
+def _mp4_keyframes(track, size):
+    """(seconds, byte offset) of every sync sample of a progressive track"""
+    data = track['data']
+    stbl = track['stbl']
+    tables = {kind: (body, end) for kind, body, end in _boxes(data, *stbl)}
+
+    sizes, constant_size, count = _sample_sizes(data, tables, size)
+    if not count or b'stts' not in tables or b'stsc' not in tables:
+        return []
+    if b'stss' in tables:
+        sync = [number - 1 for number in _table(data, tables[b'stss']) if 0 < number <= count]
+    else:
+        # Every sample is a sync sample; thin by position before decoding any times
+        sync = range(0, count, -(-count // MAX_KEYFRAMES))
+
+    times = _decode_times(_table(data, tables[b'stts'], fields=2), sync)
+    thinned = _thin(times)
+    kept = [sync[i] for i in thinned]
+    times = [times[i] for i in thinned]
+
+    if b'stco' in tables:
+        chunks = _table(data, tables[b'stco'])
+    elif b'co64' in tables:
+        chunks = _table(data, tables[b'co64'], width=8)
+    else:
+        return []
+    runs = _table(data, tables[b'stsc'], fields=3)
+    offsets = _sample_offsets(runs, chunks, sizes, constant_size, kept)
+
+    timescale = track['timescale']
+    return [(ticks / timescale, offset) for ticks, offset in zip(times, offsets)]
+
+
+def _sample_sizes(data, tables, size):
+    """(per-sample sizes or None, constant size, sample count) from stsz or stz2"""
+    if b'stsz' in tables:
+        body, end = tables[b'stsz']
+        constant_size, count = struct.unpack_from('>II', data, body + 4)
+        if constant_size:
+            # Nothing in the box backs the count, but the samples must fit in the file
+            if count > size // constant_size:
+                raise ContainerError('Sample count exceeds the file size')
+            return None, constant_size, count
+        return _uints(data, body + 12, end, count), 0, count
+    if b'stz2' in tables:
+        body, end = tables[b'stz2']
+        field_size = data[body + 7]
+        count = struct.unpack_from('>I', data, body + 8)[0]
+        if field_size not in (4, 8, 16):
+            raise ContainerError('Invalid stz2 field size')
+        table = body + 12
+        if table + (count * field_size + 7) // 8 > end:
+            raise ContainerError('Sample table overruns its box')
+        if field_size == 16:
+            sizes = array('H', data[table:table + 2 * count])
+            if sys.byteorder == 'little':
+                sizes.byteswap()
+        elif field_size == 8:
+            sizes = array('B', data[table:table + count])
+        else:
+            packed = data[table:table + (count + 1) // 2]
+            sizes = [nibble for byte in packed for nibble in (byte >> 4, byte & 15)][:count]
+        return sizes, 0, count
+    return None, 0, 0
+
+
+def _decode_times(pairs, samples):
+    """Decode time (in track ticks) of each of the ascending 0-based ``samples`` from stts"""
+    times = []
+    wanted = iter(samples)
+    sample = next(wanted, None)
+    first = ticks = 0
+    for i in range(0, len(pairs), 2):
+        count, delta = pairs[i], pairs[i + 1]
+        while sample is not None and sample < first + count:
+            times.append(ticks + (sample - first) * delta)
+            sample = next(wanted, None)
+        first += count
+        ticks += count * delta
+    return times
+
+
+def _sample_offsets(runs, chunks, sizes, constant_size, samples):
+    """File offset of each of the ascending 0-based ``samples`` from stsc, stco and stsz"""
+    offsets = []
+    wanted = iter(samples)
+    sample = next(wanted, None)
+    first_sample = 0
+    for i in range(0, len(runs), 3):
+        first_chunk, per_chunk = runs[i], runs[i + 1]
+        last_chunk = runs[i + 3] - 1 if i + 3 < len(runs) else len(chunks)
+        if not per_chunk or last_chunk < first_chunk:
+            continue
+        run_samples = (last_chunk - first_chunk + 1) * per_chunk
+        while sample is not None and sample < first_sample + run_samples:
+            local = sample - first_sample
+            within = local % per_chunk
+            chunk = first_chunk - 1 + local // per_chunk
+            if chunk >= len(chunks):
+                return offsets
+            if constant_size:
+                before = within * constant_size
+            else:
+                before = sum(sizes[sample - within:sample])
+            offsets.append(chunks[chunk] + before)
+            sample = next(wanted, None)
+        first_sample += run_samples
+    return offsets
+
+
+def _fragment_time(data, start, stop, video):
+    """Seconds at which the video track's samples in a moof begin, or None"""
+    for kind, body, end in _boxes(data, start, stop):
+        if kind != b'traf':
+            continue
+        tfhd = _child(data, body, end, b'tfhd')
+        tfdt = _child(data, body, end, b'tfdt')
+        if tfhd is None or tfdt is None or struct.unpack_from('>I', data, tfhd[0] + 4)[0] != video['id']:
+            continue
+        fmt = '>Q' if data[tfdt[0]] == 1 else '>I'
+        return struct.unpack_from(fmt, data, tfdt[0] + 4)[0] / video['timescale']
+    return None
+
+
+# WebM / Matroska
+
+def _ebml_header(data, pos):
+    """(element id, data start, data size or None when unknown) of the element at ``data[pos]``"""
+    first = data[pos]
+    id_length = 9 - first.bit_length()
+    if not first or id_length > 4:
+        raise ContainerError('Invalid element id')
+    element_id = int.from_bytes(data[pos:pos + id_length], 'big')
+    pos += id_length
+    first = data[pos]
+    size_length = 9 - first.bit_length()
+    if not first:
+        raise ContainerError('Invalid element size')
+    size = int.from_bytes(data[pos:pos + size_length], 'big') & ((1 << (7 * size_length)) - 1)
+    if size == (1 << (7 * size_length)) - 1:
+        size = None
+    if pos + size_length > len(data):
+        raise ContainerError('Truncated element')
+    return element_id, pos + size_length, size
+
+
+def _element_at(f, pos, stop):
+    """(element id, data start, end or None when unknown) of the element at file ``pos``"""
+    f.seek(pos)
+    head = f.read(12)
+    element_id, body, size = _ebml_header(head, 0)
+    body += pos
+    return element_id, body, None if size is None else min(body + size, stop)
+
+
+def _elements(data, start, stop):
+    while start < stop:
+        element_id, body, size = _ebml_header(data, start)
+        end = stop if size is None else body + size
+        if end > stop:
+            raise ContainerError('Truncated element')
+        yield element_id, body, end
+        start = end
+
+
+def _ebml_uint(data, start, stop):
+    return int.from_bytes(data[start:stop], 'big')
+
+
+def _index_matroska(f, size):
+    element_id, body, end = _element_at(f, 0, size)
+    if end is None:
+        raise ContainerError('Invalid EBML header')
+    header = _read(f, body, end)
+    doc_type = 'matroska'
+    for child, start, stop in _elements(header, 0, len(header)):
+        if child == DOC_TYPE:
+            doc_type = header[start:stop].rstrip(b'\0').decode('ascii')
+
+    element_id, segment, segment_end = _element_at(f, end, size)
+    if element_id != SEGMENT:
+        raise ContainerError('No Segment element')
+    segment_end = segment_end or size
+
+    found = {}  # element id -> (start, data start, end)
+    seek = {}
+    first_cluster = None
+    pos = segment
+    while pos < segment_end:
+        element_id, body, end = _element_at(f, pos, segment_end)
+        if element_id == CLUSTER:
+            if first_cluster is None:
+                first_cluster = pos
+            # Clusters are only stepped over while looking for cues nothing points to
+            if CUES in found or CUES in seek or end is None:
+                break
+        elif element_id in (SEEK_HEAD, INFO, TRACKS, CUES) and element_id not in found and end:
+            found[element_id] = (pos, body, end)
+            if element_id == SEEK_HEAD:
+                seek = _seek_positions(_read(f, body, end))
+        if end is None:
+            break
+        pos = end
+    for element_id, position in seek.items():
+        if element_id in (INFO, TRACKS, CUES) and element_id not in found:
+            element, body, end = _element_at(f, segment + position, segment_end)
+            if element == element_id and end:
+                found[element_id] = (segment + position, body, end)
+
+    scale = 1000000
+    duration = None
+    if INFO in found:
+        info = _read(f, *found[INFO][1:])
+        for child, start, stop in _elements(info, 0, len(info)):
+            if child == TIMECODE_SCALE:
+                scale = _ebml_uint(info, start, stop) or scale
+            elif child == DURATION and stop - start in (4, 8):
+                duration = struct.unpack('>f' if stop - start == 4 else '>d', info[start:stop])[0]
+        if duration:
+            duration = duration * scale / 1e9
+
+    video = audio = None
+    if TRACKS in found:
+        tracks = _read(f, *found[TRACKS][1:])
+        for child, start, stop in _elements(tracks, 0, len(tracks)):
+            if child == TRACK_ENTRY:
+                track = _matroska_track(tracks, start, stop)
+                if track['type'] == 1 and video is None:
+                    video = track
+                elif track['type'] == 2 and audio is None:
+                    audio = track
+
+    keyframes = []
+    # Everything before the first cluster (headers, and cues placed up front)
+    if first_cluster is None:
+        first_cluster = max((end for _, _, end in found.values()), default=0)
+    ranges = [(0, first_cluster)]
+    if CUES in found:
+        cues_start, body, end = found[CUES]
+        cues = _read(f, body, end)
+        keyframes = _matroska_cues(cues, segment, scale, video and video['number'])
+        if cues_start >= first_cluster:
+            ranges.append((cues_start, end))
+
+    return VideoIndex.from_keyframes(
+        doc_type, size, keyframes, duration=duration, header=[r for r in ranges if r[1] > r[0]],
+        video_codec=video and video['codec'], audio_codec=audio and audio['codec'],
+        width=video and video['width'], height=video and video['height'])
+
+
+def _seek_positions(data):
+    """Element id -> position relative to the segment data, from a SeekHead"""
+    positions = {}
+    for child, start, stop in _elements(data, 0, len(data)):
+        if child != SEEK:
+            continue
+        element_id = position = None
+        for field, body, end in _elements(data, start, stop):
+            if field == SEEK_ID:
+                element_id = _ebml_uint(data, body, end)
+            elif field == SEEK_POSITION:
+                position = _ebml_uint(data, body, end)
+        if element_id is not None and position is not None:
+            positions.setdefault(element_id, position)
+    return positions
+
+
+def _matroska_track(data, start, stop):
+    track = {'number': None, 'type': None, 'codec': None, 'width': None, 'height': None}
+    for child, body, end in _elements(data, start, stop):
+        if child == TRACK_NUMBER:
+            track['number'] = _ebml_uint(data, body, end)
+        elif child == TRACK_TYPE:
+            track['type'] = _ebml_uint(data, body, end)
+        elif child == CODEC_ID:
+            track['codec'] = data[body:end].rstrip(b'\0').decode('ascii')
+        elif child == VIDEO:
+            for field, field_start, field_end in _elements(data, body, end):
+                if field == PIXEL_WIDTH:
+                    track['width'] = _ebml_uint(data, field_start, field_end)
+                elif field == PIXEL_HEIGHT:
+                    track['height'] = _ebml_uint(data, field_start, field_end)
+    return track
+
+
+def _matroska_cues(data, segment, scale, video_track):
+    """(seconds, cluster offset) of each cue point, for the video track when there is one"""
+    keyframes = []
+    for child, start, stop in _elements(data, 0, len(data)):
+        if child != CUE_POINT:
+            continue
+        cue_time = None
+        position = None
+        for field, body, end in _elements(data, start, stop):
+            if field == CUE_TIME:
+                cue_time = _ebml_uint(data, body, end)
+            elif field == CUE_TRACK_POSITIONS and position is None:
+                track = cluster = None
+                for entry, entry_start, entry_end in _elements(data, body, end):
+                    if entry == CUE_TRACK:
+                        track = _ebml_uint(data, entry_start, entry_end)
+                    elif entry == CUE_CLUSTER_POSITION:
+                        cluster = _ebml_uint(data, entry_start, entry_end)
+                if cluster is not None and (video_track is None or track == video_track):
+                    position = cluster
+        if cue_time is not None and position is not None:
+            keyframes.append((cue_time * scale / 1e9, segment + position))
+    return keyframes
+
+
+class VideoIndexer:
+    """Process-wide index builder, with a cache of the indexes of recently played videos"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # sha256 -> (VideoIndex or None, monotonic expiry of a None)
+
+    def ensure(self, blob):
+        """Index ``blob``'s file unless that was done before (sets its columns, not committed)"""
+        if blob.indexed_at is not None:
+            return
+        started = time.perf_counter()
+        try:
+            index = index_file(video_store.path(blob))
+        except (OSError, ValueError, OverflowError) as e:
+            # Still marked as indexed: the same bytes would fail the same way again
+            logging.warning(f"Could not index video {blob.filename}: {e}")
+        else:
+            blob.container = index.container
+            blob.duration = index.duration
+            blob.video_codec = index.video_codec
+            blob.audio_codec = index.audio_codec
+            blob.width = index.width
+            blob.height = index.height
+            blob.media_index = index.table_json()
+            logging.info(f"Indexed video {blob.filename}: {len(index.times)} keyframes "
+                         f"in {(time.perf_counter() - started) * 1000:.0f}ms")
+        blob.indexed_at = datetime.now()
+
+    def schedule(self, blob):
+        """Index ``blob`` in a background task unless that was done before; call after committing it"""
+        if blob.indexed_at is None:
+            socketio.start_background_task(self._index_later, current_app._get_current_object(),
+                                           blob.id, blob.sha256)
+
+    def _index_later(self, app, blob_id, digest):
+        from models import VideoBlob
+
+        with app.app_context():
+            try:
+                blob = db.session.get(VideoBlob, blob_id)
+                if blob is not None:
+                    self.ensure(blob)
+                    db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logging.error(f"Indexing video blob {blob_id} failed: {e}")
+            finally:
+                db.session.remove()
+        # Announcements made meanwhile remembered the video as having no index
+        with self._lock:
+            self._cache.pop(digest, None)
+
+    def get(self, video_url):
+        """The index of an uploaded video by URL, or None (not an upload, or no index)"""
+        match = BLOB_URL.search(video_url or '')
+        if match is None:
+            return None
+        digest = match.group(1)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(digest)
+            if cached is not None and (cached[0] is not None or cached[1] > now):
+                self._cache.move_to_end(digest)
+                return cached[0]
+
+        from models import VideoBlob
+
+        row = db.session.execute(
+            select(VideoBlob.container, VideoBlob.duration, VideoBlob.video_codec,
+                   VideoBlob.audio_codec, VideoBlob.width, VideoBlob.height, VideoBlob.media_index)
+            .where(VideoBlob.sha256 == digest)).first()
+        index = VideoIndex.from_row(row) if row is not None and row.media_index else None
+        with self._lock:
+            self._cache[digest] = (index, now + MISSING_TTL)
+            self._cache.move_to_end(digest)
+            while len(self._cache) > CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return index
+
+    def clamp(self, video_url, position):
+        """``position`` limited to the duration of the video at ``video_url``, when it is known"""
+        index = self.get(video_url)
+        return index.clamp(position) if index is not None else position
+
+    def hints(self, video_url, position, header=False):
+        """``{'duration', 'prefetch'}`` for playing an uploaded video from ``position``, or None"""
+        index = self.get(video_url)
+        if index is None:
+            return None
+        config = current_app.config
+        seconds = config.get('VIDEO_PREFETCH_SECONDS', 0)
+        max_bytes = config.get('VIDEO_PREFETCH_MAX_MB', 0) * 2 ** 20
+        prefetch = index.prefetch(position, seconds, max_bytes, header) if seconds and max_bytes else []
+        return {'duration': index.duration, 'prefetch': prefetch}
+
+
+video_indexer = VideoIndexer()
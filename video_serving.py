@@ -0,0 +1,235 @@
+"""
+Serving uploaded videos.
+
+Uploaded files never change once published (new uploads are named by their
+SHA-256, older ones by their upload timestamp), so responses are cacheable
+for a year and marked immutable. The ETag of a content-addressed upload is
+its SHA-256, a strong validator that every worker computes alike and that
+survives the file being copied; older uploads use size + mtime.
+``If-None-Match`` / ``If-Modified-Since`` answer 304, ``If-Range`` falls back to the whole file
+when it no longer matches, and ``Range`` is answered with 206 for one range
+or ``multipart/byteranges`` for several (overlapping ranges are merged; more
+than ``MAX_RANGES`` get the whole file), 416 when nothing is satisfiable.
+
+Whole files and single ranges are handed to the server as a file object
+positioned at the first byte with an exact Content-Length, so gunicorn
+sends them with ``sendfile()`` without copying through Python. With
+``VIDEO_OFFLOAD`` set to ``x-accel`` (nginx) or ``x-sendfile`` (Apache,
+lighttpd) the worker only sends headers and the front server streams the
+file, ranges included.
+
+A transfer still holds a worker thread until the viewer has received it,
+so at most ``VIDEO_MAX_STREAMS`` run at once per process; past that viewers
+get 503 with ``Retry-After`` and the remaining threads stay free for the
+Socket.IO and room endpoints.
+"""
+
+import io
+import mimetypes
+import os
+import re
+import threading
+from datetime import datetime, timezone
+
+from flask import Response, abort, current_app, request
+from werkzeug.http import http_date, parse_date, quote_etag
+from werkzeug.security import safe_join
+from werkzeug.wsgi import wrap_file
+
+# More ranges than this in one request are answered with the whole file
+MAX_RANGES = 16
+
+# Bytes read per block when a multi-range body is built in Python
+READ_BLOCK = 256 * 1024
+
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Names of content-addressed uploads: the SHA-256 of the file and its extension
+BLOB_NAME = re.compile(r'([0-9a-f]{64})(?:\.\w+)?')
+
+
+class RangeFile(io.FileIO):
+    """A file opened at ``start`` that reads at most ``length`` bytes and frees its stream slot on close"""
+
+    def __init__(self, path, start, length, on_close):
+        super().__init__(path, 'rb')
+        self.seek(start)
+        self._remaining = length
+        self._on_close = on_close
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = super().read(size)
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            on_close, self._on_close = self._on_close, None
+            if on_close is not None:
+                on_close()
+
+
+class VideoServer:
+    """Process-wide video responder with a cap on concurrent transfers"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._slots = None
+
+    def send(self, directory, filename):
+        """Response for GET/HEAD of ``filename`` in ``directory``"""
+        path = safe_join(directory, filename)
+        if path is None:
+            abort(404)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            abort(404)
+        if not os.path.isfile(path):
+            abort(404)
+
+        size = stat.st_size
+        blob = BLOB_NAME.fullmatch(filename)
+        tag = blob.group(1) if blob else f'{size:x}-{stat.st_mtime_ns:x}'
+        etag = quote_etag(tag)
+        last_modified = datetime.fromtimestamp(int(stat.st_mtime), timezone.utc)
+        headers = {
+            'ETag': etag,
+            'Last-Modified': http_date(last_modified),
+            'Cache-Control': CACHE_CONTROL,
+            'Accept-Ranges': 'bytes',
+        }
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+        if self._not_modified(tag, last_modified):
+            return Response(status=304, headers=headers)
+
+        offload = current_app.config.get('VIDEO_OFFLOAD')
+        if offload == 'x-accel':
+            headers['X-Accel-Redirect'] = current_app.config['VIDEO_ACCEL_PREFIX'] + filename
+            return Response(mimetype=mimetype, headers=headers)
+        if offload == 'x-sendfile':
+            headers['X-Sendfile'] = os.path.abspath(path)
+            return Response(mimetype=mimetype, headers=headers)
+
+        if request.method == 'HEAD':
+            # Range only applies to GET; no file is opened and no stream slot is taken
+            headers['Content-Length'] = str(size)
+            return Response(mimetype=mimetype, headers=headers)
+
+        ranges = self._requested_ranges(size, etag, last_modified)
+        if ranges == []:
+            headers['Content-Range'] = f'bytes */{size}'
+            return Response(status=416, headers=headers)
+
+        release = self._acquire()
+        if release is None:
+            headers = {'Retry-After': '1', 'Cache-Control': 'no-store'}
+            return Response('Too many video streams, retry shortly', status=503, headers=headers)
+
+        try:
+            if ranges and len(ranges) > 1:
+                return self._multipart(path, size, ranges, mimetype, headers, release)
+            start, stop = ranges[0] if ranges else (0, size)
+            body = wrap_file(request.environ, RangeFile(path, start, stop - start, release))
+        except Exception:
+            release()
+            raise
+        headers['Content-Length'] = str(stop - start)
+        status = 200
+        if ranges:
+            headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+            status = 206
+        return Response(body, status=status, mimetype=mimetype, headers=headers,
+                        direct_passthrough=True)
+
+    @staticmethod
+    def _not_modified(tag, last_modified):
+        if request.if_none_match:
+            return request.if_none_match.contains_weak(tag)
+        since = request.if_modified_since
+        return since is not None and last_modified <= since
+
+    @staticmethod
+    def _requested_ranges(size, etag, last_modified):
+        """Sorted, merged (start, stop) byte ranges; None for the whole file, [] if unsatisfiable"""
+        if_range = request.headers.get('If-Range')
+        if if_range:
+            # Only a strong ETag or the exact Last-Modified date still matches
+            if if_range.startswith('"'):
+                if if_range != etag:
+                    return None
+            elif parse_date(if_range) != last_modified:
+                return None
+
+        requested = request.range
+        if requested is None or requested.units != 'bytes' or len(requested.ranges) > MAX_RANGES:
+            return None
+
+        ranges = []
+        for start, stop in requested.ranges:
+            if start < 0:
+                start, stop = max(size + start, 0), size
+            else:
+                stop = size if stop is None else min(stop, size)
+            if start < stop:
+                ranges.append((start, stop))
+        ranges.sort()
+
+        merged = []
+        for start, stop in ranges:
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+            else:
+                merged.append((start, stop))
+        return merged
+
+    @staticmethod
+    def _multipart(path, size, ranges, mimetype, headers, release):
+        boundary = os.urandom(12).hex()
+        parts = [(f'--{boundary}\r\nContent-Type: {mimetype}\r\n'
+                  f'Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n').encode()
+                 for start, stop in ranges]
+        closing = f'\r\n--{boundary}--\r\n'.encode()
+        length = sum(len(part) + stop - start for part, (start, stop) in zip(parts, ranges))
+        length += 2 * (len(ranges) - 1) + len(closing)
+
+        def generate():
+            with open(path, 'rb') as f:
+                for index, (part, (start, stop)) in enumerate(zip(parts, ranges)):
+                    yield (b'\r\n' if index else b'') + part
+                    f.seek(start)
+                    remaining = stop - start
+                    while remaining:
+                        block = f.read(min(READ_BLOCK, remaining))
+                        if not block:
+                            return
+                        remaining -= len(block)
+                        yield block
+            yield closing
+
+        headers['Content-Length'] = str(length)
+        response = Response(generate(), status=206, headers=headers,
+                            content_type=f'multipart/byteranges; boundary={boundary}')
+        response.call_on_close(release)
+        return response
+
+    def _acquire(self):
+        """Take a stream slot; returns the function that frees it, or None when all are busy"""
+        limit = current_app.config.get('VIDEO_MAX_STREAMS')
+        if not limit:
+            return lambda: None
+        if self._slots is None:
+            with self._lock:
+                if self._slots is None:
+                    self._slots = threading.BoundedSemaphore(limit)
+        if not self._slots.acquire(blocking=False):
+            return None
+        return self._slots.release
+
+
+video_server = VideoServer()
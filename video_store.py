@@ -0,0 +1,131 @@
+"""
+Content-addressed storage for uploaded videos.
+
+Every upload is hashed (SHA-256) while it is written (see
+:mod:`chunked_upload`) and stored once as ``UPLOAD_FOLDER/<sha256><ext>``,
+recorded in a ``VideoBlob`` row. Uploading the same bytes again, in any
+room and by any host, drops the new copy and points the new ``VideoFile``
+at the existing blob. ``VideoBlob.ref_count`` counts those rows; it is
+raised in the transaction that adds a ``VideoFile`` and lowered in the
+one that deletes it, so it stays exact without a ``COUNT(*)``.
+
+The reference is taken with ``UPDATE ... SET ref_count = ref_count + 1``
+on the blob row before anything else relies on it. If the storage sweeper
+deleted a released blob in the meantime the update matches nothing and the
+content is stored afresh; once it matches, the row lock (or SQLite's
+single writer) keeps the sweeper's ``DELETE ... WHERE ref_count <= 0``
+from taking it.
+
+A client that already knows the digest (the browser hashes files before
+uploading them) can :meth:`VideoStore.claim` it and skip the upload
+entirely when the blob exists with the same size.
+
+Uploads are checked against ``STORAGE_ROOM_QUOTA_MB`` and
+``STORAGE_USER_QUOTA_MB``. Usage is the total size of the videos a room
+holds or a user uploaded; a deduplicated upload counts like any other.
+
+Blob names never change content, which is what lets :mod:`video_serving`
+mark them immutable.
+"""
+
+import os
+
+from flask import current_app
+from sqlalchemy import case, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+
+
+class VideoStore:
+    """Process-wide access to stored video blobs"""
+
+    @staticmethod
+    def path(blob):
+        return os.path.join(current_app.config['UPLOAD_FOLDER'], blob.filename)
+
+    def claim(self, digest, size):
+        """Reference the stored blob with this content, or return None if it is unknown or missing on disk"""
+        from models import VideoBlob
+
+        blob = VideoBlob.query.filter_by(sha256=digest.lower()).first()
+        if blob is None or blob.size != size or not os.path.exists(self.path(blob)):
+            return None
+        if not self._add_reference(blob):
+            return None
+        return blob
+
+    def store(self, part_path, digest, original_filename):
+        """Take ownership of a complete part file and return its blob, referenced once more (not committed)"""
+        from models import VideoBlob
+
+        blob = VideoBlob.query.filter_by(sha256=digest).first()
+        if blob is not None and self._add_reference(blob):
+            if os.path.exists(self.path(blob)):
+                os.remove(part_path)
+            else:
+                # The row outlived its file; this upload restores it
+                os.replace(part_path, self.path(blob))
+            return blob
+
+        ext = os.path.splitext(original_filename)[1].lower()
+        blob = VideoBlob(sha256=digest, filename=digest + ext,
+                         size=os.path.getsize(part_path), ref_count=1)
+        os.replace(part_path, self.path(blob))
+        try:
+            with db.session.begin_nested():
+                db.session.add(blob)
+        except IntegrityError:
+            # Another upload of the same content got its row in first
+            blob = VideoBlob.query.filter_by(sha256=digest).one()
+            self._add_reference(blob)
+        return blob
+
+    @staticmethod
+    def _add_reference(blob):
+        """Count one more VideoFile for ``blob``; False if the row is gone"""
+        from models import VideoBlob
+
+        result = db.session.execute(update(VideoBlob).where(VideoBlob.id == blob.id)
+                                    .values(ref_count=VideoBlob.ref_count + 1)
+                                    .execution_options(synchronize_session=False))
+        return result.rowcount == 1
+
+    @staticmethod
+    def quota_error(room_id, user_id, size):
+        """Why an upload of ``size`` bytes would exceed the room or user quota, or None"""
+        from models import VideoFile
+
+        config = current_app.config
+        room_quota = config.get('STORAGE_ROOM_QUOTA_MB', 0) * 2 ** 20
+        user_quota = config.get('STORAGE_USER_QUOTA_MB', 0) * 2 ** 20
+        if not room_quota and not user_quota:
+            return None
+
+        room_used, user_used = db.session.execute(
+            select(func.coalesce(func.sum(case((VideoFile.room_id == room_id, VideoFile.file_size))), 0),
+                   func.coalesce(func.sum(case((VideoFile.uploaded_by == user_id, VideoFile.file_size))), 0))
+            .where(or_(VideoFile.room_id == room_id, VideoFile.uploaded_by == user_id))).one()
+        if room_quota and room_used + size > room_quota:
+            return (f'This room already holds {room_used / 2 ** 20:.0f} MB of videos '
+                    f'(limit {room_quota / 2 ** 20:.0f} MB)')
+        if user_quota and user_used + size > user_quota:
+            return (f'You have already uploaded {user_used / 2 ** 20:.0f} MB of videos '
+                    f'(limit {user_quota / 2 ** 20:.0f} MB)')
+        return None
+
+    @staticmethod
+    def drop_references(video_file_filter):
+        """Uncount the VideoFile rows matching ``video_file_filter``, before they are deleted"""
+        from models import VideoBlob, VideoFile
+
+        counts = db.session.execute(
+            select(VideoFile.blob_id, func.count(VideoFile.id))
+            .where(video_file_filter, VideoFile.blob_id.isnot(None))
+            .group_by(VideoFile.blob_id)).all()
+        for blob_id, count in counts:
+            db.session.execute(update(VideoBlob).where(VideoBlob.id == blob_id)
+                               .values(ref_count=VideoBlob.ref_count - count))
+
+
+video_store = VideoStore()